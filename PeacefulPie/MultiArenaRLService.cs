@@ -0,0 +1,90 @@
+using System.Collections.Generic;
+using System.Linq;
+using AustinHarris.JsonRpc;
+using UnityEngine;
+
+public interface IRLArena<TActions, TResult> {
+	// one independent copy of an environment, e.g. one DungeonEscape dungeon. A scene
+	// can contain several, side by side, all stepped by one MultiArenaRLService
+	void Step(TActions actions, float deltaTime);
+	TResult Reset();
+	TResult GetRLResult();
+}
+
+public abstract class MultiArenaRLService<TArena, TActions, TResult> : MonoBehaviour
+	where TArena : Component, IRLArena<TActions, TResult> {
+	// Steps every arena in the scene with a single json rpc call, so that one Unity
+	// process can serve K environments, using one round trip per step, rather than
+	// one Unity process, and one round trip, per environment. Use with
+	// peaceful_pie.vec_env.MultiArenaVecEnv.
+	//
+	// Unity cannot attach generic MonoBehaviours, so derive a concrete class, e.g.
+	// public class MyMultiArenaService : MultiArenaRLService<MyEnvController, List<PlayerAction>, RLResult> {}
+
+	[Tooltip("Number of extra simulation steps to run for each rlStepBatch.")]
+	public int FrameSkip = 4;
+
+	protected List<TArena> arenas = new List<TArena>();
+	List<Simulation> simulations = new List<Simulation>();
+	float simulationStepSize = 0.02f;
+	Rpc? rpc;
+
+	class Rpc : JsonRpcService {
+		MultiArenaRLService<TArena, TActions, TResult> service;
+		public Rpc(MultiArenaRLService<TArena, TActions, TResult> service) {
+			this.service = service;
+		}
+		[JsonRpcMethod]
+		int getNumArenas() {
+			return service.arenas.Count;
+		}
+		[JsonRpcMethod]
+		List<TResult> rlStepBatch(List<TActions> actions) {
+			return service.StepArenas(actions);
+		}
+		[JsonRpcMethod]
+		List<TResult> resetArenas(List<int> arenaIndices) {
+			return service.ResetArenas(arenaIndices);
+		}
+	}
+
+	protected virtual void Start() {
+		// sort by name, so that arena indices are the same on every run
+		arenas = FindObjectsOfType<TArena>().OrderBy(arena => arena.name).ToList();
+		simulations = FindObjectsOfType<Simulation>().ToList();
+		if(simulations.Count > 0) {
+			simulationStepSize = simulations[0].SimulationStepSize;
+		}
+		Debug.Log($"MultiArenaRLService found {arenas.Count} arenas");
+		rpc = new Rpc(this);
+	}
+
+	public List<TResult> StepArenas(List<TActions> actions) {
+		if(actions.Count != arenas.Count) {
+			throw new PeacefulPieException(
+				$"Got actions for {actions.Count} arenas, but there are {arenas.Count} arenas");
+		}
+		for(int i = 0; i < FrameSkip + 1; i++) {
+			for(int arenaIdx = 0; arenaIdx < arenas.Count; arenaIdx++) {
+				arenas[arenaIdx].Step(actions[arenaIdx], simulationStepSize);
+			}
+			Simulation.SimulateAll(simulations, simulationStepSize);
+		}
+		List<TResult> results = new List<TResult>(arenas.Count);
+		foreach(TArena arena in arenas) {
+			results.Add(arena.GetRLResult());
+		}
+		return results;
+	}
+
+	public List<TResult> ResetArenas(List<int> arenaIndices) {
+		List<TResult> results = new List<TResult>(arenaIndices.Count);
+		foreach(int arenaIdx in arenaIndices) {
+			if(arenaIdx < 0 || arenaIdx >= arenas.Count) {
+				throw new PeacefulPieException($"No arena with index {arenaIdx}");
+			}
+			results.Add(arenas[arenaIdx].Reset());
+		}
+		return results;
+	}
+}
@@ -1,12 +1,16 @@
 using System;
+using System.Diagnostics;
+using System.Globalization;
 using System.IO;
 using System.Net;
+using System.Net.Sockets;
 using System.Text;
 using System.Threading;
 using System.Collections.Concurrent;
 using System.Threading.Tasks;
 using AustinHarris.JsonRpc;
 using UnityEngine;
+using Debug = UnityEngine.Debug;
 
 class NetworkEvent {
 	// contains request from client, space for reply from server,
@@ -16,14 +20,31 @@ class NetworkEvent {
 	public string clientRequest;
 	public string? serverReply;
 	public AutoResetEvent serverReplied = new AutoResetEvent(false);
+	// Stopwatch timestamps, for the optional timing echo
+	public long enqueuedAt;
+	public long dequeuedAt;
+	public long repliedAt;
 	public NetworkEvent(string clientRequest) {
 		this.clientRequest = clientRequest;
+		this.enqueuedAt = Stopwatch.GetTimestamp();
 	}
 }
 
 
 
+public enum ListenMode {
+	// one http request per json rpc request. This is the default
+	Http,
+	// persistent tcp connections, each request and reply is a 4-byte big-endian length,
+	// followed by that many bytes of utf-8 json
+	Tcp
+}
+
 public class NetManager : MonoBehaviour {
+	[Tooltip("Http is the default. Tcp uses persistent connections with length-prefixed json frames, which " +
+		"has less overhead per request. Python UnityComms must use the same transport. Can be overridden " +
+		"with commandline '--transport [http|tcp]'")]
+	public ListenMode Mode = ListenMode.Http;
 	[Tooltip("Network port to listen on.")]
 	public int ListenPort = 9000;
 	[Tooltip("Network address to listen on. If not sure, put 'localhost'")]
@@ -34,12 +55,25 @@ public class NetManager : MonoBehaviour {
 	public int SleepAfterLogLineMilliseconds = 100;
 	[Tooltip("Ensure the application runs in background. If you set this to false, you might wonder why your python scripts appears to hang")]
 	public bool AutoEnableRunInBackground = true;
+	[Tooltip("Add a 'timing' field to each response, holding the milliseconds the request waited for FixedUpdate, " +
+		"the milliseconds spent processing it, including serializing the reply to json, and the milliseconds spent " +
+		"utf-8 encoding the reply. Python UnityComms strips this out, and records it in its metrics. Can also be " +
+		"turned on with commandline '--echo-timings', or from python with UnityComms.set_echo_timings")]
+	public bool EchoTimings = false;
+	[Tooltip("Maximum number of queued requests to process in each FixedUpdate. With 1, throughput is capped at " +
+		"one request per FixedDeltaTime, however many clients there are. 0 means no limit, in which case set " +
+		"TickBudgetMilliseconds. Can be overridden with commandline '--max-requests-per-tick [n]'")]
+	public int MaxRequestsPerTick = 1;
+	[Tooltip("Stop taking further queued requests in a FixedUpdate once this many milliseconds have been spent on " +
+		"requests. 0 means no budget. Can be overridden with commandline '--tick-budget-ms [milliseconds]'")]
+	public float TickBudgetMilliseconds = 0;
 
 	bool blockingListen = false;
 	bool isDedicated;
 	volatile bool isEnabled = true;
 
 	HttpListener? listener;
+	TcpListener? tcpListener;
 	BlockingCollection<NetworkEvent> networkEvents = new BlockingCollection<NetworkEvent>();
 
 	void MyDebug(string msg) {
@@ -72,6 +106,11 @@ public class NetManager : MonoBehaviour {
 			Debug.Log("after get current process . kill. hopefully we never get here :)");
 		}
 		[JsonRpcMethod]
+		private void setEchoTimings(bool echoTimings)
+		{
+			this.netManager.EchoTimings = echoTimings;
+		}
+		[JsonRpcMethod]
 		private void setBlockingListen(bool blocking)
 		{
 			// if blocking is true, then we listen for requests from python
@@ -114,13 +153,34 @@ public class NetManager : MonoBehaviour {
 			if(args[i] == "--port") {
 				ListenPort = int.Parse(args[i + 1]);
 				Debug.Log($"Using port {ListenPort}");
+			} else if(args[i] == "--transport") {
+				Mode = args[i + 1] == "tcp" ? ListenMode.Tcp : ListenMode.Http;
+				Debug.Log($"Using transport {Mode}");
+			} else if(args[i] == "--echo-timings") {
+				EchoTimings = true;
+				Debug.Log("Echoing server timings");
+			} else if(args[i] == "--max-requests-per-tick") {
+				MaxRequestsPerTick = int.Parse(args[i + 1]);
+				Debug.Log($"Processing up to {MaxRequestsPerTick} requests per tick");
+			} else if(args[i] == "--tick-budget-ms") {
+				TickBudgetMilliseconds = float.Parse(args[i + 1], CultureInfo.InvariantCulture);
+				Debug.Log($"Tick budget {TickBudgetMilliseconds} ms");
 			} else if(args[i] == "--help") {
-				Debug.Log("Specify port with '--port [port number]'");
+				Debug.Log("Specify port with '--port [port number]', and optionally transport with '--transport [http|tcp]'");
 				Application.Quit();
 				return;
 			}
 		}
 
+		if(Mode == ListenMode.Tcp) {
+			IPAddress address = ListenAddress == "localhost" ? IPAddress.Loopback : IPAddress.Parse(ListenAddress);
+			tcpListener = new TcpListener(address, ListenPort);
+			tcpListener.Start();
+			Task.Run(tcpAcceptLoop);
+			MyDebug($"Started tcp listener, on address {ListenAddress} port {ListenPort}");
+			return;
+		}
+
 		listener = new HttpListener();
 		listener.Prefixes.Add($"http://{ListenAddress}:{ListenPort}/");
 
@@ -132,6 +192,9 @@ public class NetManager : MonoBehaviour {
 	public void OnDisable() {
 		isEnabled = false;
 		Debug.Log("shutting down listener");
+		if(tcpListener != null) {
+			tcpListener.Stop();
+		}
 		if(listener is null) {
 			return;
 		}
@@ -140,20 +203,80 @@ public class NetManager : MonoBehaviour {
 		listener.Close();
 	}
 
+	void processNetworkEvent(NetworkEvent networkEvent) {
+		networkEvent.dequeuedAt = Stopwatch.GetTimestamp();
+		networkEvent.serverReply = JsonRpcProcessor.ProcessSync(
+			Handler.DefaultSessionId(), networkEvent.clientRequest, null);
+		networkEvent.repliedAt = Stopwatch.GetTimestamp();
+		networkEvent.serverReplied.Set();
+	}
+
+	bool canProcessMore(int numProcessed, long tickStart) {
+		if(MaxRequestsPerTick > 0 && numProcessed >= MaxRequestsPerTick) {
+			return false;
+		}
+		return TickBudgetMilliseconds <= 0 || ticksToMs(Stopwatch.GetTimestamp() - tickStart) < TickBudgetMilliseconds;
+	}
+
 	void FixedUpdate() {
-		int numIts = 0;
-		// while (
-		// 	(networkEvents.Count > 0 && numIts == 0)
-		// 	|| (blockingListen && numIts < 10)
-		// 	|| (isDedicated && numIts == 0)
-		// ) {
-		if(networkEvents.Count > 0 || blockingListen || isDedicated) {
-			NetworkEvent networkEvent = networkEvents.Take();
-			networkEvent.serverReply = JsonRpcProcessor.ProcessSync(
-				Handler.DefaultSessionId(), networkEvent.clientRequest, null);
-			networkEvent.serverReplied.Set();
-			numIts += 1;
+		if(networkEvents.Count == 0 && !blockingListen && !isDedicated) {
+			return;
 		}
+		// with blocking listen, or on a dedicated server, we wait for the first request, as before.
+		// Any further requests are only taken if already queued, so we never block for them
+		long tickStart = Stopwatch.GetTimestamp();
+		processNetworkEvent(networkEvents.Take());
+		int numProcessed = 1;
+		while(canProcessMore(numProcessed, tickStart) && networkEvents.TryTake(out NetworkEvent networkEvent)) {
+			processNetworkEvent(networkEvent);
+			numProcessed += 1;
+		}
+	}
+
+	static double ticksToMs(long ticks) {
+		return ticks * 1000.0 / Stopwatch.Frequency;
+	}
+
+	NetworkEvent enqueueRequest(string request) {
+		// queues the request for FixedUpdate. See awaitReply
+		NetworkEvent networkEvent = new NetworkEvent(request);
+		networkEvents.Add(networkEvent);
+		return networkEvent;
+	}
+
+	byte[] processOnMainThread(string request) {
+		return awaitReply(enqueueRequest(request));
+	}
+
+	byte[] awaitReply(NetworkEvent networkEvent) {
+		// returns the utf-8 reply, with the timing field added if EchoTimings
+		networkEvent.serverReplied.WaitOne();
+		string reply = networkEvent.serverReply ?? "";
+		if(!EchoTimings) {
+			return Encoding.UTF8.GetBytes(reply);
+		}
+		// the timing goes inside the reply object, or, for a batch, inside its last reply object
+		int insertAt = reply.EndsWith("}]") ? reply.Length - 2 : reply.EndsWith("}") ? reply.Length - 1 : -1;
+		if(insertAt < 0) {
+			return Encoding.UTF8.GetBytes(reply);
+		}
+		// JsonRpcProcessor runs the handler and serializes its result in one call, so handler_ms
+		// includes the json serialization. encode_ms is only the utf-8 encoding of the reply
+		long encodeStart = Stopwatch.GetTimestamp();
+		byte[] head = Encoding.UTF8.GetBytes(reply.Substring(0, insertAt));
+		double encodeMs = ticksToMs(Stopwatch.GetTimestamp() - encodeStart);
+		string timing = string.Format(
+			CultureInfo.InvariantCulture,
+			",\"timing\":{{\"queue_wait_ms\":{0:R},\"handler_ms\":{1:R},\"encode_ms\":{2:R}}}{3}",
+			ticksToMs(networkEvent.dequeuedAt - networkEvent.enqueuedAt),
+			ticksToMs(networkEvent.repliedAt - networkEvent.dequeuedAt),
+			encodeMs,
+			reply.Substring(insertAt));
+		byte[] tail = Encoding.UTF8.GetBytes(timing);
+		byte[] res = new byte[head.Length + tail.Length];
+		Buffer.BlockCopy(head, 0, res, 0, head.Length);
+		Buffer.BlockCopy(tail, 0, res, head.Length, tail.Length);
+		return res;
 	}
 
 	void handleRequest(HttpListenerContext context) {
@@ -164,15 +287,11 @@ public class NetManager : MonoBehaviour {
 			bodyText = reader.ReadToEnd();
 		}
 
-		NetworkEvent networkEvent = new NetworkEvent(bodyText);
-		networkEvents.Add(networkEvent);
-		networkEvent.serverReplied.WaitOne();
-		string? res = networkEvent.serverReply;
+		byte[] buffer = processOnMainThread(bodyText);
 
 		using HttpListenerResponse resp = context.Response;
 		resp.Headers.Set("Content-Type", "application/json");
 
-		byte[] buffer = Encoding.UTF8.GetBytes(res);
 		resp.ContentLength64 = buffer.Length;
 
 		using Stream ros = resp.OutputStream;
@@ -195,6 +314,92 @@ public class NetManager : MonoBehaviour {
 		handleRequest(context);
 	}
 
+	static void readExactly(NetworkStream stream, byte[] buffer, int numBytes) {
+		int received = 0;
+		while(received < numBytes) {
+			int n = stream.Read(buffer, received, numBytes - received);
+			if(n == 0) {
+				throw new EndOfStreamException("Connection closed by client");
+			}
+			received += n;
+		}
+	}
+
+	static int readFrameLength(NetworkStream stream, byte[] header) {
+		readExactly(stream, header, 4);
+		return (header[0] << 24) | (header[1] << 16) | (header[2] << 8) | header[3];
+	}
+
+	void handleTcpClient(TcpClient client) {
+		// serves length-prefixed frames from one client, until it disconnects. Each request is
+		// queued as soon as it arrives, so a client can have several requests in flight, which
+		// FixedUpdate can then process in the same tick. writeTcpReplies sends the replies back
+		// in the order the requests arrived
+		using(client) {
+			client.NoDelay = true;
+			NetworkStream stream = client.GetStream();
+			byte[] header = new byte[4];
+			BlockingCollection<NetworkEvent> inFlight = new BlockingCollection<NetworkEvent>();
+			Task writer = Task.Run(() => writeTcpReplies(stream, inFlight));
+			try {
+				while(isEnabled) {
+					int length = readFrameLength(stream, header);
+					byte[] body = new byte[length];
+					readExactly(stream, body, length);
+					inFlight.Add(enqueueRequest(Encoding.UTF8.GetString(body)));
+				}
+			} catch(EndOfStreamException) {
+				MyDebug("tcp client disconnected");
+			} catch(IOException e) {
+				MyDebug($"IOException in tcp client {e}");
+			} finally {
+				inFlight.CompleteAdding();
+				writer.Wait();
+			}
+		}
+	}
+
+	void writeTcpReplies(NetworkStream stream, BlockingCollection<NetworkEvent> inFlight) {
+		try {
+			foreach(NetworkEvent networkEvent in inFlight.GetConsumingEnumerable()) {
+				byte[] resBody = awaitReply(networkEvent);
+				byte[] frame = new byte[4 + resBody.Length];
+				frame[0] = (byte)(resBody.Length >> 24);
+				frame[1] = (byte)(resBody.Length >> 16);
+				frame[2] = (byte)(resBody.Length >> 8);
+				frame[3] = (byte)resBody.Length;
+				Buffer.BlockCopy(resBody, 0, frame, 4, resBody.Length);
+				stream.Write(frame, 0, frame.Length);
+			}
+		} catch(IOException e) {
+			MyDebug($"IOException writing to tcp client {e}");
+		} catch(ObjectDisposedException) {
+			MyDebug("tcp client closed before all replies were sent");
+		}
+	}
+
+	void tcpAcceptLoop() {
+		if (LogFilepath != null && LogFilepath != "")
+		{
+			File.OpenWrite(LogFilepath).Close();
+		}
+		while(isEnabled && tcpListener != null) {
+			try {
+				TcpClient client = tcpListener.AcceptTcpClient();
+				Task.Run(() => handleTcpClient(client));
+			} catch(SocketException e) {
+				if(!isEnabled) {
+					break;
+				}
+				MyDebug($"SocketException caught in tcp listener {e}");
+			} catch(ObjectDisposedException) {
+				MyDebug("tcp listener disposed");
+				break;
+			}
+		}
+		MyDebug("TcpAcceptLoop shut down.");
+	}
+
 	void listenLoop() {
 		if (LogFilepath != null && LogFilepath != "")
 		{
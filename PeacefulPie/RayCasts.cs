@@ -17,6 +17,77 @@ public class RayResults {
 	}
 }
 
+public class EncodedArray {
+	// a dense array, sent as base64 of its little-endian buffer, which
+	// python decodes straight into a numpy array, see peaceful_pie.ndarray_codec
+	public string dtype;
+	public List<int> shape;
+	public string data;
+	public EncodedArray(string dtype, List<int> shape, string data) {
+		this.dtype = dtype;
+		this.shape = shape;
+		this.data = data;
+	}
+	public static EncodedArray FromFloats(float[] values, List<int> shape) {
+		byte[] bytes = new byte[values.Length * sizeof(float)];
+		Buffer.BlockCopy(values, 0, bytes, 0, bytes.Length);
+		return new EncodedArray("<f4", shape, Convert.ToBase64String(toLittleEndian(bytes, sizeof(float))));
+	}
+	public static EncodedArray FromInts(int[] values, List<int> shape) {
+		byte[] bytes = new byte[values.Length * sizeof(int)];
+		Buffer.BlockCopy(values, 0, bytes, 0, bytes.Length);
+		return new EncodedArray("<i4", shape, Convert.ToBase64String(toLittleEndian(bytes, sizeof(int))));
+	}
+	public static EncodedArray FromShorts(short[] values, List<int> shape) {
+		byte[] bytes = new byte[values.Length * sizeof(short)];
+		Buffer.BlockCopy(values, 0, bytes, 0, bytes.Length);
+		return new EncodedArray("<i2", shape, Convert.ToBase64String(toLittleEndian(bytes, sizeof(short))));
+	}
+	static byte[] toLittleEndian(byte[] bytes, int itemSize) {
+		if(!BitConverter.IsLittleEndian) {
+			for(int i = 0; i < bytes.Length; i += itemSize) {
+				Array.Reverse(bytes, i, itemSize);
+			}
+		}
+		return bytes;
+	}
+}
+
+public class EncodedRayResults {
+	// same as RayResults, but much more compact to send, and faster to decode
+	// on the python side. Use with peaceful_pie.ray_results_helper.EncodedRayResults
+	public EncodedArray rayDistances;
+	public EncodedArray rayHitObjectTypes;
+	public int NumObjectTypes;
+	public EncodedRayResults(
+	    EncodedArray rayDistances,
+	    EncodedArray rayHitObjectTypes,
+	    int NumObjectTypes
+	) {
+		this.rayDistances = rayDistances;
+		this.rayHitObjectTypes = rayHitObjectTypes;
+		this.NumObjectTypes = NumObjectTypes;
+	}
+}
+
+public class DeltaRayResults {
+	// the rays which changed since the previous DeltaRayResults from the same RayCasts,
+	// with a keyframe holding every ray, now and again. Use with
+	// peaceful_pie.ray_results_helper.DeltaRayResults and RayDeltaState
+	public bool isKeyframe;
+	public int sequence;
+	public int XResolution;
+	public int YResolution;
+	public int NumObjectTypes;
+	// keyframes only
+	public EncodedArray? rayDistances;
+	public EncodedArray? rayHitObjectTypes;
+	// deltas only. changedIdxs index [x_idx * YResolution + y_idx]
+	public EncodedArray? changedIdxs;
+	public EncodedArray? changedDistances;
+	public EncodedArray? changedHitObjectTypes;
+}
+
 public class RayCasts : MonoBehaviour {
 	[Tooltip("Consider the rays form a low-resolution image. This is the x-resolution of that image.")]
 	[Range(1, 100)]
@@ -34,11 +105,21 @@ public class RayCasts : MonoBehaviour {
 	public int RayLength = 40;
 	[Tooltip("Ray radius. 0 means RayCast, >0 is SphereCast")]
 	public float RayRadius = 0;
+	[Tooltip("GetDeltaObservation sends every ray, rather than only those which changed, once every this many observations")]
+	public int DeltaKeyframeInterval = 100;
+	[Tooltip("GetDeltaObservation sends rays whose object type changed, or whose distance changed by more than this")]
+	public float DeltaDistanceThreshold = 0.01f;
 	public bool ShowRaysInEditor = true;
 	public bool ShowRaysInPlayer = false;
 	[Tooltip("Mandatory field: list here the tags you want to detect. Each will be given it's own output feature plane.")]
 	public List<string> DetectableTags = new List<string>();
 
+	// what GetDeltaObservation last sent, for each ray. null means the next one is a keyframe
+	float[]? sentDistances;
+	short[]? sentHitObjectTypes;
+	int deltaSequence = 0;
+	int framesSinceKeyframe = 0;
+
 	class Ray {
 		public Vector3 direction;
 		public Ray(Vector3 direction) {
@@ -105,65 +186,169 @@ public class RayCasts : MonoBehaviour {
 		}
 	}
 
-	public RayResults GetZerodObservation() {
-		// for use if agent is dead, for example
+	void checkDetectableTags() {
 		if(DetectableTags.Count == 0) {
 			throw new PeacefulPieException("You must provide at least one detectabletag when using RayCasts");
 		}
-		List<List<float>> rayDistances = new List<List<float>>();
-		List<List<int>> rayHitObjectTypes = new List<List<int>>();
-		int NumObjectTypes = DetectableTags.Count;
-		for(int x_idx = 0; x_idx < XResolution; x_idx++) {
-			rayDistances.Add(new List<float>());
-			rayHitObjectTypes.Add(new List<int>());
-			for(int y_idx = 0; y_idx < YResolution; y_idx++) {
-				rayDistances[x_idx].Add(-1);
-				rayHitObjectTypes[x_idx].Add(-1);
-			}
-		}
-		return new RayResults(
-		    rayDistances,
-		    rayHitObjectTypes,
-		    NumObjectTypes
-		);
 	}
 
-	public RayResults GetObservation() {
-		if(DetectableTags.Count == 0) {
-			throw new PeacefulPieException("You must provide at least one detectabletag when using RayCasts");
-		}
-		List<List<float>> rayDistances = new List<List<float>>();
-		List<List<int>> rayHitObjectTypes = new List<List<int>>();
+	void castRays(float[] rayDistances, short[] rayHitObjectTypes) {
+		// fills rayDistances and rayHitObjectTypes, indexed by [x_idx * YResolution + y_idx]
 		Dictionary<string, int> tagIdxByName = new Dictionary<string, int>();
 		for(int i = 0; i < DetectableTags.Count; i++) {
 			tagIdxByName[DetectableTags[i]] = i;
 		}
-		int NumObjectTypes = DetectableTags.Count;
 		for(int x_idx = 0; x_idx < XResolution; x_idx++) {
-			rayDistances.Add(new List<float>());
-			rayHitObjectTypes.Add(new List<int>());
 			for(int y_idx = 0; y_idx < YResolution; y_idx++) {
+				int idx = x_idx * YResolution + y_idx;
+				rayDistances[idx] = -1;
+				rayHitObjectTypes[idx] = -1;
 				Vector3 vec = RayDirection(x_idx, y_idx);
 				RaycastHit hit;
 				if(SingleCast(vec, out hit)) {
 					string tag = hit.collider.gameObject.tag;
 					if(tagIdxByName.ContainsKey(tag)) {
-						rayDistances[x_idx].Add(hit.distance);
-						rayHitObjectTypes[x_idx].Add(tagIdxByName[tag]);
-					} else {
-						rayDistances[x_idx].Add(-1);
-						rayHitObjectTypes[x_idx].Add(-1);
+						rayDistances[idx] = hit.distance;
+						rayHitObjectTypes[idx] = (short)tagIdxByName[tag];
 					}
-				} else {
-					rayDistances[x_idx].Add(-1);
-					rayHitObjectTypes[x_idx].Add(-1);
 				}
 			}
 		}
+	}
+
+	RayResults toRayResults(float[] flatDistances, short[] flatHitObjectTypes) {
+		List<List<float>> rayDistances = new List<List<float>>();
+		List<List<int>> rayHitObjectTypes = new List<List<int>>();
+		for(int x_idx = 0; x_idx < XResolution; x_idx++) {
+			rayDistances.Add(new List<float>());
+			rayHitObjectTypes.Add(new List<int>());
+			for(int y_idx = 0; y_idx < YResolution; y_idx++) {
+				rayDistances[x_idx].Add(flatDistances[x_idx * YResolution + y_idx]);
+				rayHitObjectTypes[x_idx].Add(flatHitObjectTypes[x_idx * YResolution + y_idx]);
+			}
+		}
 		return new RayResults(
 		    rayDistances,
 		    rayHitObjectTypes,
-		    NumObjectTypes
+		    DetectableTags.Count
+		);
+	}
+
+	EncodedRayResults toEncodedRayResults(float[] flatDistances, short[] flatHitObjectTypes) {
+		List<int> shape = new List<int> { XResolution, YResolution };
+		return new EncodedRayResults(
+		    EncodedArray.FromFloats(flatDistances, shape),
+		    EncodedArray.FromShorts(flatHitObjectTypes, shape),
+		    DetectableTags.Count
 		);
 	}
+
+	void fillZeros(float[] rayDistances, short[] rayHitObjectTypes) {
+		for(int i = 0; i < rayDistances.Length; i++) {
+			rayDistances[i] = -1;
+			rayHitObjectTypes[i] = -1;
+		}
+	}
+
+	public RayResults GetZerodObservation() {
+		// for use if agent is dead, for example
+		checkDetectableTags();
+		float[] rayDistances = new float[XResolution * YResolution];
+		short[] rayHitObjectTypes = new short[XResolution * YResolution];
+		fillZeros(rayDistances, rayHitObjectTypes);
+		return toRayResults(rayDistances, rayHitObjectTypes);
+	}
+
+	public RayResults GetObservation() {
+		checkDetectableTags();
+		float[] rayDistances = new float[XResolution * YResolution];
+		short[] rayHitObjectTypes = new short[XResolution * YResolution];
+		castRays(rayDistances, rayHitObjectTypes);
+		return toRayResults(rayDistances, rayHitObjectTypes);
+	}
+
+	public EncodedRayResults GetEncodedZerodObservation() {
+		// for use if agent is dead, for example
+		checkDetectableTags();
+		float[] rayDistances = new float[XResolution * YResolution];
+		short[] rayHitObjectTypes = new short[XResolution * YResolution];
+		fillZeros(rayDistances, rayHitObjectTypes);
+		return toEncodedRayResults(rayDistances, rayHitObjectTypes);
+	}
+
+	public EncodedRayResults GetEncodedObservation() {
+		// same as GetObservation, but encoded compactly, see EncodedRayResults
+		checkDetectableTags();
+		float[] rayDistances = new float[XResolution * YResolution];
+		short[] rayHitObjectTypes = new short[XResolution * YResolution];
+		castRays(rayDistances, rayHitObjectTypes);
+		return toEncodedRayResults(rayDistances, rayHitObjectTypes);
+	}
+
+	DeltaRayResults toDeltaRayResults(float[] flatDistances, short[] flatHitObjectTypes) {
+		DeltaRayResults delta = new DeltaRayResults();
+		delta.sequence = deltaSequence++;
+		delta.XResolution = XResolution;
+		delta.YResolution = YResolution;
+		delta.NumObjectTypes = DetectableTags.Count;
+		if(sentDistances == null || sentHitObjectTypes == null
+		        || sentDistances.Length != flatDistances.Length
+		        || framesSinceKeyframe + 1 >= DeltaKeyframeInterval) {
+			sentDistances = (float[])flatDistances.Clone();
+			sentHitObjectTypes = (short[])flatHitObjectTypes.Clone();
+			framesSinceKeyframe = 0;
+			List<int> shape = new List<int> { XResolution, YResolution };
+			delta.isKeyframe = true;
+			delta.rayDistances = EncodedArray.FromFloats(flatDistances, shape);
+			delta.rayHitObjectTypes = EncodedArray.FromShorts(flatHitObjectTypes, shape);
+			return delta;
+		}
+		framesSinceKeyframe++;
+		List<int> changedIdxs = new List<int>();
+		for(int i = 0; i < flatDistances.Length; i++) {
+			if(flatHitObjectTypes[i] != sentHitObjectTypes[i]
+			        || Math.Abs(flatDistances[i] - sentDistances[i]) > DeltaDistanceThreshold) {
+				changedIdxs.Add(i);
+			}
+		}
+		float[] changedDistances = new float[changedIdxs.Count];
+		short[] changedHitObjectTypes = new short[changedIdxs.Count];
+		for(int j = 0; j < changedIdxs.Count; j++) {
+			int i = changedIdxs[j];
+			sentDistances[i] = flatDistances[i];
+			sentHitObjectTypes[i] = flatHitObjectTypes[i];
+			changedDistances[j] = flatDistances[i];
+			changedHitObjectTypes[j] = flatHitObjectTypes[i];
+		}
+		List<int> changedShape = new List<int> { changedIdxs.Count };
+		delta.changedIdxs = EncodedArray.FromInts(changedIdxs.ToArray(), changedShape);
+		delta.changedDistances = EncodedArray.FromFloats(changedDistances, changedShape);
+		delta.changedHitObjectTypes = EncodedArray.FromShorts(changedHitObjectTypes, changedShape);
+		return delta;
+	}
+
+	public void ResetDelta() {
+		// makes the next GetDeltaObservation a keyframe, e.g. on reset, or if python lost track
+		sentDistances = null;
+		sentHitObjectTypes = null;
+	}
+
+	public DeltaRayResults GetDeltaZerodObservation() {
+		// for use if agent is dead, for example
+		checkDetectableTags();
+		float[] rayDistances = new float[XResolution * YResolution];
+		short[] rayHitObjectTypes = new short[XResolution * YResolution];
+		fillZeros(rayDistances, rayHitObjectTypes);
+		return toDeltaRayResults(rayDistances, rayHitObjectTypes);
+	}
+
+	public DeltaRayResults GetDeltaObservation() {
+		// same as GetObservation, but sends only the rays which changed since the previous
+		// call, see DeltaRayResults
+		checkDetectableTags();
+		float[] rayDistances = new float[XResolution * YResolution];
+		short[] rayHitObjectTypes = new short[XResolution * YResolution];
+		castRays(rayDistances, rayHitObjectTypes);
+		return toDeltaRayResults(rayDistances, rayHitObjectTypes);
+	}
 }
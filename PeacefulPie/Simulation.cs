@@ -130,4 +130,16 @@ public class Simulation : MonoBehaviour {
 			Physics.Simulate(deltaTime);
 		}
 	}
+
+	public static void SimulateAll(IEnumerable<Simulation> simulations, float deltaTime) {
+		// for scenes with several arenas, each with its own Simulation. Physics is
+		// shared by the whole scene, so we must only step it once, not once per arena
+		foreach(Simulation simulation in simulations) {
+			simulation.RunFixedUpdates(deltaTime);
+			simulation.RunUpdates(deltaTime);
+		}
+		if(!Physics.autoSimulation) {
+			Physics.Simulate(deltaTime);
+		}
+	}
 }
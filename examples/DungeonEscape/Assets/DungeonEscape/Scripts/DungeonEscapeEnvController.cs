@@ -10,7 +10,7 @@ public interface IAgent
     void ApplyAction(PlayerAction action, float deltaTime);
 }
 
-public class DungeonEscapeEnvController : MonoBehaviour, INeedFixedUpdate
+public class DungeonEscapeEnvController : MonoBehaviour, INeedFixedUpdate, IRLArena<List<PlayerAction>, RLResult>
 {
     [System.Serializable]
     public class PlayerInfo
@@ -0,0 +1,9 @@
+using System.Collections.Generic;
+
+// Add to a single GameObject, in a scene containing several DungeonEscape arenas, to step
+// them all with one rlStepBatch call. Arenas in such a scene should not also have an
+// RLRpcService, since each RLRpcService registers its own rlStep and reset methods.
+// See my_multi_arena_vec_env.py for the python side.
+public class DungeonEscapeMultiArenaService : MultiArenaRLService<DungeonEscapeEnvController, List<PlayerAction>, RLResult>
+{
+}
@@ -0,0 +1,128 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from my_unity_env import MyUnityEnv
+from numpy.typing import NDArray
+
+
+class BatchInferenceRunner:
+    """
+    Runs one policy over many MyUnityEnvs, e.g. one per Unity server, from a single process.
+    Each tick runs one batched predict over every env's observation, then sends each env its
+    actions concurrently, so that the Unity servers simulate in parallel, e.g.
+
+    runner = BatchInferenceRunner(envs, predict=lambda obs: ppo.predict(obs)[0])
+    runner.run()
+
+    With tick_seconds, ticks are paced in real time, e.g. for demos. Without, we run as fast as
+    the servers and the policy allow, e.g. for evaluations.
+    """
+
+    def __init__(
+        self,
+        envs: Sequence[MyUnityEnv],
+        predict: Callable[[NDArray[np.float32]], NDArray],
+        frame_skip: int = 0,
+        max_episode_steps: Optional[int] = None,
+        tick_seconds: Optional[float] = None,
+    ) -> None:
+        """
+        :param envs: Sequence[MyUnityEnv] All with the same observation space
+        :param predict: Callable[[NDArray[np.float32]], NDArray] Takes observations of shape
+            (len(envs), *obs_shape), and returns actions of shape (len(envs), num_actions)
+        :param frame_skip: int Each action is repeated for frame_skip further steps
+        :param max_episode_steps: Optional[int] Reset an env once its episode reaches this many
+            ticks
+        :param tick_seconds: Optional[float] Pace ticks at this interval. None runs flat out
+        """
+        self.envs = list(envs)
+        self.predict = predict
+        self.frame_skip = frame_skip
+        self.max_episode_steps = max_episode_steps
+        self.tick_seconds = tick_seconds
+        obs_shape = self.envs[0].observation_space.shape
+        assert obs_shape is not None
+        # row i holds the latest observation of env i, and is what we pass to predict
+        self.obs = np.zeros((len(self.envs), *obs_shape), dtype=np.float32)
+        self.episode_steps = [0] * len(self.envs)
+        self.num_ticks = 0
+        self.num_steps = 0
+        self.num_episodes = 0
+        self._executor = ThreadPoolExecutor(
+            max_workers=len(self.envs), thread_name_prefix="BatchInferenceRunner"
+        )
+
+    def _reset_env(self, env_idx: int) -> None:
+        self.obs[env_idx] = self.envs[env_idx].reset()
+        self.episode_steps[env_idx] = 0
+
+    def _step_env(self, env_idx: int, actions: List[int]) -> Tuple[int, bool]:
+        """
+        Steps env env_idx frame_skip + 1 times, or until its episode ends
+
+        :return: Tuple[int, bool] how many steps we took, and whether the episode ended
+        """
+        env = self.envs[env_idx]
+        self.episode_steps[env_idx] += 1
+        for num_steps in range(1, self.frame_skip + 2):
+            obs, _, done, _ = env.step(actions)
+            if done or (
+                self.max_episode_steps is not None
+                and self.episode_steps[env_idx] >= self.max_episode_steps
+            ):
+                self._reset_env(env_idx)
+                return num_steps, True
+        self.obs[env_idx] = obs
+        return self.frame_skip + 1, False
+
+    def reset(self) -> NDArray[np.float32]:
+        """
+        Resets every env concurrently
+
+        :return: NDArray[np.float32] the observations, of shape (len(envs), *obs_shape)
+        """
+        list(self._executor.map(self._reset_env, range(len(self.envs))))
+        return self.obs
+
+    def tick(self) -> NDArray[np.float32]:
+        """
+        Runs predict once over all observations, then steps every env concurrently
+
+        :return: NDArray[np.float32] the new observations. Overwritten by the next tick
+        """
+        actions = np.asarray(self.predict(self.obs))
+        for num_steps, episode_ended in self._executor.map(
+            self._step_env, range(len(self.envs)), actions.tolist()
+        ):
+            self.num_steps += num_steps
+            self.num_episodes += episode_ended
+        self.num_ticks += 1
+        return self.obs
+
+    def run(self, num_ticks: Optional[int] = None) -> None:
+        """
+        Resets, then ticks num_ticks times, or forever, if None
+        """
+        self.reset()
+        start = time.perf_counter()
+        next_tick = start
+        while num_ticks is None or self.num_ticks < num_ticks:
+            self.tick()
+            if self.tick_seconds is not None:
+                # sleep until the next tick is due, allowing for the time the tick took,
+                # without trying to catch up, if we fell behind
+                next_tick = max(next_tick + self.tick_seconds, time.perf_counter())
+                time.sleep(max(0.0, next_tick - time.perf_counter()))
+            if self.num_ticks % 10 == 0:
+                elapsed = time.perf_counter() - start
+                print(
+                    f"\rticks {self.num_ticks} episodes {self.num_episodes}"
+                    f" steps/sec {self.num_steps / elapsed:.0f}",
+                    end="",
+                    flush=True,
+                )
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True)
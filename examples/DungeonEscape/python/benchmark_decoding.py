@@ -0,0 +1,67 @@
+import argparse
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List
+
+import chili
+import my_unity_env
+import numpy as np
+
+from peaceful_pie import dataclass_codec, ray_results_helper
+from peaceful_pie.testing import make_rl_result
+
+
+@dataclass
+class ListPlayerObservation:
+    IAmAlive: bool
+    IHaveAKey: bool
+    rayResults: ray_results_helper.RayResults
+
+
+@dataclass
+class ListRLResult:
+    """
+    my_unity_env.RLResult, but with the ray results as python lists, for comparison
+    """
+
+    reward: float
+    episodeFinished: bool
+    playerObservations: List[ListPlayerObservation]
+
+
+def time_decoder(
+    decoder: Callable[[Dict[str, Any]], Any], payload: Dict[str, Any], its: int
+) -> float:
+    start = time.perf_counter()
+    for _ in range(its):
+        decoder(payload)
+    return (time.perf_counter() - start) / its
+
+
+def run(args: argparse.Namespace) -> None:
+    payload = make_rl_result(
+        num_players=args.num_players, ray_resolution=args.resolution
+    )
+    decoders = {
+        "chili": lambda d: chili.init_dataclass(d, my_unity_env.RLResult),
+        "dataclass_codec": dataclass_codec.get_decoder(my_unity_env.RLResult),
+        "dataclass_codec, lists": dataclass_codec.get_decoder(ListRLResult),
+    }
+    expected_obs = np.array(
+        my_unity_env.ObsBuffer().write(decoders["dataclass_codec"](payload))
+    )
+    for name, decoder in decoders.items():
+        assert np.allclose(
+            my_unity_env.ObsBuffer().write(decoder(payload)), expected_obs
+        )
+        seconds = time_decoder(decoder, payload, args.its)
+        print(f"{name}: {seconds * 1e6:.1f} us per RLResult")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num-players", type=int, default=3)
+    parser.add_argument("--resolution", type=int, default=5)
+    parser.add_argument("--its", type=int, default=2000)
+    args = parser.parse_args()
+    run(args)
@@ -0,0 +1,36 @@
+import argparse
+import time
+
+import my_unity_env
+
+from peaceful_pie.unity_comms import ReplayUnityComms
+
+
+def run(args: argparse.Namespace) -> None:
+    """
+    Steps MyUnityEnv through a recording made with e.g. run_inference.py --record-path, without
+    Unity, and reports python-side steps per second, i.e. decoding and building observations.
+    Recorded resets are replayed as steps, since both return an RLResult
+    """
+    comms = ReplayUnityComms(args.recording)
+    my_env = my_unity_env.MyUnityEnv(comms=comms)
+    actions = [0, 0, 0]
+    num_steps = 0
+    start = time.perf_counter()
+    for _ in range(args.passes):
+        comms.rewind()
+        my_env.reset()
+        while comms.num_remaining > 0:
+            my_env.step(actions)
+            num_steps += 1
+    elapsed = time.perf_counter() - start
+    print(f"{num_steps / elapsed:.0f} steps/sec")
+    print(comms.metrics.format())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--recording", type=str, required=True)
+    parser.add_argument("--passes", type=int, default=10)
+    args = parser.parse_args()
+    run(args)
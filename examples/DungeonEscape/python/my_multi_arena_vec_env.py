@@ -0,0 +1,38 @@
+from typing import Any, Dict, List, Tuple
+
+import gym.spaces
+import numpy as np
+from my_unity_env import ObsBuffer, RLResult, action_strs
+from numpy.typing import NDArray
+
+from peaceful_pie.unity_comms import UnityComms
+from peaceful_pie.vec_env import MultiArenaVecEnv
+
+
+class MyMultiArenaVecEnv(MultiArenaVecEnv):
+    """
+    Runs every DungeonEscape arena in one Unity process as a separate env. Needs a scene with
+    several arenas, and a DungeonEscapeMultiArenaService
+    """
+
+    def __init__(self, comms: UnityComms) -> None:
+        self._obs_buffers: List[ObsBuffer] = []
+        super().__init__(
+            comms=comms,
+            ResultClass=RLResult,
+            action_space=gym.spaces.MultiDiscrete([4] * 3),
+            obs_low=0,
+            obs_high=1,
+        )
+
+    def arena_actions(self, actions: NDArray) -> List[str]:
+        return action_strs(actions.tolist())
+
+    def decode_result(
+        self, arena_idx: int, result: RLResult
+    ) -> Tuple[NDArray[np.float32], float, bool, Dict[str, Any]]:
+        while len(self._obs_buffers) <= arena_idx:
+            self._obs_buffers.append(ObsBuffer())
+        obs = self._obs_buffers[arena_idx].write(result)
+        info: Dict[str, Any] = {"finished": result.episodeFinished}
+        return obs, result.reward, result.episodeFinished, info
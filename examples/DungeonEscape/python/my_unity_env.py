@@ -1,5 +1,6 @@
+from concurrent.futures import Future
 from dataclasses import dataclass
-from typing import Any, Dict, List, Tuple
+from typing import Any, Dict, List, Optional, Tuple
 
 import gym
 import gym.spaces
@@ -7,13 +8,14 @@ import numpy as np
 from numpy.typing import NDArray
 
 from peaceful_pie import ray_results_helper, unity_comms
+from peaceful_pie.frame_stack import FrameStack
 
 
 @dataclass
 class PlayerObservation:
     IAmAlive: bool
     IHaveAKey: bool
-    rayResults: ray_results_helper.RayResults
+    rayResults: ray_results_helper.ArrayRayResults
 
 
 @dataclass
@@ -23,12 +25,87 @@ class RLResult:
     playerObservations: List[PlayerObservation]
 
 
+def action_strs(actions: List[int]) -> List[str]:
+    return [
+        [
+            "nop",
+            "rotateLeft",
+            "rotateRight",
+            "forward",
+        ][action]
+        for action in actions
+    ]
+
+
+class ObsBuffer:
+    """
+    Converts RLResults into observation vectors, written into a buffer which is sized from the
+    first RLResult, and overwritten in place by each later one
+    """
+
+    def __init__(self) -> None:
+        self.obs: Optional[NDArray[np.float32]] = None
+        # views into self.obs, with shape (num_players, NumObjectTypes, X, Y) and (num_players, 2)
+        self.features: Optional[NDArray[np.float32]] = None
+        self.flags: Optional[NDArray[np.float32]] = None
+
+    def _allocate(self, rl_result: RLResult) -> None:
+        """
+        Sizes the observation buffer from rl_result. Each player gets a contiguous block of the
+        buffer, holding their ray features, flattened, followed by IAmAlive and IHaveAKey.
+        """
+        num_players = len(rl_result.playerObservations)
+        ray_results = rl_result.playerObservations[0].rayResults
+        features_shape = (
+            ray_results.NumObjectTypes,
+            *np.asarray(ray_results.rayDistances).shape,
+        )
+        features_size = int(np.prod(features_shape))
+        self.obs = np.zeros(num_players * (features_size + 2), dtype=np.float32)
+        obs_by_player = self.obs.reshape(num_players, features_size + 2)
+        # splitting the last axis of a slice like this gives a view, not a copy
+        self.features = obs_by_player[:, :features_size].reshape(
+            num_players, *features_shape
+        )
+        self.flags = obs_by_player[:, features_size:]
+        assert np.shares_memory(self.features, self.obs)
+
+    def write(self, rl_result: RLResult) -> NDArray[np.float32]:
+        """
+        Writes the observation into our preallocated buffer, and returns it. Note that the same
+        array is returned on each call, and overwritten by the next step. MyUnityEnv copies it
+        where it must outlive the next step, i.e. on reset, and at the end of an episode.
+        """
+        if self.obs is None:
+            self._allocate(rl_result)
+        assert self.obs is not None
+        assert self.features is not None and self.flags is not None
+        ray_results_helper.ray_results_to_feature_np_batch(
+            [player_obs.rayResults for player_obs in rl_result.playerObservations],
+            out=self.features,
+        )
+        for i, player_obs in enumerate(rl_result.playerObservations):
+            self.flags[i, 0] = player_obs.IAmAlive
+            self.flags[i, 1] = player_obs.IHaveAKey
+        return self.obs
+
+
 class MyUnityEnv(gym.Env):
     def __init__(
         self,
         comms: unity_comms.UnityComms,
+        num_frames: int = 1,
     ):
+        """
+        :param num_frames: int If more than 1, observations are the last num_frames observation
+            vectors, stacked, of shape (num_frames, obs_size), oldest first
+        """
         self.comms = comms
+        self.num_frames = num_frames
+        self._obs_buffer = ObsBuffer()
+        self._frame_stack: Optional[FrameStack] = None
+        # pending rlStep, between step_async and step_wait
+        self._step_future: Optional[Future] = None
 
         self.action_space = gym.spaces.MultiDiscrete(
             [4] * 3
@@ -41,48 +118,58 @@ class MyUnityEnv(gym.Env):
 
     def reset(self) -> NDArray[np.float32]:
         rl_result: RLResult = self.comms.reset(ResultClass=RLResult)
-        obs = self._result_to_obs(rl_result)
-        return obs
-
-    def _player_observation_to_vec(
-        self, player_obs: PlayerObservation
-    ) -> NDArray[np.float32]:
-        """
-        Takes in a player observation, containing ray hits, and whether the player has a key,
-        and returns a single vector, representing both of those
-        """
-        vec = ray_results_helper.ray_results_to_feature_np(player_obs.rayResults)
-        res = np.concatenate(
-            [vec.flatten(), [player_obs.IAmAlive, player_obs.IHaveAKey]]
-        )
-        return res
+        obs = self._obs_buffer.write(rl_result)
+        if self.num_frames == 1:
+            # a copy, since the next step overwrites our buffer
+            return obs.copy()
+        if self._frame_stack is None:
+            self._frame_stack = FrameStack(self.num_frames, frame_shape=obs.shape)
+        self._frame_stack.reset(obs)
+        # a copy, since the next step overwrites the frame stack's view
+        return self._frame_stack.copy()
 
     def _result_to_obs(self, rl_result: RLResult) -> NDArray[np.float32]:
-        return np.concatenate(
-            [
-                self._player_observation_to_vec(obs)
-                for obs in rl_result.playerObservations
-            ]
-        )
+        obs = self._obs_buffer.write(rl_result)
+        if self._frame_stack is None:
+            return obs
+        return self._frame_stack.push(obs)
+
+    def _step_result(
+        self, rl_result: RLResult
+    ) -> Tuple[NDArray[np.float32], float, bool, Dict[str, Any]]:
+        obs = self._result_to_obs(rl_result)
+        if rl_result.episodeFinished:
+            # vec envs keep the final observation, as info["terminal_observation"], across the
+            # reset which follows, and reset overwrites our buffer
+            obs = obs.copy()
+        info: Dict[str, Any] = {"finished": rl_result.episodeFinished}
+        return obs, rl_result.reward, rl_result.episodeFinished, info
 
     def step(
         self, actions: List[int]
     ) -> Tuple[NDArray[np.float32], float, bool, Dict[str, Any]]:
-        action_strs = [
-            [
-                "nop",
-                "rotateLeft",
-                "rotateRight",
-                "forward",
-            ][action]
-            for action in actions
-        ]
         rl_result: RLResult = self.comms.rlStep(
-            actions=action_strs, ResultClass=RLResult
+            actions=action_strs(actions), ResultClass=RLResult
         )
-        obs = self._result_to_obs(rl_result)
-        info: Dict[str, Any] = {"finished": rl_result.episodeFinished}
-        return obs, rl_result.reward, rl_result.episodeFinished, info
+        return self._step_result(rl_result)
+
+    def step_async(self, actions: List[int]) -> None:
+        """
+        Sends the actions to Unity, without waiting for Unity to simulate the step. Call
+        step_wait to get the result. In the meantime, python is free to e.g. run inference for
+        other envs, whilst this env's Unity simulates.
+        """
+        assert (
+            self._step_future is None
+        ), "step_wait must be called before stepping again"
+        self._step_future = self.comms.rpc_call_async(
+            "rlStep", actions=action_strs(actions), ResultClass=RLResult
+        )
+
+    def step_wait(self) -> Tuple[NDArray[np.float32], float, bool, Dict[str, Any]]:
+        assert self._step_future is not None, "step_async must be called first"
+        step_future, self._step_future = self._step_future, None
+        return self._step_result(step_future.result())
 
     def close(self) -> None:
         ...
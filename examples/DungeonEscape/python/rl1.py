@@ -7,14 +7,17 @@ import mlflow_logging
 import models
 import torch
 from gym import Env
+from my_multi_arena_vec_env import MyMultiArenaVecEnv
 from my_unity_env import MyUnityEnv
 from sbs3_checkpoint_callback import SBS3CheckpointCallback
 from stable_baselines3 import PPO
 from stable_baselines3.common.monitor import Monitor
 from stable_baselines3.common.policies import ActorCriticPolicy
-from stable_baselines3.common.vec_env import SubprocVecEnv, VecEnv, VecMonitor
+from stable_baselines3.common.vec_env import VecEnv, VecMonitor
 
+from peaceful_pie.server_pool import UnityServerPool
 from peaceful_pie.unity_comms import UnityComms
+from peaceful_pie.vec_env import PipelinedVecEnv, SharedMemoryVecEnv
 
 
 def dump_params_counts(net: torch.nn.Module) -> int:
@@ -27,6 +30,18 @@ def dump_params_counts(net: torch.nn.Module) -> int:
 
 
 def run(args: argparse.Namespace) -> None:
+    if args.server_executable_path is None:
+        train(args)
+        return
+    # launches the servers in parallel, restarts any that crash, and stops them all when we
+    # are done, or fail
+    with UnityServerPool(
+        args.server_executable_path, num_servers=len(args.ports), ports=args.ports
+    ):
+        train(args)
+
+
+def train(args: argparse.Namespace) -> None:
     class EnvFactory:
         def __init__(self, port: int, server_executable_path: Optional[str]):
             # I think this gets pickled into a new process
@@ -44,12 +59,20 @@ def run(args: argparse.Namespace) -> None:
             return my_unity_env
 
     env_factories = [
-        EnvFactory(port=port, server_executable_path=args.server_executable_path)
-        for port in args.ports
+        EnvFactory(port=port, server_executable_path=None) for port in args.ports
     ]
     my_env: Union[Env, VecEnv]
-    if len(args.ports) > 1:
-        my_env = SubprocVecEnv(env_fns=env_factories)  # type: ignore
+    if args.vec_env == "multi-arena":
+        assert (
+            len(args.ports) == 1
+        ), "multi-arena runs every env in a single Unity process"
+        my_env = MyMultiArenaVecEnv(comms=env_factories[0].unity_comms)
+        my_env = VecMonitor(my_env)
+    elif len(args.ports) > 1:
+        if args.vec_env == "pipelined":
+            my_env = PipelinedVecEnv(env_fns=env_factories)  # type: ignore
+        else:
+            my_env = SharedMemoryVecEnv(env_fns=env_factories)  # type: ignore
         my_env = VecMonitor(my_env)
     else:
         my_env = env_factories[0]()
@@ -147,6 +170,16 @@ if __name__ == "__main__":
         type=str,
         help="optional path to dedicated server executable",
     )
+    parser.add_argument(
+        "--vec-env",
+        type=str,
+        default="shared-memory",
+        choices=["shared-memory", "pipelined", "multi-arena"],
+        help="'shared-memory' and 'pipelined' are used with more than one port. 'shared-memory' "
+        "runs one process per env. 'pipelined' steps all envs from this process, with the Unity "
+        "processes simulating in parallel. 'multi-arena' runs each arena in a single Unity "
+        "process as an env, stepping them all with one rpc call.",
+    )
     parser.add_argument("--ref", type=str, required=True)
     parser.add_argument("--no-mlflow", action="store_true")
     parser.add_argument(
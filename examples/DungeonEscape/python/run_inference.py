@@ -1,11 +1,14 @@
 import argparse
-import time
 
 import mlflow_utils
 import my_unity_env
+import numpy as np
+import torch
+from batch_inference import BatchInferenceRunner
+from numpy.typing import NDArray
 from stable_baselines3 import PPO
 
-from peaceful_pie import unity_comms
+from peaceful_pie import server_daemon, unity_comms
 
 
 def run(args: argparse.Namespace) -> None:
@@ -15,28 +18,40 @@ def run(args: argparse.Namespace) -> None:
 
     checkpoint_path = mlflow_loader.download_checkpoint(args.run_name, args.iterations)
 
-    comms = unity_comms.UnityComms(port=args.port)
-    comms.rlInitAi(accel=args.accel, frame_skip=0)
+    if args.server_daemon_registry is not None:
+        # the servers are returned to the daemon when this process exits
+        leases = [
+            server_daemon.ServerLease(args.server_daemon_registry)
+            for _ in range(args.num_leases)
+        ]
+        comms_l = [lease.create_comms() for lease in leases]
+    else:
+        comms_l = [unity_comms.UnityComms(port=port) for port in args.ports]
+    unity_comms.UnityCommsGroup(comms_l).rlInitAi(accel=args.accel, frame_skip=0)
+    if args.record_path is not None:
+        for i, comms in enumerate(comms_l):
+            comms.start_recording(
+                args.record_path if len(comms_l) == 1 else f"{args.record_path}.{i}"
+            )
 
-    my_env = my_unity_env.MyUnityEnv(comms=comms)
-    ppo = PPO.load(checkpoint_path, my_env)
+    envs = [my_unity_env.MyUnityEnv(comms=comms) for comms in comms_l]
+    ppo = PPO.load(checkpoint_path, envs[0])
     print(ppo.policy)
 
-    obs = my_env.reset()
-    step = 0
-    while True:
-        # print('stepping')
-        actions, _states = ppo.predict(obs)
-        for _ in range(args.frame_skip + 1):
-            obs, rewards, dones, info = my_env.step(actions.tolist())
-            if dones or step > 200:
-                print("resetting")
-                obs = my_env.reset()
-                step = 0
-                break
-        step += 1
-        print(f"\r{step}", end="", flush=True)
-        time.sleep(1 / 50 / args.accel)
+    def predict(obs: NDArray[np.float32]) -> NDArray:
+        # one forward pass for every env
+        with torch.no_grad():
+            actions, _states = ppo.predict(obs)
+        return actions
+
+    runner = BatchInferenceRunner(
+        envs,
+        predict=predict,
+        frame_skip=args.frame_skip,
+        max_episode_steps=200,
+        tick_seconds=None if args.fast else 1 / 50 / args.accel,
+    )
+    runner.run()
 
 
 if __name__ == "__main__":
@@ -50,7 +65,26 @@ if __name__ == "__main__":
     )
     parser.add_argument("--experiment-name", type=str, default="unityml")
     parser.add_argument("--mlflow-uri", type=str, default="http://localhost:5000")
-    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument(
+        "--ports",
+        type=int,
+        nargs="+",
+        default=[9000],
+        help="Provide more than one to run the policy on multiple unity processes at once, "
+        "with one batched forward pass per tick.",
+    )
+    parser.add_argument(
+        "--server-daemon-registry",
+        type=str,
+        help="lease already running servers from a peaceful_pie.server_daemon, using this "
+        f"registry file, e.g. {server_daemon.DEFAULT_REGISTRY_PATH}, instead of using --ports",
+    )
+    parser.add_argument(
+        "--num-leases",
+        type=int,
+        default=1,
+        help="how many servers to lease, with --server-daemon-registry",
+    )
     parser.add_argument(
         "--frame-skip",
         type=int,
@@ -58,6 +92,17 @@ if __name__ == "__main__":
         help="should match what was used for training",
     )
     parser.add_argument("--accel", type=float, default=1.0)
+    parser.add_argument(
+        "--fast",
+        action="store_true",
+        help="run as fast as possible, e.g. for evaluations, rather than in real time",
+    )
+    parser.add_argument(
+        "--record-path",
+        type=str,
+        help="record the session's rpc traffic here, for benchmark_replay.py. With more than "
+        "one server, server i is recorded to [record-path].[i]",
+    )
     args = parser.parse_args()
     args.run_name, iterations = args.run.split(":")
     args.iterations = int(iterations)
@@ -5,14 +5,21 @@ try:
     google.protobuf.descriptor._Deprecated.count = 0  # type: ignore
 except Exception:
     pass
+import time
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Any, Dict
 from unittest import mock
 
 import my_unity_env
 import numpy as np
 import pytest
+from batch_inference import BatchInferenceRunner
 from numpy.typing import NDArray
 
 from peaceful_pie import ray_results_helper
+from peaceful_pie.testing import StandInServer, rl_methods
+from peaceful_pie.unity_comms import ReplayUnityComms, UnityComms
 
 
 @pytest.mark.parametrize(
@@ -22,8 +29,10 @@ from peaceful_pie import ray_results_helper
             my_unity_env.PlayerObservation(
                 True,
                 False,
-                ray_results_helper.RayResults(
-                    rayDistances=[[1, 2]], rayHitObjectTypes=[[0, 1]], NumObjectTypes=2
+                ray_results_helper.ArrayRayResults(
+                    rayDistances=np.array([[1, 2]], dtype=np.float32),
+                    rayHitObjectTypes=np.array([[0, 1]], dtype=np.int16),
+                    NumObjectTypes=2,
                 ),
             ),
             np.array([1, 0, 0, 0.5, 1, 0]),
@@ -32,21 +41,22 @@ from peaceful_pie import ray_results_helper
             my_unity_env.PlayerObservation(
                 True,
                 True,
-                ray_results_helper.RayResults(
-                    rayDistances=[[1, 2]], rayHitObjectTypes=[[0, 1]], NumObjectTypes=2
+                ray_results_helper.ArrayRayResults(
+                    rayDistances=np.array([[1, 2]], dtype=np.float32),
+                    rayHitObjectTypes=np.array([[0, 1]], dtype=np.int16),
+                    NumObjectTypes=2,
                 ),
             ),
             np.array([1, 0, 0, 0.5, 1, 1]),
         ),
     ],
 )
-def test__player_observation_to_vec(
+def test_obs_buffer_player_observation(
     player_obs: my_unity_env.PlayerObservation, expected_vec: NDArray[np.float32]
 ) -> None:
-    unity_comms = mock.Mock()
-    unity_comms.reset.return_value = my_unity_env.RLResult(0, False, [player_obs])
-    env = my_unity_env.MyUnityEnv(unity_comms)
-    actual = env._player_observation_to_vec(player_obs)
+    actual = my_unity_env.ObsBuffer().write(
+        my_unity_env.RLResult(0, False, [player_obs])
+    )
     print("expected", expected_vec, expected_vec.shape)
     print("actual", actual, actual.shape)
     assert np.all(actual == expected_vec)
@@ -63,18 +73,18 @@ def test__player_observation_to_vec(
                     my_unity_env.PlayerObservation(
                         IAmAlive=True,
                         IHaveAKey=True,
-                        rayResults=ray_results_helper.RayResults(
-                            rayDistances=[[1, 2]],
-                            rayHitObjectTypes=[[0, 1]],
+                        rayResults=ray_results_helper.ArrayRayResults(
+                            rayDistances=np.array([[1, 2]], dtype=np.float32),
+                            rayHitObjectTypes=np.array([[0, 1]], dtype=np.int16),
                             NumObjectTypes=2,
                         ),
                     ),
                     my_unity_env.PlayerObservation(
                         IAmAlive=True,
                         IHaveAKey=False,
-                        rayResults=ray_results_helper.RayResults(
-                            rayDistances=[[1, 2]],
-                            rayHitObjectTypes=[[0, 1]],
+                        rayResults=ray_results_helper.ArrayRayResults(
+                            rayDistances=np.array([[1, 2]], dtype=np.float32),
+                            rayHitObjectTypes=np.array([[0, 1]], dtype=np.int16),
                             NumObjectTypes=2,
                         ),
                     ),
@@ -94,3 +104,216 @@ def test_result_to_obs(
     print("expected", expected_vec, expected_vec.shape)
     print("actual", actual, actual.shape)
     assert np.all(actual == expected_vec)
+
+
+def test_step_reuses_float32_obs_buffer() -> None:
+    player_obs = my_unity_env.PlayerObservation(
+        IAmAlive=True,
+        IHaveAKey=False,
+        rayResults=ray_results_helper.ArrayRayResults(
+            rayDistances=np.array([[1, 2]], dtype=np.float32),
+            rayHitObjectTypes=np.array([[0, 1]], dtype=np.int16),
+            NumObjectTypes=2,
+        ),
+    )
+    unity_comms = mock.Mock()
+    unity_comms.reset.return_value = my_unity_env.RLResult(0, False, [player_obs])
+    env = my_unity_env.MyUnityEnv(unity_comms)
+    assert env.observation_space.dtype == np.float32
+
+    player_obs_2 = my_unity_env.PlayerObservation(
+        IAmAlive=False,
+        IHaveAKey=True,
+        rayResults=ray_results_helper.ArrayRayResults(
+            rayDistances=np.array([[4, -1]], dtype=np.float32),
+            rayHitObjectTypes=np.array([[1, -1]], dtype=np.int16),
+            NumObjectTypes=2,
+        ),
+    )
+    unity_comms.rlStep.return_value = my_unity_env.RLResult(0.5, False, [player_obs_2])
+    obs, reward, finished, info = env.step([0, 1, 2])
+    assert obs.dtype == np.float32
+    assert np.all(obs == np.array([0, 0, 0.25, 0, 0, 1]))
+    obs_2, _, _, _ = env.step([0, 1, 2])
+    assert obs_2 is obs
+
+
+def test_step_async_matches_step() -> None:
+    player_obs = my_unity_env.PlayerObservation(
+        IAmAlive=True,
+        IHaveAKey=False,
+        rayResults=ray_results_helper.ArrayRayResults(
+            rayDistances=np.array([[1, 2]], dtype=np.float32),
+            rayHitObjectTypes=np.array([[0, 1]], dtype=np.int16),
+            NumObjectTypes=2,
+        ),
+    )
+    rl_result = my_unity_env.RLResult(0.5, True, [player_obs])
+    step_future: Future = Future()
+    unity_comms = mock.Mock()
+    unity_comms.reset.return_value = rl_result
+    unity_comms.rlStep.return_value = rl_result
+    unity_comms.rpc_call_async.return_value = step_future
+    env = my_unity_env.MyUnityEnv(unity_comms)
+    expected_obs, expected_reward, expected_finished, expected_info = env.step(
+        [3, 1, 0]
+    )
+    expected_obs = expected_obs.copy()
+
+    env.step_async([3, 1, 0])
+    unity_comms.rpc_call_async.assert_called_once_with(
+        "rlStep",
+        actions=["forward", "rotateLeft", "nop"],
+        ResultClass=my_unity_env.RLResult,
+    )
+    step_future.set_result(rl_result)
+    obs, reward, finished, info = env.step_wait()
+    assert np.all(obs == expected_obs)
+    assert (reward, finished, info) == (
+        expected_reward,
+        expected_finished,
+        expected_info,
+    )
+
+
+def test_replay_matches_live(tmp_path: Path) -> None:
+    def rl_result_d(step: int) -> Dict[str, Any]:
+        return {
+            "reward": step * 0.1,
+            "episodeFinished": step % 3 == 2,
+            "playerObservations": [
+                {
+                    "IAmAlive": True,
+                    "IHaveAKey": step % 2 == 1,
+                    "rayResults": {
+                        "rayDistances": [[step + 1.0, 2.0]],
+                        "rayHitObjectTypes": [[step % 2, 1]],
+                        "NumObjectTypes": 2,
+                    },
+                }
+            ],
+        }
+
+    steps = iter(range(100))
+    methods: Dict[str, Any] = {
+        "reset": lambda: rl_result_d(next(steps)),
+        "rlStep": lambda actions: rl_result_d(next(steps)),
+    }
+    recording = str(tmp_path / "rollout.rec")
+    with StandInServer(methods=methods) as server:
+        comms = UnityComms(port=server.port)
+        comms.start_recording(recording)
+        env = my_unity_env.MyUnityEnv(comms)
+        expected = []
+        for _ in range(5):
+            obs, reward, done, info = env.step([3, 1, 0])
+            # the env reuses its observation buffer
+            expected.append((obs.copy(), reward, done, info))
+        comms.stop_recording()
+
+    replay_env = my_unity_env.MyUnityEnv(ReplayUnityComms(recording, strict=True))
+    for expected_obs, expected_reward, expected_done, expected_info in expected:
+        obs, reward, done, info = replay_env.step([3, 1, 0])
+        assert np.all(obs == expected_obs)
+        assert (reward, done, info) == (expected_reward, expected_done, expected_info)
+
+
+def test_frame_stacking() -> None:
+    def rl_result(distance: float) -> my_unity_env.RLResult:
+        player_obs = my_unity_env.PlayerObservation(
+            IAmAlive=True,
+            IHaveAKey=False,
+            rayResults=ray_results_helper.ArrayRayResults(
+                rayDistances=np.array([[distance, 2]], dtype=np.float32),
+                rayHitObjectTypes=np.array([[0, 1]], dtype=np.int16),
+                NumObjectTypes=2,
+            ),
+        )
+        return my_unity_env.RLResult(0, False, [player_obs])
+
+    unity_comms = mock.Mock()
+    unity_comms.reset.return_value = rl_result(1)
+    env = my_unity_env.MyUnityEnv(unity_comms, num_frames=3)
+    assert env.observation_space.shape == (3, 6)
+    for distance in [2, 4]:
+        unity_comms.rlStep.return_value = rl_result(distance)
+        obs, _, _, _ = env.step([0, 0, 0])
+    assert obs.shape == (3, 6)
+    assert np.all(obs[:, 0] == [1, 0.5, 0.25])
+
+    obs = env.reset()
+    assert np.all(obs[:2] == 0)
+    assert obs[2, 0] == 1
+    unity_comms.rlStep.return_value = rl_result(2)
+    env.step([0, 0, 0])
+    # the observation from reset is not a view onto the frame stack
+    assert np.all(obs[:2] == 0)
+
+
+@pytest.mark.parametrize("num_frames", [1, 3])
+def test_terminal_observation_survives_reset(num_frames: int) -> None:
+    dummy_vec_env = pytest.importorskip(
+        "stable_baselines3.common.vec_env.dummy_vec_env"
+    )
+
+    def rl_result(distance: float, finished: bool) -> my_unity_env.RLResult:
+        player_obs = my_unity_env.PlayerObservation(
+            IAmAlive=True,
+            IHaveAKey=False,
+            rayResults=ray_results_helper.ArrayRayResults(
+                rayDistances=np.array([[distance, 2]], dtype=np.float32),
+                rayHitObjectTypes=np.array([[0, 1]], dtype=np.int16),
+                NumObjectTypes=2,
+            ),
+        )
+        return my_unity_env.RLResult(0, finished, [player_obs])
+
+    unity_comms = mock.Mock()
+    unity_comms.reset.return_value = rl_result(1, False)
+    env = my_unity_env.MyUnityEnv(unity_comms, num_frames=num_frames)
+    vec_env = dummy_vec_env.DummyVecEnv([lambda: env])
+    vec_env.reset()
+    unity_comms.rlStep.return_value = rl_result(4, True)
+    obs, _, dones, infos = vec_env.step(np.zeros((1, 3), dtype=np.int64))
+    assert dones.tolist() == [True]
+    # the reset after the final step must not overwrite the terminal observation
+    terminal_obs = infos[0]["terminal_observation"].reshape(num_frames, -1)
+    assert terminal_obs[-1, 0] == 0.25
+    assert obs.reshape(num_frames, -1)[-1, 0] == 1
+
+
+def test_batch_inference_runner() -> None:
+    servers = [
+        StandInServer(methods=rl_methods(num_players=2, episode_length=7)).start()
+        for _ in range(3)
+    ]
+    try:
+        envs = [
+            my_unity_env.MyUnityEnv(UnityComms(port=server.port)) for server in servers
+        ]
+        obs_batches = []
+
+        def predict(obs: NDArray[np.float32]) -> NDArray:
+            obs_batches.append(obs.copy())
+            return np.zeros((len(obs), 3), dtype=np.int64)
+
+        runner = BatchInferenceRunner(envs, predict=predict, frame_skip=1)
+        runner.run(num_ticks=5)
+        # one batched predict per tick
+        assert len(obs_batches) == 5
+        assert obs_batches[0].shape[0] == 3
+        assert obs_batches[0].shape[1:] == envs[0].observation_space.shape
+        # each episode lasts 7 steps, so ends on the first frame of the 4th tick, cutting
+        # that tick short
+        assert runner.num_episodes == 3
+        assert runner.num_steps == 3 * (2 + 2 + 2 + 1 + 2)
+
+        # paced in real time
+        runner = BatchInferenceRunner(envs, predict=predict, tick_seconds=0.05)
+        start = time.perf_counter()
+        runner.run(num_ticks=4)
+        assert time.perf_counter() - start >= 0.15
+        runner.close()
+    finally:
+        for server in servers:
+            server.stop()
@@ -0,0 +1,331 @@
+import asyncio
+import datetime
+import json
+from contextlib import asynccontextmanager
+from typing import Any, AsyncGenerator, Dict, List, Optional, Tuple, Type, Union
+
+from peaceful_pie.retry import RetryPolicy, RetryState
+from peaceful_pie.transports import FatalTransportError, ResponseLostError
+from peaceful_pie.unity_comms import (
+    RpcCall,
+    decode_batch_response,
+    decode_response,
+    encode_params,
+)
+
+
+class AsyncUnityCommsFn:
+    def __init__(self, unity_comms: "AsyncUnityComms", method_name: str):
+        self.unity_comms = unity_comms
+        self.method_name = method_name
+
+    async def __call__(
+        self, ResultClass: Optional[Type] = None, retry: bool = True, **kwargs: Any
+    ) -> Any:
+        return await self.unity_comms.rpc_call(
+            method=self.method_name,
+            retry=retry,
+            params_dict=kwargs,
+            ResultClass=ResultClass,
+        )
+
+
+class AsyncUnityComms:
+    """
+    asyncio version of UnityComms. Calls are coroutines, so a single event loop can keep many
+    Unity servers busy at once, e.g.
+
+    comms_l = [AsyncUnityComms(port=port) for port in ports]
+    rl_results = await asyncio.gather(
+        *[comms.rlStep(actions=actions, ResultClass=RLResult) for comms in comms_l]
+    )
+
+    Talks HTTP/1.1 to NetManager over a persistent asyncio connection, so has no dependencies
+    beyond the standard library. Each AsyncUnityComms sends one request at a time; concurrent
+    calls on the same instance are queued. The connection belongs to the event loop it was
+    opened on, so an instance used from a new event loop, e.g. a second asyncio.run(),
+    reconnects. This does not start dedicated servers: use UnityComms for that, or start them
+    yourself.
+    """
+
+    def __init__(
+        self,
+        port: int,
+        logfile: Optional[str] = None,
+        hostname: str = "localhost",
+        retry_policy: Optional[RetryPolicy] = None,
+    ) -> None:
+        """
+        :param port: int The port that Unity is running on
+        :param logfile: Optional[str] Logfile to write to. Optional
+        :param hostname: str The hostname where the Unity process is running. Reminder that all network
+            communications are insecure, so best to set this to localhost.
+        :param retry_policy: Optional[RetryPolicy] How to retry failed calls, as for UnityComms.
+            Defaults to RetryPolicy()
+        """
+        self.hostname = hostname
+        self.port = port
+        self.retry_policy = retry_policy if retry_policy is not None else RetryPolicy()
+        self.jsonrpc_id = 0
+        self.logfile = logfile
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._lock: Optional[asyncio.Lock] = None
+        # the event loop which _lock, _reader and _writer belong to
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _rpc_request_dict(self, method: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        res = {
+            "method": method,
+            "params": params,
+            "jsonrpc": "2.0",
+            "id": self.jsonrpc_id,
+        }
+        self.jsonrpc_id += 1
+        return res
+
+    @asynccontextmanager
+    async def blocking_listen(self) -> AsyncGenerator:
+        """
+        See UnityComms.blocking_listen. Use as:
+
+        async with unity_comms.blocking_listen():
+            # do other stuff here
+        """
+        await self.rpc_call("setBlockingListen", {"blocking": True})
+        try:
+            yield None
+        finally:
+            await self.rpc_call("setBlockingListen", {"blocking": False}, retry=False)
+
+    async def set_autosimulation(self, auto_simulation: bool) -> None:
+        """
+        See UnityComms.set_autosimulation
+        """
+        await self.rpc_call("setAutosimulation", {"autosimulation": auto_simulation})
+
+    async def get_autosimulation(self) -> bool:
+        return await self.rpc_call("getAutosimulation")
+
+    def __getattr__(self, method_name: str) -> AsyncUnityCommsFn:
+        if method_name.startswith("_"):
+            raise AttributeError()
+        return AsyncUnityCommsFn(unity_comms=self, method_name=method_name)
+
+    def __getitem__(self, method_name: str) -> AsyncUnityCommsFn:
+        return AsyncUnityCommsFn(unity_comms=self, method_name=method_name)
+
+    async def close(self) -> None:
+        self._lock, self._loop = None, None
+        await self._close_connection()
+
+    async def _close_connection(self) -> None:
+        if self._writer is not None:
+            writer = self._writer
+            self._reader, self._writer = None, None
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except OSError:
+                pass
+
+    async def rpc_call(
+        self,
+        method: str,
+        params_dict: Optional[Dict[str, Any]] = None,
+        ResultClass: Optional[Type] = None,
+        retry: bool = True,
+        **kwargs: Any,
+    ) -> Any:
+        """
+        Same as UnityComms.rpc_call, but is a coroutine
+        """
+        params_dict = params_dict if params_dict else {}
+        params_dict.update(kwargs)
+        payload = self._rpc_request_dict(method, encode_params(params_dict))
+        res_d = await self._post(
+            payload,
+            retry=retry,
+            method=method,
+            idempotent=self.retry_policy.is_idempotent(method),
+        )
+        if res_d is None:
+            return None
+        return decode_response(res_d, ResultClass)
+
+    async def rpc_batch(self, calls: List[RpcCall], retry: bool = True) -> List[Any]:
+        """
+        Same as UnityComms.rpc_batch, but is a coroutine
+        """
+        payloads = [
+            self._rpc_request_dict(call.method, encode_params(call.params_dict or {}))
+            for call in calls
+        ]
+        res_l = await self._post(
+            payloads,
+            retry=retry,
+            method="batch",
+            idempotent=all(
+                self.retry_policy.is_idempotent(call.method) for call in calls
+            ),
+        )
+        if res_l is None:
+            return [None] * len(calls)
+        return decode_batch_response(res_l, calls, payloads)
+
+    async def _post(
+        self,
+        payload: Union[Dict[str, Any], List[Dict[str, Any]]],
+        retry: bool,
+        method: str,
+        idempotent: bool,
+    ) -> Any:
+        """
+        Sends payload, retrying according to self.retry_policy, as UnityComms does
+
+        :param retry: bool If False, return None on connection errors and empty responses,
+            rather than retrying
+        :param method: str Name to use in error messages
+        :param idempotent: bool Whether the payload may be re-sent after Unity might have
+            processed it
+        """
+        body = json.dumps(payload, allow_nan=False).encode("utf-8")
+        retry_state = RetryState(self.retry_policy, method, idempotent)
+        while True:
+            content = None
+            error: Optional[Exception] = None
+            timeout = retry_state.start_attempt()
+            try:
+                content = await asyncio.wait_for(self._http_post(body), timeout)
+            except ConnectionError as e:
+                # includes ResponseLostError
+                if not retry:
+                    return None
+                error = e
+            except asyncio.TimeoutError as e:
+                if not retry:
+                    raise retry_state.timeout_error() from e
+                # before python 3.11, asyncio.TimeoutError is not a TimeoutError
+                error = TimeoutError(e)
+            if content is not None and content.strip() == b"":
+                if not retry:
+                    return None
+            elif content is not None:
+                try:
+                    return json.loads(content)
+                except ValueError as e:
+                    # a malformed reply will be malformed again, so retrying will not help
+                    self._log_error(payload, content, e)
+                    raise
+            backoff = retry_state.on_failure(error)
+            if retry_state.attempt == 1 and isinstance(error, ConnectionError):
+                print(f"{type(error).__name__} => retrying {method}")
+            await asyncio.sleep(backoff)
+
+    def _log_error(
+        self,
+        payload: Union[Dict[str, Any], List[Dict[str, Any]]],
+        content: bytes,
+        e: Exception,
+    ) -> None:
+        print("payload", payload)
+        print("content", content)
+        print("e", e)
+        if self.logfile is not None:
+            with open(self.logfile, "a") as f:
+                datetime_str = datetime.datetime.now().strftime("%Y%m%d %H%M%S")
+                f.write(f"{datetime_str}: payload {payload}\n")
+                f.write(f"{datetime_str}: content {str(content)}\n")
+                f.write(f"{datetime_str}: e {e}\n")
+
+    async def _http_post(self, body: bytes) -> bytes:
+        """
+        Sends one HTTP POST over our persistent connection, and returns the response body.
+        Raises ConnectionError if the connection fails, after which we reconnect on the next
+        call, ResponseLostError if it fails after the request was sent, and FatalTransportError
+        if Unity does not reply 200 OK. If cancelled, e.g. by a timeout, the connection is
+        dropped, since the response may still arrive on it.
+        """
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # the lock and streams only work on the loop which created them, which may have
+            # been closed, so we abandon any connection opened on it
+            self._reader, self._writer = None, None
+            self._lock, self._loop = asyncio.Lock(), loop
+        assert self._lock is not None
+        async with self._lock:
+            sent = False
+            try:
+                if self._writer is None:
+                    self._reader, self._writer = await asyncio.open_connection(
+                        self.hostname, self.port
+                    )
+                assert self._reader is not None
+                request_head = (
+                    "POST /jsonrpc HTTP/1.1\r\n"
+                    f"Host: {self.hostname}:{self.port}\r\n"
+                    "Content-Type: application/json\r\n"
+                    f"Content-Length: {len(body)}\r\n"
+                    "\r\n"
+                )
+                sent = True
+                self._writer.write(request_head.encode("ascii") + body)
+                await self._writer.drain()
+                status, headers, content = await _read_http_response(self._reader)
+            except (OSError, asyncio.IncompleteReadError) as e:
+                await self._close_connection()
+                if sent:
+                    # e.g. Unity crashed whilst processing the request
+                    raise ResponseLostError(e)
+                raise ConnectionError(e)
+            except asyncio.CancelledError:
+                if self._writer is not None:
+                    self._writer.close()
+                    self._reader, self._writer = None, None
+                raise
+            if headers.get("connection", "").lower() == "close":
+                await self._close_connection()
+            if status != 200:
+                raise FatalTransportError(
+                    f"HTTP {status} from Unity: {content[:200]!r}"
+                )
+            return content
+
+
+async def _read_http_response(
+    reader: asyncio.StreamReader,
+) -> Tuple[int, Dict[str, str], bytes]:
+    """
+    :return: Tuple[int, Dict[str, str], bytes] the status code, the headers, with lower case
+        keys, and the body
+    """
+    status_line = await reader.readline()
+    if status_line == b"":
+        raise ConnectionResetError("Connection closed by server")
+    # e.g. HTTP/1.1 200 OK
+    status_parts = status_line.split(maxsplit=2)
+    if len(status_parts) < 2 or not status_parts[1].isdigit():
+        raise FatalTransportError(f"Malformed HTTP status line {status_line[:200]!r}")
+    status = int(status_parts[1])
+    headers: Dict[str, str] = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        key, _, value = line.decode("latin-1").partition(":")
+        headers[key.strip().lower()] = value.strip()
+    if headers.get("transfer-encoding", "").lower() == "chunked":
+        chunks = []
+        while True:
+            chunk_size = int((await reader.readline()).split(b";")[0], 16)
+            if chunk_size == 0:
+                await reader.readline()
+                break
+            chunks.append(await reader.readexactly(chunk_size))
+            await reader.readline()
+        return status, headers, b"".join(chunks)
+    return (
+        status,
+        headers,
+        await reader.readexactly(int(headers.get("content-length", "0"))),
+    )
@@ -0,0 +1,410 @@
+import argparse
+import asyncio
+import json
+import threading
+import time
+from contextlib import ExitStack
+from functools import partial
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from peaceful_pie.async_unity_comms import AsyncUnityComms
+from peaceful_pie.server_pool import find_free_ports
+from peaceful_pie.testing import (
+    StandInEnv,
+    StandInServer,
+    StandInServerProcess,
+    rl_methods,
+)
+from peaceful_pie.unity_comms import RpcCall, UnityComms
+
+CLIENT_MODES = ["single", "batch", "threaded", "async"]
+
+
+def time_calls(fn: Callable[[], Any], num_calls: int) -> List[float]:
+    """
+    Calls fn num_calls times, and returns the latency of each call, in seconds
+    """
+    latencies = []
+    for _ in range(num_calls):
+        start = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def format_latencies(name: str, latencies: List[float]) -> str:
+    latencies_ms = np.array(latencies) * 1000
+    p50, p90, p99 = np.percentile(latencies_ms, [50, 90, 99])
+    calls_per_sec = len(latencies) / np.sum(latencies)
+    return (
+        f"{name}: {calls_per_sec:.0f} calls/sec, latency ms p50 {p50:.3f} p90 {p90:.3f}"
+        f" p99 {p99:.3f}"
+    )
+
+
+def bench_transports(args: argparse.Namespace) -> None:
+    """
+    Round-trip latency of each transport, against a local stand-in server, with a small
+    rlStep-sized payload
+    """
+
+    def rl_step(actions: List[str]) -> Any:
+        return {"reward": 0.0, "episodeFinished": False, "actions": actions}
+
+    for transport in args.transports:
+        with StandInServer(methods={"rlStep": rl_step}, transport=transport) as server:
+            comms = UnityComms(port=server.port, transport=transport)
+            actions = ["nop", "forward", "rotateLeft"]
+            time_calls(lambda: comms.rlStep(actions=actions), args.warmup)
+            latencies = time_calls(
+                lambda: comms.rlStep(actions=actions), args.num_calls
+            )
+            print(format_latencies(transport, latencies))
+            comms.transport.close()
+
+
+def stress(
+    port: int,
+    num_clients: int,
+    duration: float,
+    transport: str = "http",
+    method: str = "getAutosimulation",
+    params_dict: Optional[Dict[str, Any]] = None,
+    hostname: str = "localhost",
+) -> Tuple[float, List[float]]:
+    """
+    Calls method as fast as possible from num_clients threads, each with its own UnityComms,
+    for duration seconds.
+
+    :return: requests per second over all clients, and the latency of each call, in seconds
+    """
+    latencies: List[List[float]] = [[] for _ in range(num_clients)]
+    deadline = time.perf_counter() + duration
+
+    def run_client(client_latencies: List[float]) -> None:
+        comms = UnityComms(port=port, transport=transport, hostname=hostname)
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            comms.rpc_call(method, dict(params_dict or {}))
+            client_latencies.append(time.perf_counter() - start)
+        comms.transport.close()
+
+    start = time.perf_counter()
+    threads = [
+        threading.Thread(target=run_client, args=(client_latencies,))
+        for client_latencies in latencies
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    all_latencies = [latency for client in latencies for latency in client]
+    return len(all_latencies) / elapsed, all_latencies
+
+
+def format_stress(name: str, requests_per_sec: float, latencies: List[float]) -> str:
+    p50, p99 = np.percentile(np.array(latencies) * 1000, [50, 99])
+    return f"{name}: {requests_per_sec:.0f} requests/sec, latency ms p50 {p50:.3f} p99 {p99:.3f}"
+
+
+def bench_stress(args: argparse.Namespace) -> None:
+    """
+    Requests per second from several concurrent clients. Against a running Unity if --port is
+    given, otherwise against local stand-in servers which tick every --fixed-delta-time, using
+    NetManager's drain policy, once for each --max-requests-per-tick
+    """
+    params_dict = json.loads(args.params) if args.params else None
+    if args.port is not None:
+        requests_per_sec, latencies = stress(
+            args.port,
+            num_clients=args.num_clients,
+            duration=args.duration,
+            transport=args.transport,
+            method=args.method,
+            params_dict=params_dict,
+            hostname=args.hostname,
+        )
+        print(format_stress(f"port {args.port}", requests_per_sec, latencies))
+        return
+
+    tick_budget = args.tick_budget_ms / 1000 if args.tick_budget_ms else None
+    for max_requests_per_tick in args.max_requests_per_tick:
+        with StandInServer(
+            methods={args.method: lambda **kwargs: True},
+            transport=args.transport,
+            fixed_delta_time=args.fixed_delta_time,
+            max_requests_per_tick=max_requests_per_tick,
+            tick_budget=tick_budget,
+        ) as server:
+            requests_per_sec, latencies = stress(
+                server.port,
+                num_clients=args.num_clients,
+                duration=args.duration,
+                transport=args.transport,
+                method=args.method,
+                params_dict=params_dict,
+            )
+        print(
+            format_stress(
+                f"max_requests_per_tick={max_requests_per_tick}",
+                requests_per_sec,
+                latencies,
+            )
+        )
+
+
+def run_clients(
+    mode: str,
+    port: int,
+    num_calls: int,
+    transport: str = "http",
+    num_clients: int = 4,
+    batch_size: int = 8,
+) -> Tuple[float, List[float]]:
+    """
+    Sends num_calls rlSteps to the server on port, using one of the CLIENT_MODES:
+    - single: one UnityComms, one call at a time
+    - batch: one UnityComms, sending batch_size calls per round trip, using rpc_batch
+    - threaded: num_clients threads, each with its own UnityComms
+    - async: num_clients AsyncUnityComms, on one event loop. http only
+
+    :return: rlSteps per second, and the latency of each round trip, in seconds
+    """
+    actions = ["nop", "forward", "rotateLeft"]
+    start = time.perf_counter()
+    latencies: List[float]
+    if mode == "single":
+        comms = UnityComms(port=port, transport=transport)
+        latencies = time_calls(lambda: comms.rlStep(actions=actions), num_calls)
+        comms.transport.close()
+    elif mode == "batch":
+        comms = UnityComms(port=port, transport=transport)
+        calls = [RpcCall("rlStep", {"actions": actions})] * batch_size
+        latencies = time_calls(
+            lambda: comms.rpc_batch(calls), max(1, num_calls // batch_size)
+        )
+        num_calls = len(latencies) * batch_size
+        comms.transport.close()
+    elif mode == "threaded":
+        client_latencies: List[List[float]] = [[] for _ in range(num_clients)]
+
+        def run_client(latencies: List[float]) -> None:
+            comms = UnityComms(port=port, transport=transport)
+            latencies += time_calls(
+                lambda: comms.rlStep(actions=actions), num_calls // num_clients
+            )
+            comms.transport.close()
+
+        threads = [
+            threading.Thread(target=run_client, args=(latencies,))
+            for latencies in client_latencies
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        latencies = [latency for client in client_latencies for latency in client]
+        num_calls = len(latencies)
+    elif mode == "async":
+        if transport != "http":
+            raise ValueError("AsyncUnityComms only supports http")
+        latencies = asyncio.run(
+            _run_async_clients(port, num_calls // num_clients, num_clients, actions)
+        )
+        num_calls = len(latencies)
+    else:
+        raise ValueError(f"Unknown mode {mode}, should be one of {CLIENT_MODES}")
+    return num_calls / (time.perf_counter() - start), latencies
+
+
+async def _run_async_clients(
+    port: int, num_calls: int, num_clients: int, actions: List[str]
+) -> List[float]:
+    async def run_client(comms: AsyncUnityComms) -> List[float]:
+        latencies = []
+        for _ in range(num_calls):
+            start = time.perf_counter()
+            await comms.rlStep(actions=actions)
+            latencies.append(time.perf_counter() - start)
+        await comms.close()
+        return latencies
+
+    client_latencies = await asyncio.gather(
+        *[run_client(AsyncUnityComms(port=port)) for _ in range(num_clients)]
+    )
+    return [latency for client in client_latencies for latency in client]
+
+
+def format_calls(name: str, calls_per_sec: float, latencies: List[float]) -> str:
+    p50, p90, p99 = np.percentile(np.array(latencies) * 1000, [50, 90, 99])
+    return (
+        f"{name}: {calls_per_sec:.0f} calls/sec, latency ms p50 {p50:.3f} p90 {p90:.3f}"
+        f" p99 {p99:.3f}"
+    )
+
+
+def bench_clients(args: argparse.Namespace) -> None:
+    """
+    rlStep calls per second, and round-trip latency, for single, batched, threaded and async
+    clients, against a stand-in server returning DungeonEscape-sized rlStep results, in this
+    process, or, with --out-of-process, in its own process. Against a running Unity if --port
+    is given
+    """
+    with ExitStack() as stack:
+        port = args.port
+        if port is None and args.out_of_process:
+            port = find_free_ports(1)[0]
+            extra_args = [
+                "--num-players",
+                str(args.num_players),
+                "--ray-resolution",
+                str(args.ray_resolution),
+                "--empty-response-every",
+                str(args.empty_response_every),
+            ]
+            if args.fixed_delta_time is not None:
+                extra_args += [
+                    "--fixed-delta-time",
+                    str(args.fixed_delta_time),
+                    "--max-requests-per-tick",
+                    str(args.max_requests_per_tick),
+                ]
+            stack.enter_context(
+                StandInServerProcess(port, args.transport, extra_args=extra_args)
+            )
+        elif port is None:
+            server = stack.enter_context(
+                StandInServer(
+                    methods=rl_methods(
+                        num_players=args.num_players, ray_resolution=args.ray_resolution
+                    ),
+                    transport=args.transport,
+                    fixed_delta_time=args.fixed_delta_time,
+                    max_requests_per_tick=args.max_requests_per_tick,
+                    empty_response_every=args.empty_response_every,
+                )
+            )
+            port = server.port
+        for mode in args.modes:
+            if mode == "async" and args.transport != "http":
+                print("async: skipped, AsyncUnityComms only supports http")
+                continue
+            run = partial(
+                run_clients,
+                mode,
+                port=port,
+                transport=args.transport,
+                num_clients=args.num_clients,
+                batch_size=args.batch_size,
+            )
+            run(num_calls=args.warmup)
+            calls_per_sec, latencies = run(num_calls=args.num_calls)
+            print(format_calls(mode, calls_per_sec, latencies))
+
+
+def bench_vec_env(args: argparse.Namespace) -> None:
+    """
+    Steps per second of stable baselines 3's SubprocVecEnv vs SharedMemoryVecEnv, with stand-in
+    envs returning DungeonEscape-sized observations. Needs stable_baselines3.
+    """
+    from stable_baselines3.common.vec_env import SubprocVecEnv
+
+    from peaceful_pie.vec_env import SharedMemoryVecEnv
+
+    def make_env() -> StandInEnv:
+        return StandInEnv(obs_size=args.obs_size, episode_length=args.episode_length)
+
+    for name, VecEnvClass in [
+        ("SubprocVecEnv", SubprocVecEnv),
+        ("SharedMemoryVecEnv", SharedMemoryVecEnv),
+    ]:
+        vec_env = VecEnvClass([make_env] * args.num_envs, start_method="fork")
+        vec_env.reset()
+        actions = np.stack(
+            [vec_env.action_space.sample() for _ in range(args.num_envs)]
+        )
+        time_calls(lambda: vec_env.step(actions), args.warmup)
+        latencies = time_calls(lambda: vec_env.step(actions), args.num_steps)
+        print(format_latencies(name, latencies))
+        vec_env.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    transports_parser = subparsers.add_parser(
+        "transports", help=bench_transports.__doc__
+    )
+    transports_parser.add_argument(
+        "--transports", type=str, nargs="+", default=["http", "tcp"]
+    )
+    transports_parser.add_argument("--num-calls", type=int, default=2000)
+    transports_parser.add_argument("--warmup", type=int, default=100)
+    transports_parser.set_defaults(func=bench_transports)
+
+    stress_parser = subparsers.add_parser("stress", help=bench_stress.__doc__)
+    stress_parser.add_argument(
+        "--port", type=int, help="Stress this server, rather than stand-ins"
+    )
+    stress_parser.add_argument("--hostname", type=str, default="localhost")
+    stress_parser.add_argument(
+        "--transport", type=str, default="http", choices=["http", "tcp"]
+    )
+    stress_parser.add_argument("--method", type=str, default="getAutosimulation")
+    stress_parser.add_argument(
+        "--params", type=str, help="json params for each call, e.g. '{\"a\": 1}'"
+    )
+    stress_parser.add_argument("--num-clients", type=int, default=8)
+    stress_parser.add_argument("--duration", type=float, default=5.0)
+    stress_parser.add_argument(
+        "--fixed-delta-time",
+        type=float,
+        default=0.02,
+        help="Stand-in tick interval. 0.02 is Unity's default FixedDeltaTime",
+    )
+    stress_parser.add_argument(
+        "--max-requests-per-tick", type=int, nargs="+", default=[1, 8, 0]
+    )
+    stress_parser.add_argument("--tick-budget-ms", type=float, default=0.0)
+    stress_parser.set_defaults(func=bench_stress)
+
+    clients_parser = subparsers.add_parser("clients", help=bench_clients.__doc__)
+    clients_parser.add_argument("--modes", type=str, nargs="+", default=CLIENT_MODES)
+    clients_parser.add_argument(
+        "--port", type=int, help="Benchmark this server, rather than a stand-in"
+    )
+    clients_parser.add_argument(
+        "--transport", type=str, default="http", choices=["http", "tcp"]
+    )
+    clients_parser.add_argument("--out-of-process", action="store_true")
+    clients_parser.add_argument("--num-players", type=int, default=3)
+    clients_parser.add_argument("--ray-resolution", type=int, default=5)
+    clients_parser.add_argument("--num-calls", type=int, default=2000)
+    clients_parser.add_argument("--warmup", type=int, default=100)
+    clients_parser.add_argument("--num-clients", type=int, default=4)
+    clients_parser.add_argument("--batch-size", type=int, default=8)
+    clients_parser.add_argument(
+        "--fixed-delta-time",
+        type=float,
+        help="Have the stand-in process requests in ticks, as NetManager. Default: no ticks",
+    )
+    clients_parser.add_argument("--max-requests-per-tick", type=int, default=1)
+    clients_parser.add_argument("--empty-response-every", type=int, default=0)
+    clients_parser.set_defaults(func=bench_clients)
+
+    vec_env_parser = subparsers.add_parser("vec-env", help=bench_vec_env.__doc__)
+    vec_env_parser.add_argument("--num-envs", type=int, default=8)
+    vec_env_parser.add_argument(
+        "--obs-size", type=int, default=276, help="276 is DungeonEscape's obs size"
+    )
+    vec_env_parser.add_argument("--episode-length", type=int, default=200)
+    vec_env_parser.add_argument("--num-steps", type=int, default=2000)
+    vec_env_parser.add_argument("--warmup", type=int, default=100)
+    vec_env_parser.set_defaults(func=bench_vec_env)
+
+    args = parser.parse_args()
+    args.func(args)
@@ -0,0 +1,215 @@
+import dataclasses
+import typing
+from functools import partial
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple, Type
+
+import chili
+
+# dataclass types we have generated a decoder/encoder for, or decided to leave to chili
+_decoders: Dict[Type, Callable[[Any], Any]] = {}
+_encoders: Dict[Type, Callable[[Any], Any]] = {}
+_building_decoders: Set[Type] = set()
+_building_encoders: Set[Type] = set()
+
+_PRIMITIVES = (int, float, str, bool)
+
+
+class _Unsupported(Exception):
+    pass
+
+
+def get_decoder(ResultClass: Type) -> Callable[[Any], Any]:
+    """
+    Returns a function which converts a json dict into ResultClass. The first time a dataclass
+    is seen, we generate python code specialized to its fields, and compile it. This is much
+    faster than chili.init_dataclass for nested types, such as lists of dataclasses. Fields we
+    cannot specialize, such as Unions or datetimes, use chili's strategy for that field. Classes
+    we cannot specialize at all fall back to chili.init_dataclass.
+    """
+    decoder = _decoders.get(ResultClass)
+    if decoder is None:
+        try:
+            decoder = _build_decoder(ResultClass)
+        except _Unsupported:
+            decoder = partial(_chili_decode, ResultClass=ResultClass)
+        _decoders[ResultClass] = decoder
+    return decoder
+
+
+def get_encoder(DataClass: Type) -> Callable[[Any], Any]:
+    """
+    Returns a function which converts an instance of DataClass into a json dict, as chili.asdict
+    does. Generated and cached on first use, like get_decoder.
+    """
+    encoder = _encoders.get(DataClass)
+    if encoder is None:
+        try:
+            encoder = _build_encoder(DataClass)
+        except _Unsupported:
+            encoder = chili.asdict
+        _encoders[DataClass] = encoder
+    return encoder
+
+
+def clear_cache() -> None:
+    _decoders.clear()
+    _encoders.clear()
+
+
+def _chili_decode(value: Any, ResultClass: Type) -> Any:
+    return chili.init_dataclass(value, ResultClass)
+
+
+def _get_field_types(DataClass: Type) -> List[Tuple[dataclasses.Field, Any]]:
+    if not dataclasses.is_dataclass(DataClass) or not isinstance(DataClass, type):
+        raise _Unsupported()
+    if getattr(DataClass, "__parameters__", None):
+        # generic dataclasses need chili's type parameter handling
+        raise _Unsupported()
+    fields = dataclasses.fields(DataClass)
+    if len(fields) != len(DataClass.__dataclass_fields__):  # type: ignore
+        # InitVars or ClassVars
+        raise _Unsupported()
+    try:
+        type_hints = typing.get_type_hints(DataClass)
+    except Exception:
+        raise _Unsupported()
+    return [(field, type_hints[field.name]) for field in fields]
+
+
+def _optional_arg(field_type: Any) -> Optional[Any]:
+    """
+    If field_type is Optional[X], returns X, otherwise None
+    """
+    if typing.get_origin(field_type) is typing.Union:
+        args = [arg for arg in typing.get_args(field_type) if arg is not type(None)]
+        if len(args) == 1 and len(typing.get_args(field_type)) == 2:
+            return args[0]
+    return None
+
+
+class _CodeGen:
+    """
+    Builds the expression which converts one field value, and collects the names the
+    expression refers to
+    """
+
+    def __init__(self, DataClass: Type, decode: bool) -> None:
+        self.DataClass = DataClass
+        self.decode = decode
+        self.namespace: Dict[str, Any] = {}
+        self.num_vars = 0
+
+    def add_name(self, value: Any) -> str:
+        name = f"_n{len(self.namespace)}"
+        self.namespace[name] = value
+        return name
+
+    def new_var(self) -> str:
+        self.num_vars += 1
+        return f"_v{self.num_vars}"
+
+    def convert(self, field_type: Any, expr: str) -> str:
+        if field_type is Any:
+            return expr
+        if field_type in _PRIMITIVES:
+            # when encoding, pass values through unchanged: int(2.7) would silently truncate
+            return f"{field_type.__name__}({expr})" if self.decode else expr
+        optional_arg = _optional_arg(field_type)
+        if optional_arg is not None:
+            # expr is always a dict lookup, attribute or variable, so is cheap to repeat
+            return f"(None if {expr} is None else {self.convert(optional_arg, expr)})"
+        origin = typing.get_origin(field_type)
+        args = typing.get_args(field_type)
+        if origin is list and len(args) == 1:
+            if args[0] in _PRIMITIVES:
+                if not self.decode:
+                    return f"list({expr})"
+                # map with a builtin runs in C, so is much faster than a comprehension
+                return f"list(map({args[0].__name__}, {expr}))"
+            var = self.new_var()
+            return f"[{self.convert(args[0], var)} for {var} in {expr}]"
+        if origin is dict and len(args) == 2 and args[0] is str:
+            key_var, var = self.new_var(), self.new_var()
+            return (
+                f"{{{key_var}: {self.convert(args[1], var)}"
+                f" for {key_var}, {var} in {expr}.items()}}"
+            )
+        if (
+            dataclasses.is_dataclass(field_type)
+            and isinstance(field_type, type)
+            and typing.get_origin(field_type) is None
+        ):
+            return f"{self.add_name(self.nested(field_type))}({expr})"
+        # anything else, e.g. NDArray, Union, datetime, Enum: use chili's strategy
+        try:
+            strategy = chili.registry.get_for(
+                field_type, module=self.DataClass.__module__
+            )
+        except Exception:
+            raise _Unsupported()
+        method = strategy.hydrate if self.decode else strategy.extract
+        return f"{self.add_name(method)}({expr})"
+
+    def nested(self, DataClass: Type) -> Callable[[Any], Any]:
+        building = _building_decoders if self.decode else _building_encoders
+        cache = _decoders if self.decode else _encoders
+        if DataClass in building:
+            # recursive type: look up the decoder once it has been built
+            return lambda value: cache[DataClass](value)
+        return get_decoder(DataClass) if self.decode else get_encoder(DataClass)
+
+
+def _compile(
+    func_name: str, lines: List[str], namespace: Dict[str, Any]
+) -> Callable[[Any], Any]:
+    source = "\n".join(lines)
+    exec(compile(source, f"<peaceful_pie {func_name}>", "exec"), namespace)
+    return namespace[func_name]
+
+
+def _build_decoder(ResultClass: Type) -> Callable[[Any], Any]:
+    field_types = _get_field_types(ResultClass)
+    _building_decoders.add(ResultClass)
+    try:
+        codegen = _CodeGen(ResultClass, decode=True)
+        cls_name = codegen.add_name(ResultClass)
+        args = []
+        for field, field_type in field_types:
+            if not field.init:
+                continue
+            value_expr = codegen.convert(field_type, f"d[{field.name!r}]")
+            if field.default_factory is not dataclasses.MISSING:  # type: ignore
+                factory_name = codegen.add_name(field.default_factory)  # type: ignore
+                value_expr = (
+                    f"({value_expr} if {field.name!r} in d else {factory_name}())"
+                )
+            elif field.default is not dataclasses.MISSING:
+                default_name = codegen.add_name(field.default)
+                value_expr = (
+                    f"({value_expr} if {field.name!r} in d else {default_name})"
+                )
+            elif _optional_arg(field_type) is not None:
+                value_expr = f"({value_expr} if {field.name!r} in d else None)"
+            args.append(f"        {field.name}={value_expr},")
+        func_name = f"decode_{ResultClass.__name__}"
+        lines = [f"def {func_name}(d):", f"    return {cls_name}(", *args, "    )"]
+        return _compile(func_name, lines, codegen.namespace)
+    finally:
+        _building_decoders.discard(ResultClass)
+
+
+def _build_encoder(DataClass: Type) -> Callable[[Any], Any]:
+    field_types = _get_field_types(DataClass)
+    _building_encoders.add(DataClass)
+    try:
+        codegen = _CodeGen(DataClass, decode=False)
+        items = []
+        for field, field_type in field_types:
+            value_expr = codegen.convert(field_type, f"o.{field.name}")
+            items.append(f"        {field.name!r}: {value_expr},")
+        func_name = f"encode_{DataClass.__name__}"
+        lines = [f"def {func_name}(o):", "    return {", *items, "    }"]
+        return _compile(func_name, lines, codegen.namespace)
+    finally:
+        _building_encoders.discard(DataClass)
@@ -0,0 +1,118 @@
+from typing import Optional, Tuple
+
+import numpy as np
+from numpy.typing import ArrayLike, DTypeLike, NDArray
+
+from peaceful_pie.ray_results_helper import AnyRayResults, RayFeatureEncoder
+
+
+class FrameStack:
+    """
+    Keeps the last num_frames observations, e.g. ray features, for policies which need a short
+    history. Each frame is written twice into a preallocated slab of 2 * num_frames frames, at
+    slot i and slot i + num_frames, so that the last num_frames frames are always a contiguous
+    slice of the slab. Pushing a frame thus costs O(frame), however many frames are stacked, and
+    the stacked frames are returned as a view, without copying, e.g.
+
+    frame_stack = FrameStack(num_frames=4, frame_shape=obs.shape)
+    stacked = frame_stack.reset(env.reset())
+    while True:
+        obs, reward, done, info = env.step(policy(stacked))
+        stacked = frame_stack.reset(env.reset()) if done else frame_stack.push(obs)
+
+    The returned view, of shape (num_frames, *frame_shape), oldest first, is overwritten by the
+    next push or reset. Use copy() if you need to keep it, e.g. in a replay buffer.
+    """
+
+    def __init__(
+        self,
+        num_frames: int,
+        frame_shape: Tuple[int, ...],
+        dtype: DTypeLike = np.float32,
+        pad_with_first: bool = False,
+    ) -> None:
+        """
+        :param num_frames: int How many frames to stack
+        :param frame_shape: Tuple[int, ...] Shape of each frame
+        :param dtype: DTypeLike
+        :param pad_with_first: bool On reset, fill the history with the first frame, as gym's
+            FrameStack does, rather than with zeros, as stable baselines 3's VecFrameStack does
+        """
+        if num_frames < 1:
+            raise ValueError(f"num_frames should be at least 1, not {num_frames}")
+        self.num_frames = num_frames
+        self.frame_shape = tuple(frame_shape)
+        self.pad_with_first = pad_with_first
+        self.slab: NDArray = np.zeros((2 * num_frames, *self.frame_shape), dtype=dtype)
+        # slot holding the newest frame
+        self.slot = num_frames - 1
+
+    @property
+    def frames(self) -> NDArray:
+        """
+        View of the stacked frames, of shape (num_frames, *frame_shape), oldest first
+        """
+        return self.slab[self.slot + 1 : self.slot + 1 + self.num_frames]
+
+    def copy(self) -> NDArray:
+        """
+        Returns the stacked frames as a new contiguous array, which later pushes do not change
+        """
+        return self.frames.copy()
+
+    def _next_slot(self) -> int:
+        return (self.slot + 1) % self.num_frames
+
+    def _commit(self, slot: int) -> NDArray:
+        """
+        Makes the frame written at slot the newest, and mirrors it into the second half of the
+        slab
+        """
+        self.slot = slot
+        self.slab[slot + self.num_frames] = self.slab[slot]
+        return self.frames
+
+    def push(self, frame: ArrayLike) -> NDArray:
+        """
+        Adds frame as the newest frame, dropping the oldest
+
+        :return: NDArray view of the stacked frames. See frames
+        """
+        slot = self._next_slot()
+        self.slab[slot] = frame
+        return self._commit(slot)
+
+    def push_ray_results(
+        self,
+        ray_results: AnyRayResults,
+        encoder: Optional[RayFeatureEncoder] = None,
+    ) -> NDArray:
+        """
+        Encodes ray_results straight into the slab, without an intermediate array. frame_shape
+        should be (num_channels, X, Y), and dtype float32
+
+        :param encoder: Optional[RayFeatureEncoder] Defaults to the 'inverse' encoding, as for
+            ray_results_to_feature_np
+        """
+        if encoder is None:
+            encoder = RayFeatureEncoder(ray_results.NumObjectTypes)
+        slot = self._next_slot()
+        encoder.encode(
+            ray_results.rayDistances, ray_results.rayHitObjectTypes, out=self.slab[slot]
+        )
+        return self._commit(slot)
+
+    def reset(self, frame: Optional[ArrayLike] = None) -> NDArray:
+        """
+        Clears the history, e.g. at the end of an episode, then pushes frame, if provided. The
+        history is filled with frame if pad_with_first, otherwise with zeros.
+
+        :return: NDArray view of the stacked frames. See frames
+        """
+        if frame is not None and self.pad_with_first:
+            self.slab[:] = frame
+            return self.frames
+        self.slab.fill(0)
+        if frame is None:
+            return self.frames
+        return self.push(frame)
@@ -0,0 +1,244 @@
+import copy
+import datetime
+import threading
+from typing import Any, Dict, List, Optional
+
+# each power of two is split into this many linear sub-buckets, giving about 3% precision, as
+# for an HDR histogram with 2 significant figures
+_SUB_BUCKET_BITS = 5
+_SUB_BUCKET_COUNT = 1 << _SUB_BUCKET_BITS
+# values are recorded in whole microseconds, up to 2 ** 40 us, i.e. about 12 days
+_MAX_EXPONENT = 40
+_NUM_BUCKETS = (_MAX_EXPONENT + 1) * _SUB_BUCKET_COUNT
+
+
+class LatencyHistogram:
+    """
+    Log-linear histogram of latencies, in the style of HdrHistogram. Recording is O(1), and
+    memory is fixed, whatever the number of values recorded. Percentiles are accurate to within
+    about 3%.
+    """
+
+    def __init__(self) -> None:
+        self.counts = [0] * _NUM_BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.min = float("inf")
+        self.max = 0.0
+
+    @staticmethod
+    def _bucket_idx(value_us: int) -> int:
+        if value_us < _SUB_BUCKET_COUNT:
+            return value_us
+        # value_us >> exponent is in [_SUB_BUCKET_COUNT / 2, _SUB_BUCKET_COUNT)
+        exponent = value_us.bit_length() - _SUB_BUCKET_BITS
+        idx = exponent * _SUB_BUCKET_COUNT + (value_us >> exponent)
+        return min(idx, _NUM_BUCKETS - 1)
+
+    @staticmethod
+    def _bucket_value(idx: int) -> float:
+        """
+        Returns the midpoint of bucket idx, in seconds
+        """
+        if idx < _SUB_BUCKET_COUNT:
+            return idx / 1e6
+        exponent, sub_bucket = divmod(idx, _SUB_BUCKET_COUNT)
+        return ((sub_bucket << exponent) + (1 << exponent) / 2) / 1e6
+
+    def record(self, seconds: float) -> None:
+        self.counts[self._bucket_idx(int(seconds * 1e6))] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds < self.min:
+            self.min = seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, percentile: float) -> float:
+        """
+        :param percentile: float e.g. 99 for p99
+        :return: float the latency at that percentile, in seconds. 0 if nothing was recorded
+        """
+        if self.count == 0:
+            return 0.0
+        target = max(1, int(round(self.count * percentile / 100)))
+        if target >= self.count:
+            return self.max
+        seen = 0
+        for idx, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return min(max(self._bucket_value(idx), self.min), self.max)
+        return self.max
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count > 0 else 0.0
+
+    def snapshot(self) -> Dict[str, float]:
+        """
+        Summary of the recorded latencies, in seconds
+        """
+        return {
+            "count": self.count,
+            "mean": self.mean,
+            "min": self.min if self.count > 0 else 0.0,
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+            "p99": self.percentile(99),
+            "max": self.max,
+        }
+
+
+class MethodStats:
+    """
+    Counters, and a latency histogram per phase, for one rpc method
+    """
+
+    def __init__(self) -> None:
+        self.counters: Dict[str, int] = {}
+        self.histograms: Dict[str, LatencyHistogram] = {}
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "counters": dict(self.counters),
+            "latencies": {
+                phase: histogram.snapshot()
+                for phase, histogram in self.histograms.items()
+            },
+        }
+
+
+class CommsMetrics:
+    """
+    Per-method counters and latency histograms, collected by UnityComms. Phases are:
+    - serialize: encoding params, and the json dump
+    - network: sending the request, and receiving the response, for the final attempt
+    - parse: parsing the json response
+    - decode: converting the result into ResultClass
+    - total: the whole call, including any retries
+
+    If NetManager echoes its timings (see UnityComms.set_echo_timings), there are also:
+    - server_queue_wait: waiting in NetManager for FixedUpdate
+    - server_handler: processing the request in Unity, including json rpc parsing, and
+      serializing the reply to json
+    - server_encode: utf-8 encoding the reply
+    - transport: network, less the three server phases
+
+    Counters are 'calls', 'retries' (failed attempts which were retried), 'empty_skips'
+    (empty responses, which are retried), 'timeouts' (attempts which timed out), and 'errors'
+    (CSExceptions).
+    """
+
+    def __init__(self, enabled: bool = True) -> None:
+        self.enabled = enabled
+        self._methods: Dict[str, MethodStats] = {}
+        self._init_threading()
+
+    def _init_threading(self) -> None:
+        self._lock = threading.Lock()
+        self._dump_thread: Optional[threading.Thread] = None
+        self._dump_stop = threading.Event()
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # locks and threads cannot be pickled, so the unpickled copy gets its own lock, and
+        # does not dump periodically
+        with self._lock:
+            state = self.__dict__.copy()
+            state["_methods"] = copy.deepcopy(self._methods)
+        del state["_lock"], state["_dump_thread"], state["_dump_stop"]
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        self._init_threading()
+
+    def _method_stats(self, method: str) -> MethodStats:
+        method_stats = self._methods.get(method)
+        if method_stats is None:
+            method_stats = self._methods[method] = MethodStats()
+        return method_stats
+
+    def record(self, method: str, phase: str, seconds: float) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            histograms = self._method_stats(method).histograms
+            histogram = histograms.get(phase)
+            if histogram is None:
+                histogram = histograms[phase] = LatencyHistogram()
+            histogram.record(seconds)
+
+    def count(self, method: str, counter: str, n: int = 1) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            counters = self._method_stats(method).counters
+            counters[counter] = counters.get(counter, 0) + n
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Returns {method: {"counters": {...}, "latencies": {phase: {"p50": ..., ...}}}}.
+        Latencies are in seconds
+        """
+        with self._lock:
+            return {
+                method: method_stats.snapshot()
+                for method, method_stats in self._methods.items()
+            }
+
+    def reset(self) -> None:
+        with self._lock:
+            self._methods = {}
+
+    def format(self) -> str:
+        """
+        Returns the snapshot as a table, with latencies in milliseconds
+        """
+        lines: List[str] = []
+        for method, method_stats in sorted(self.snapshot().items()):
+            counters = " ".join(
+                f"{name}={value}"
+                for name, value in sorted(method_stats["counters"].items())
+            )
+            lines.append(f"{method}: {counters}")
+            for phase, latencies in method_stats["latencies"].items():
+                lines.append(
+                    f"    {phase:<16} n={latencies['count']:<8} "
+                    + " ".join(
+                        f"{key}={latencies[key] * 1000:.3f}"
+                        for key in ["mean", "p50", "p90", "p99", "max"]
+                    )
+                )
+        return "\n".join(lines)
+
+    def start_periodic_dump(
+        self, interval: float, logfile: Optional[str] = None
+    ) -> None:
+        """
+        Prints the formatted stats every interval seconds, from a background thread, or
+        appends them to logfile, if provided
+        """
+        self.stop_periodic_dump()
+        self._dump_stop.clear()
+
+        def dump() -> None:
+            while not self._dump_stop.wait(interval):
+                datetime_str = datetime.datetime.now().strftime("%Y%m%d %H%M%S")
+                text = f"{datetime_str}: UnityComms stats\n{self.format()}\n"
+                if logfile is not None:
+                    with open(logfile, "a") as f:
+                        f.write(text)
+                else:
+                    print(text, end="")
+
+        self._dump_thread = threading.Thread(
+            target=dump, name="CommsMetrics-dump", daemon=True
+        )
+        self._dump_thread.start()
+
+    def stop_periodic_dump(self) -> None:
+        if self._dump_thread is not None:
+            self._dump_stop.set()
+            self._dump_thread.join()
+            self._dump_thread = None
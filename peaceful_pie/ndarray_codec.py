@@ -0,0 +1,73 @@
+import base64
+from typing import Any, Dict, Optional
+
+import chili
+import numpy as np
+from numpy.typing import DTypeLike, NDArray
+
+# dtypes that dataclass fields can be annotated with, as NDArray[dtype], and be filled by chili
+SUPPORTED_DTYPES = [
+    np.float32,
+    np.float64,
+    np.int8,
+    np.int16,
+    np.int32,
+    np.int64,
+    np.uint8,
+    np.bool_,
+]
+
+
+def encode_ndarray(array: NDArray) -> Dict[str, Any]:
+    """
+    Encodes array as {"dtype": ..., "shape": [...], "data": base64 of the little-endian buffer},
+    which is the format that EncodedArray uses on the C# side
+    """
+    array = np.ascontiguousarray(array)
+    array = array.astype(array.dtype.newbyteorder("<"), copy=False)
+    return {
+        "dtype": array.dtype.str,
+        "shape": list(array.shape),
+        "data": base64.b64encode(array.tobytes()).decode("ascii"),
+    }
+
+
+def decode_ndarray(value: Any, dtype: Optional[DTypeLike] = None) -> NDArray:
+    """
+    Decodes an array encoded by encode_ndarray, or by EncodedArray on the C# side, without
+    copying the decoded buffer. The returned array is read-only. Plain (nested) lists are also
+    accepted, and converted with np.asarray, straight into dtype, if provided.
+
+    :param dtype: Optional[DTypeLike] If provided, the result is converted to this dtype, if
+        it is not already
+    """
+    if isinstance(value, dict):
+        array = np.frombuffer(
+            base64.b64decode(value["data"]), dtype=np.dtype(value["dtype"])
+        ).reshape(value["shape"])
+        if dtype is not None:
+            array = array.astype(dtype, copy=False)
+        return array
+    # converting straight to dtype avoids building an intermediate float64 or int64 array
+    return np.asarray(value, dtype=dtype)
+
+
+class NDArrayStrategy(chili.HydrationStrategy):
+    """
+    Lets chili fill dataclass fields annotated as NDArray[dtype]
+    """
+
+    def __init__(self, dtype: Optional[DTypeLike] = None) -> None:
+        self.dtype = dtype
+
+    def hydrate(self, value: Any) -> Any:
+        return decode_ndarray(value, dtype=self.dtype)
+
+    def extract(self, value: Any) -> Any:
+        return encode_ndarray(value)
+
+
+def register_chili_strategies() -> None:
+    chili.registry.add(np.ndarray, NDArrayStrategy())
+    for dtype in SUPPORTED_DTYPES:
+        chili.registry.add(NDArray[dtype], NDArrayStrategy(dtype))  # type: ignore
@@ -1,8 +1,9 @@
 from dataclasses import dataclass
-from typing import List
+from functools import lru_cache
+from typing import List, Optional, Sequence, Tuple, Union
 
 import numpy as np
-from numpy.typing import NDArray
+from numpy.typing import ArrayLike, NDArray
 
 
 @dataclass
@@ -12,8 +13,311 @@ class RayResults:
     NumObjectTypes: int
 
 
+@dataclass
+class EncodedRayResults:
+    """
+    Python side of EncodedRayResults, returned by RayCasts.GetEncodedObservation() on the C# side.
+    The distances and object types are sent as base64-encoded little-endian buffers, and are
+    decoded straight into numpy arrays by UnityComms, when used as (part of) a ResultClass
+    """
+
+    rayDistances: NDArray[np.float32]
+    rayHitObjectTypes: NDArray[np.int16]
+    NumObjectTypes: int
+
+
+@dataclass
+class ArrayRayResults:
+    """
+    Same fields as RayResults, but held as numpy arrays. When used as (part of) a ResultClass,
+    UnityComms decodes the plain json lists sent by RayCasts.GetObservation() straight into
+    float32 and int16 arrays, rather than first building a python float or int for every ray.
+    Also accepts the encoded arrays sent by RayCasts.GetEncodedObservation(). Uses __slots__,
+    since one is created per agent per step.
+    """
+
+    __slots__ = ("rayDistances", "rayHitObjectTypes", "NumObjectTypes")
+
+    rayDistances: NDArray[np.float32]
+    rayHitObjectTypes: NDArray[np.int16]
+    NumObjectTypes: int
+
+
+AnyRayResults = Union[RayResults, EncodedRayResults, ArrayRayResults]
+
+
+class RayDeltaError(Exception):
+    pass
+
+
+@dataclass
+class DeltaRayResults:
+    """
+    Python side of DeltaRayResults, returned by RayCasts.GetDeltaObservation() on the C# side.
+    Keyframes hold the whole grid, in rayDistances and rayHitObjectTypes. Other observations
+    hold only the rays which changed since the previous observation, in changedIdxs, indexed by
+    [x_idx * YResolution + y_idx], changedDistances and changedHitObjectTypes. Use RayDeltaState
+    to rebuild the full grid.
+    """
+
+    __slots__ = (
+        "isKeyframe",
+        "sequence",
+        "XResolution",
+        "YResolution",
+        "NumObjectTypes",
+        "rayDistances",
+        "rayHitObjectTypes",
+        "changedIdxs",
+        "changedDistances",
+        "changedHitObjectTypes",
+    )
+
+    isKeyframe: bool
+    # counts up by one with each observation from the same RayCasts
+    sequence: int
+    XResolution: int
+    YResolution: int
+    NumObjectTypes: int
+    rayDistances: Optional[NDArray[np.float32]]
+    rayHitObjectTypes: Optional[NDArray[np.int16]]
+    changedIdxs: Optional[NDArray[np.int32]]
+    changedDistances: Optional[NDArray[np.float32]]
+    changedHitObjectTypes: Optional[NDArray[np.int16]]
+
+
+def apply_ray_delta(
+    distances: NDArray[np.float32],
+    object_types: NDArray[np.int16],
+    changed_idxs: NDArray,
+    changed_distances: NDArray,
+    changed_object_types: NDArray,
+) -> None:
+    """
+    Writes the changed rays into distances and object_types, in place
+
+    :param changed_idxs: NDArray of flat indices into distances and object_types
+    """
+    np.put(distances, changed_idxs, changed_distances)
+    np.put(object_types, changed_idxs, changed_object_types)
+
+
+class RayDeltaState:
+    """
+    Keeps the last full ray grid of one agent, and updates it in place from each
+    DeltaRayResults, e.g.
+
+    ray_delta_states = [RayDeltaState() for _ in range(num_players)]
+    ...
+    ray_results = ray_delta_states[i].apply(player_obs.rayResults)
+    features = ray_results_to_feature_np(ray_results)
+
+    Raises RayDeltaError if a delta does not follow on from the previous observation, e.g.
+    because a response was lost, after which we need a keyframe. See RayCasts.ResetDelta.
+    """
+
+    def __init__(self) -> None:
+        self.ray_results: Optional[ArrayRayResults] = None
+        self.sequence: Optional[int] = None
+
+    def apply(self, delta: DeltaRayResults) -> ArrayRayResults:
+        """
+        :return: ArrayRayResults whose arrays are updated in place by later calls
+        """
+        if delta.isKeyframe:
+            assert delta.rayDistances is not None
+            assert delta.rayHitObjectTypes is not None
+            shape = (delta.XResolution, delta.YResolution)
+            if self.ray_results is None or self.ray_results.rayDistances.shape != shape:
+                self.ray_results = ArrayRayResults(
+                    rayDistances=np.zeros(shape, dtype=np.float32),
+                    rayHitObjectTypes=np.zeros(shape, dtype=np.int16),
+                    NumObjectTypes=delta.NumObjectTypes,
+                )
+            self.ray_results.NumObjectTypes = delta.NumObjectTypes
+            self.ray_results.rayDistances[:] = np.reshape(delta.rayDistances, shape)
+            self.ray_results.rayHitObjectTypes[:] = np.reshape(
+                delta.rayHitObjectTypes, shape
+            )
+        else:
+            if self.ray_results is None or self.sequence is None:
+                raise RayDeltaError(
+                    f"Got delta {delta.sequence} before the first keyframe"
+                )
+            if delta.sequence != self.sequence + 1:
+                raise RayDeltaError(
+                    f"Got delta {delta.sequence}, but last observation was {self.sequence}"
+                )
+            assert delta.changedIdxs is not None
+            assert delta.changedDistances is not None
+            assert delta.changedHitObjectTypes is not None
+            apply_ray_delta(
+                self.ray_results.rayDistances,
+                self.ray_results.rayHitObjectTypes,
+                delta.changedIdxs,
+                delta.changedDistances,
+                delta.changedHitObjectTypes,
+            )
+        self.sequence = delta.sequence
+        return self.ray_results
+
+    def reset(self) -> None:
+        """
+        Forgets the last observation, so that the next must be a keyframe
+        """
+        self.sequence = None
+
+
+RAY_ENCODINGS = ["inverse", "clipped_inverse", "log", "normalized", "depth_bins"]
+
+
+@lru_cache(maxsize=64)
+def _channel_0_idxs(num_rays: int, grid_size: int, num_channels: int) -> NDArray:
+    """
+    For each ray, in a flattened (B, X, Y) grid, returns the flat index of its feature in
+    channel 0 of the (B, num_channels, X, Y) output. Cached per grid shape
+    """
+    ray_idxs = np.arange(num_rays, dtype=np.int64)
+    channel_0_idxs = (
+        ray_idxs // grid_size * num_channels * grid_size + ray_idxs % grid_size
+    )
+    channel_0_idxs.flags.writeable = False
+    return channel_0_idxs
+
+
+class RayFeatureEncoder:
+    """
+    Converts ray hit distances and object types into feature planes, one per object type, in
+    one vectorized pass: only the rays which hit something are encoded, and written straight
+    into the output. Rays with object type -1 give 0 in every plane. Encodings are:
+    - inverse: 1 / distance, so near 1 means nearby, and near 0 far away. Not bounded
+    - clipped_inverse: min(1 / distance, max_value)
+    - log: 1 - log(1 + distance) / log(1 + ray_length), in [0, 1], with 1 nearest
+    - normalized: 1 - distance / ray_length, in [0, 1], with 1 nearest
+    - depth_bins: num_bins planes per object type, splitting [0, ray_length] into equal bins,
+      with 1 in the bin the distance falls in, and 0 elsewhere
+
+    Nearer is always larger, so that 0 still means 'not seen'. ray_length should match
+    RayCasts.RayLength.
+    """
+
+    def __init__(
+        self,
+        num_object_types: int,
+        encoding: str = "inverse",
+        ray_length: Optional[float] = None,
+        max_value: float = 1.0,
+        num_bins: int = 8,
+    ) -> None:
+        """
+        :param num_object_types: int
+        :param encoding: str One of RAY_ENCODINGS
+        :param ray_length: Optional[float] Needed for 'log', 'normalized' and 'depth_bins'
+        :param max_value: float Upper bound, for 'clipped_inverse'
+        :param num_bins: int Bins per object type, for 'depth_bins'
+        """
+        if encoding not in RAY_ENCODINGS:
+            raise ValueError(
+                f"encoding should be one of {RAY_ENCODINGS}, not {encoding}"
+            )
+        if encoding in ["log", "normalized", "depth_bins"] and ray_length is None:
+            raise ValueError(f"Encoding {encoding} needs ray_length")
+        self.num_object_types = num_object_types
+        self.encoding = encoding
+        self.ray_length = ray_length
+        self.max_value = max_value
+        self.num_bins = num_bins
+        self.planes_per_type = num_bins if encoding == "depth_bins" else 1
+        self.num_channels = num_object_types * self.planes_per_type
+
+    def _encode_hits(
+        self, distances: NDArray, object_types: NDArray
+    ) -> Tuple[NDArray, Union[NDArray, float]]:
+        """
+        :return: the channel, and the feature value, for each of the hit rays
+        """
+        if self.encoding == "inverse":
+            return object_types, 1 / distances
+        if self.encoding == "clipped_inverse":
+            return object_types, np.minimum(1 / distances, self.max_value)
+        assert self.ray_length is not None
+        if self.encoding == "log":
+            return object_types, 1 - np.log1p(distances) / np.log1p(self.ray_length)
+        if self.encoding == "normalized":
+            return object_types, 1 - distances / self.ray_length
+        bins = np.clip(
+            (distances * (self.num_bins / self.ray_length)).astype(np.int64),
+            0,
+            self.num_bins - 1,
+        )
+        return object_types.astype(np.int64) * self.num_bins + bins, 1.0
+
+    def encode(
+        self,
+        distances: ArrayLike,
+        object_types: ArrayLike,
+        batch_ndim: int = 0,
+        out: Optional[NDArray[np.float32]] = None,
+    ) -> NDArray[np.float32]:
+        """
+        :param distances: NDArray of shape (*batch_shape, *grid_shape)
+        :param object_types: NDArray of the same shape, -1 where nothing was hit. Raises
+            ValueError if any is num_object_types or more
+        :param batch_ndim: int How many of the leading dimensions are batch dimensions, e.g. 1
+            for a stack of ray results, one per agent
+        :param out: Optional preallocated float32 array of shape
+            (*batch_shape, num_channels, *grid_shape), which will be overwritten, and returned
+        :return: NDArray of shape (*batch_shape, num_channels, *grid_shape)
+        """
+        distances_np = np.asarray(distances)
+        object_types_np = np.asarray(object_types)
+        batch_shape = distances_np.shape[:batch_ndim]
+        grid_shape = distances_np.shape[batch_ndim:]
+        out_shape = (*batch_shape, self.num_channels, *grid_shape)
+        if out is None:
+            out = np.zeros(out_shape, dtype=np.float32)
+        else:
+            if out.shape != out_shape or out.dtype != np.float32:
+                raise ValueError(
+                    f"out should be float32 of shape {out_shape}, but is {out.dtype} of shape"
+                    f" {out.shape}"
+                )
+            out.fill(0)
+        grid_size = int(np.prod(grid_shape))
+        flat_object_types = object_types_np.reshape(-1)
+        # an out of range type would otherwise be written silently into the next ray's planes
+        if (
+            flat_object_types.size > 0
+            and flat_object_types.max() >= self.num_object_types
+        ):
+            raise ValueError(
+                f"object types should be less than num_object_types {self.num_object_types},"
+                f" but got {flat_object_types.max()}"
+            )
+        hit_idxs = np.flatnonzero(flat_object_types >= 0)
+        channels, values = self._encode_hits(
+            distances_np.reshape(-1)[hit_idxs], flat_object_types[hit_idxs]
+        )
+        out_idxs = (
+            _channel_0_idxs(distances_np.size, grid_size, self.num_channels)[hit_idxs]
+            + np.asarray(channels, dtype=np.int64) * grid_size
+        )
+        if out.flags.c_contiguous:
+            out.reshape(-1)[out_idxs] = values
+        else:
+            # e.g. a view onto part of a larger observation buffer
+            np.put(out, out_idxs, values)
+        return out
+
+
+@lru_cache(maxsize=16)
+def _inverse_encoder(num_object_types: int) -> RayFeatureEncoder:
+    return RayFeatureEncoder(num_object_types)
+
+
 def ray_results_to_feature_np(
-    ray_results: RayResults,
+    ray_results: AnyRayResults,
+    encoder: Optional[RayFeatureEncoder] = None,
 ) -> NDArray[np.float32]:
     """
     Takes in the ray results, i.e. hit distances and object types,
@@ -27,26 +331,67 @@ def ray_results_to_feature_np(
     - near 0 => tag far away
     - near 1 => tag nearby
 
-    The number is not upper-bounded: we simply take the inverse of the distance. However, you can
-    always apply your own sigmoid or similar, to the output of this function, to bound it.
+    By default, the number is not upper-bounded: we simply take the inverse of the distance.
+    Pass in a RayFeatureEncoder for bounded encodings, such as 'clipped_inverse' or 'log'.
 
     In detail: the distances will be inverted, so that nearer gives a higher number, and further gives
     smaller. this number will be assigned to the output plane indexed by object type.
     If object type is -1, the output will be set to 0 across all output channels
     """
-    distances_np = np.array(ray_results.rayDistances)
-    distances_np = 1 / distances_np
-    object_types_np = np.array(ray_results.rayHitObjectTypes)
-    # add one feature plane for the object type of -1
-    _obs = np.zeros(
-        (ray_results.NumObjectTypes + 1, *distances_np.shape), dtype=np.float32
-    )
-    np.put_along_axis(
-        _obs,
-        np.expand_dims(object_types_np, axis=0),
-        np.expand_dims(distances_np, axis=0),
-        axis=0,
+    if encoder is None:
+        encoder = _inverse_encoder(ray_results.NumObjectTypes)
+    return encoder.encode(ray_results.rayDistances, ray_results.rayHitObjectTypes)
+
+
+def ray_arrays_to_feature_np_batch(
+    distances: NDArray,
+    object_types: NDArray,
+    num_object_types: int,
+    out: Optional[NDArray[np.float32]] = None,
+    encoder: Optional[RayFeatureEncoder] = None,
+) -> NDArray[np.float32]:
+    """
+    Batched version of ray_results_to_feature_np, for stacked ray results, e.g. from several
+    agents and/or several environments, in one vectorized pass.
+
+    :param distances: NDArray of shape (B, X, Y)
+    :param object_types: NDArray of shape (B, X, Y), -1 where nothing was hit
+    :param num_object_types: int
+    :param out: Optional preallocated float32 array of shape (B, num_channels, X, Y), which
+        will be overwritten, and returned. Avoids allocating a new array on each call
+    :param encoder: Optional[RayFeatureEncoder] Defaults to the 'inverse' encoding, with
+        num_channels = num_object_types
+    :return: NDArray of shape (B, num_channels, X, Y)
+    """
+    if encoder is None:
+        encoder = _inverse_encoder(num_object_types)
+    return encoder.encode(distances, object_types, batch_ndim=1, out=out)
+
+
+def ray_results_to_feature_np_batch(
+    ray_results_list: Sequence[AnyRayResults],
+    out: Optional[NDArray[np.float32]] = None,
+    encoder: Optional[RayFeatureEncoder] = None,
+) -> NDArray[np.float32]:
+    """
+    Runs ray_results_to_feature_np over a list of ray results, e.g. one per agent, in one
+    vectorized pass. All ray results should have the same resolution and NumObjectTypes.
+    See ray_arrays_to_feature_np_batch.
+
+    :return: NDArray of shape (len(ray_results_list), num_channels, X, Y)
+    """
+    if len(ray_results_list) == 0:
+        # without any ray results, we know neither the resolution nor the number of channels
+        raise ValueError("ray_results_list should not be empty")
+    num_object_types = ray_results_list[0].NumObjectTypes
+    if any(rr.NumObjectTypes != num_object_types for rr in ray_results_list):
+        raise ValueError("All ray results should have the same NumObjectTypes")
+    return ray_arrays_to_feature_np_batch(
+        distances=np.stack([np.asarray(rr.rayDistances) for rr in ray_results_list]),
+        object_types=np.stack(
+            [np.asarray(rr.rayHitObjectTypes) for rr in ray_results_list]
+        ),
+        num_object_types=num_object_types,
+        out=out,
+        encoder=encoder,
     )
-    # truncate off the not found object feature plane
-    _obs = _obs[:-1]
-    return _obs
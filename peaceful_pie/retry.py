@@ -0,0 +1,157 @@
+import random
+import time
+from dataclasses import dataclass
+from typing import FrozenSet, Optional
+
+from peaceful_pie.transports import ResponseLostError
+
+# methods which change Unity's state, so must not be re-sent if Unity might have processed them
+DEFAULT_NON_IDEMPOTENT_METHODS = frozenset({"rlStep", "rlStepBatch"})
+
+
+class RetriesExhaustedError(ConnectionError):
+    """
+    Raised when a call still fails after RetryPolicy.max_attempts attempts, or once its
+    RetryPolicy.deadline has passed
+    """
+
+
+class RpcTimeoutError(TimeoutError):
+    """
+    Raised when Unity does not respond within RetryPolicy.timeout, and the call cannot be
+    retried, e.g. because the method is not idempotent, or the retries are exhausted
+    """
+
+
+@dataclass
+class RetryPolicy:
+    """
+    How UnityComms and AsyncUnityComms retry failed calls, e.g. whilst Unity starts up, or
+    restarts. The wait between attempts grows exponentially from initial_backoff to
+    max_backoff, with +/- jitter, as a fraction, so that many clients do not retry in
+    lockstep. Empty responses are retried in the same way.
+
+    Methods in non_idempotent_methods change Unity's state, e.g. stepping the simulation, so
+    are only re-sent if the request cannot have reached Unity, i.e. if connecting failed. If the
+    connection is lost after sending, or the response times out, they raise instead.
+    """
+
+    initial_backoff: float = 0.05
+    max_backoff: float = 2.0
+    multiplier: float = 2.0
+    jitter: float = 0.2
+    # None means no limit
+    max_attempts: Optional[int] = None
+    # seconds from the start of the call, after which we stop retrying, and by which each
+    # attempt must have been answered. None means no limit
+    deadline: Optional[float] = None
+    # seconds to wait for each response. Passed to the transport. None waits forever, or until
+    # the deadline
+    timeout: Optional[float] = None
+    non_idempotent_methods: FrozenSet[str] = DEFAULT_NON_IDEMPOTENT_METHODS
+
+    def backoff(self, attempt: int) -> float:
+        """
+        :param attempt: int The attempt which just failed, counting from 1
+        :return: float seconds to wait before the next attempt
+        """
+        backoff = min(
+            self.max_backoff, self.initial_backoff * self.multiplier ** (attempt - 1)
+        )
+        return backoff * (1 + random.uniform(-self.jitter, self.jitter))
+
+    def attempt_timeout(self, elapsed: float) -> Optional[float]:
+        """
+        :param elapsed: float Seconds since the start of the call
+        :return: Optional[float] seconds to wait for the response to the next attempt, i.e.
+            timeout, cut short so as not to overrun the deadline
+        """
+        if self.deadline is None:
+            return self.timeout
+        # a zero timeout would make sockets non-blocking, rather than time out at once
+        remaining = max(self.deadline - elapsed, 0.001)
+        return remaining if self.timeout is None else min(self.timeout, remaining)
+
+    def is_idempotent(self, method: str) -> bool:
+        return method not in self.non_idempotent_methods
+
+
+class RetryState:
+    """
+    The attempts made so far by one call, under a RetryPolicy. UnityComms and AsyncUnityComms
+    use it to decide how long to wait for each attempt, and whether, and when, to retry a
+    failed one
+    """
+
+    def __init__(
+        self,
+        policy: RetryPolicy,
+        method: str,
+        idempotent: bool,
+        start_time: Optional[float] = None,
+    ) -> None:
+        """
+        :param method: str Name to use in error messages
+        :param idempotent: bool Whether the request may be re-sent after Unity might have
+            processed it
+        :param start_time: Optional[float] time.perf_counter() at the start of the call.
+            Defaults to now
+        """
+        self.policy = policy
+        self.method = method
+        self.idempotent = idempotent
+        self.start_time = time.perf_counter() if start_time is None else start_time
+        self.attempt = 0
+        self.timeout: Optional[float] = None
+
+    def start_attempt(self) -> Optional[float]:
+        """
+        :return: Optional[float] seconds to wait for the response to this attempt. See
+            RetryPolicy.attempt_timeout
+        """
+        self.attempt += 1
+        self.timeout = self.policy.attempt_timeout(
+            time.perf_counter() - self.start_time
+        )
+        return self.timeout
+
+    def timeout_error(self) -> RpcTimeoutError:
+        if self.timeout is None:
+            return RpcTimeoutError(f"{self.method} timed out")
+        return RpcTimeoutError(
+            f"{self.method} timed out after {self.timeout:.3g} seconds"
+        )
+
+    def on_failure(self, error: Optional[Exception]) -> float:
+        """
+        Raises if the failed attempt must not be retried: if Unity may have processed a
+        non-idempotent request, i.e. the response was lost, timed out, or was malformed, or if
+        the retries are exhausted
+
+        :param error: Optional[Exception] Why the attempt failed, or None for an empty response
+        :return: float seconds to wait before the next attempt
+        """
+        if not self.idempotent:
+            if isinstance(error, TimeoutError):
+                raise self.timeout_error() from error
+            if isinstance(error, (ResponseLostError, ValueError)):
+                raise error
+        backoff = self.policy.backoff(self.attempt)
+        elapsed = time.perf_counter() - self.start_time
+        out_of_time = (
+            self.policy.deadline is not None
+            and elapsed + backoff > self.policy.deadline
+        )
+        if out_of_time or (
+            self.policy.max_attempts is not None
+            and self.attempt >= self.policy.max_attempts
+        ):
+            last_error = "empty response" if error is None else error
+            message = (
+                f"{self.method} failed after {self.attempt} attempts, in {elapsed:.1f}"
+                f" seconds. Last error: {last_error}"
+            )
+            if isinstance(error, TimeoutError):
+                raise RpcTimeoutError(message) from error
+            raise RetriesExhaustedError(message) from error
+        return backoff
@@ -0,0 +1,364 @@
+import argparse
+import json
+import os
+import signal
+import socket
+import socketserver
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from os import path
+from typing import Any, Dict, List, Optional, Sequence, Set
+
+from peaceful_pie.server_pool import UnityServer, UnityServerPool
+from peaceful_pie.unity_comms import RpcCall, UnityComms
+
+DEFAULT_REGISTRY_PATH = path.join(
+    path.expanduser("~"), ".peaceful_pie", "server_daemon.json"
+)
+
+
+class ServerDaemonError(Exception):
+    pass
+
+
+class _ControlServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+class ServerDaemon:
+    """
+    Long-lived supervisor, holding dedicated servers which have already started, and been
+    initialized, so that short jobs, such as evaluations or hyperparameter sweeps, can lease
+    one, rather than waiting for Unity to boot. Run it using e.g.
+
+    python -m peaceful_pie.server_daemon --server-executable-path [path] --num-servers 4 \\
+        --init-call rlInitAi '{"accel": 1.0, "frame_skip": 0}'
+
+    then, in each job:
+
+    with ServerLease() as lease:
+        comms = lease.create_comms()
+
+    Clients find the daemon through a registry file, holding the port of the daemon's control
+    socket. Each lease lasts as long as the client's connection to the control socket, so a
+    crashed client returns its server too. Returned servers are reset, by running reset_calls,
+    before being leased again.
+    """
+
+    def __init__(
+        self,
+        server_executable_path: str,
+        num_servers: int,
+        registry_path: str = DEFAULT_REGISTRY_PATH,
+        transport: str = "http",
+        init_calls: Sequence[RpcCall] = (),
+        reset_calls: Sequence[RpcCall] = (RpcCall("reset"),),
+        extra_args: Optional[Sequence[str]] = None,
+        health_check_interval: float = 5.0,
+    ) -> None:
+        """
+        :param server_executable_path: str Path to dedicated server executable
+        :param num_servers: int How many servers to keep warm
+        :param registry_path: str Where to write the registry file, that clients read
+        :param transport: str 'http' or 'tcp'
+        :param init_calls: Sequence[RpcCall] Calls to make on each server once it has started,
+            or restarted, e.g. RpcCall('rlInitAi', {'accel': 1.0, 'frame_skip': 0})
+        :param reset_calls: Sequence[RpcCall] Calls to make on each server when it is returned
+        :param extra_args: Optional[Sequence[str]] Further commandline arguments for every server
+        :param health_check_interval: float Seconds between health checks. See UnityServerPool
+        """
+        self.registry_path = registry_path
+        self.init_calls = list(init_calls)
+        self.reset_calls = list(reset_calls)
+        self.pool = UnityServerPool(
+            server_executable_path,
+            num_servers=num_servers,
+            transport=transport,
+            extra_args=extra_args,
+            health_check_interval=health_check_interval,
+            on_restart=self._on_restart,
+        )
+        self.comms: List[UnityComms] = []
+        self._free: List[int] = []
+        # servers which could be neither reset nor restarted, held back until the health check
+        # restarts them
+        self._broken: Set[int] = set()
+        self._cond = threading.Condition()
+        self._control_server: Optional[_ControlServer] = None
+        self._control_thread: Optional[threading.Thread] = None
+
+    def start(self) -> "ServerDaemon":
+        self.pool.start()
+        self.comms = self.pool.create_comms()
+        with ThreadPoolExecutor(max_workers=len(self.comms)) as executor:
+            list(executor.map(self._init_server, range(len(self.comms))))
+        with self._cond:
+            self._free = list(range(len(self.comms)))
+        daemon = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self) -> None:
+                daemon._handle_client(self.rfile, self.wfile)
+
+        self._control_server = _ControlServer(("localhost", 0), Handler)
+        self._control_thread = threading.Thread(
+            target=self._control_server.serve_forever,
+            kwargs={"poll_interval": 0.05},
+            daemon=True,
+        )
+        self._control_thread.start()
+        self._write_registry()
+        return self
+
+    @property
+    def control_port(self) -> int:
+        assert self._control_server is not None
+        return self._control_server.server_address[1]
+
+    @property
+    def num_free(self) -> int:
+        with self._cond:
+            return len(self._free)
+
+    def _write_registry(self) -> None:
+        os.makedirs(path.dirname(path.abspath(self.registry_path)), exist_ok=True)
+        registry = {
+            "pid": os.getpid(),
+            "port": self.control_port,
+            "num_servers": len(self.comms),
+        }
+        # write then rename, so clients never see a partial file
+        tmp_path = f"{self.registry_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(registry, f)
+        os.replace(tmp_path, self.registry_path)
+
+    def _run_calls(self, server_idx: int, calls: Sequence[RpcCall]) -> None:
+        for call in calls:
+            self.comms[server_idx].rpc_call(call.method, dict(call.params_dict or {}))
+
+    def _init_server(self, server_idx: int) -> None:
+        self._run_calls(server_idx, self.init_calls)
+
+    def _on_restart(self, server_idx: int, server: UnityServer) -> None:
+        self._init_server(server_idx)
+        with self._cond:
+            if server_idx in self._broken:
+                self._broken.discard(server_idx)
+                self._free.append(server_idx)
+                self._cond.notify()
+
+    def acquire(self, timeout: Optional[float] = None) -> Optional[int]:
+        """
+        Returns the index of a free server, waiting up to timeout seconds for one to be
+        returned. Returns None on timeout
+        """
+        with self._cond:
+            if not self._cond.wait_for(lambda: len(self._free) > 0, timeout=timeout):
+                return None
+            return self._free.pop(0)
+
+    def release(self, server_idx: int) -> None:
+        """
+        Resets the server, then makes it available to other clients. A server which fails to
+        reset is restarted, and re-initialized, first, so that the next client does not lease a
+        server left in the previous client's state
+        """
+        try:
+            self._run_calls(server_idx, self.reset_calls)
+        except Exception as e:
+            print(f"Resetting server {server_idx} failed => restarting", e)
+            try:
+                self.pool.servers[server_idx].restart(timeout=self.pool.startup_timeout)
+                self._init_server(server_idx)
+            except Exception as e:
+                print(f"Restarting server {server_idx} failed", e)
+                with self._cond:
+                    self._broken.add(server_idx)
+                return
+        with self._cond:
+            self._free.append(server_idx)
+            self._cond.notify()
+
+    def _handle_client(self, rfile: Any, wfile: Any) -> None:
+        server_idx: Optional[int] = None
+        try:
+            for line in rfile:
+                req = json.loads(line)
+                res: Dict[str, Any]
+                if req["cmd"] == "acquire" and server_idx is None:
+                    server_idx = self.acquire(timeout=req.get("timeout"))
+                    if server_idx is None:
+                        res = {"error": "No server available"}
+                    else:
+                        server = self.pool.servers[server_idx]
+                        res = {"port": server.port, "transport": server.transport}
+                elif req["cmd"] == "release" and server_idx is not None:
+                    self.release(server_idx)
+                    server_idx = None
+                    res = {}
+                elif req["cmd"] == "status":
+                    res = {"num_servers": len(self.comms), "num_free": self.num_free}
+                else:
+                    res = {"error": f"Cannot {req['cmd']} now"}
+                wfile.write((json.dumps(res) + "\n").encode("utf-8"))
+        except (OSError, ValueError):
+            pass
+        finally:
+            if server_idx is not None:
+                # client went away without returning its server
+                self.release(server_idx)
+
+    def serve_forever(self) -> None:
+        """
+        Starts, then blocks until SIGINT or SIGTERM
+        """
+        stop_event = threading.Event()
+        for sig in [signal.SIGINT, signal.SIGTERM]:
+            signal.signal(sig, lambda *args: stop_event.set())
+        self.start()
+        print(f"Serving {len(self.comms)} servers, registry {self.registry_path}")
+        try:
+            stop_event.wait()
+        finally:
+            self.stop()
+
+    def stop(self) -> None:
+        if self._control_server is not None:
+            self._control_server.shutdown()
+            self._control_server.server_close()
+            self._control_server = None
+        try:
+            with open(self.registry_path) as f:
+                if json.load(f)["pid"] == os.getpid():
+                    os.remove(self.registry_path)
+        except (OSError, ValueError, KeyError):
+            pass
+        for comms in self.comms:
+            comms.transport.close()
+        self.pool.stop()
+
+
+class ServerLease:
+    """
+    Leases a warm server from a ServerDaemon, for the lifetime of this object, or of a `with`
+    block, e.g.
+
+    with ServerLease() as lease:
+        comms = lease.create_comms()
+        my_env = MyUnityEnv(comms=comms)
+    """
+
+    def __init__(
+        self,
+        registry_path: str = DEFAULT_REGISTRY_PATH,
+        timeout: Optional[float] = None,
+    ) -> None:
+        """
+        :param registry_path: str The registry file written by the ServerDaemon
+        :param timeout: Optional[float] Seconds to wait for a free server. None waits forever.
+        """
+        try:
+            with open(registry_path) as f:
+                registry = json.load(f)
+        except OSError as e:
+            raise ServerDaemonError(
+                f"No server daemon registry at {registry_path}. Is the daemon running?"
+            ) from e
+        try:
+            self._sock: Optional[socket.socket] = socket.create_connection(
+                ("localhost", registry["port"])
+            )
+        except OSError as e:
+            raise ServerDaemonError(
+                f"Could not connect to the server daemon on port {registry['port']}"
+            ) from e
+        self._rfile = self._sock.makefile("rb")
+        res = self._request({"cmd": "acquire", "timeout": timeout})
+        if "error" in res:
+            self.close()
+            raise ServerDaemonError(res["error"])
+        self.port: int = res["port"]
+        self.transport: str = res["transport"]
+
+    def _request(self, req: Dict[str, Any]) -> Dict[str, Any]:
+        assert self._sock is not None
+        self._sock.sendall((json.dumps(req) + "\n").encode("utf-8"))
+        line = self._rfile.readline()
+        if not line:
+            raise ServerDaemonError("Server daemon closed the connection")
+        return json.loads(line)
+
+    def create_comms(self, **kwargs: Any) -> UnityComms:
+        """
+        kwargs are passed to UnityComms
+        """
+        return UnityComms(port=self.port, transport=self.transport, **kwargs)
+
+    def release(self) -> None:
+        """
+        Returns the server to the daemon, which resets it for the next client
+        """
+        if self._sock is None:
+            return
+        self._request({"cmd": "release"})
+        self.close()
+
+    def close(self) -> None:
+        if self._sock is not None:
+            self._rfile.close()
+            self._sock.close()
+            self._sock = None
+
+    def __enter__(self) -> "ServerLease":
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.release()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--server-executable-path", type=str, required=True)
+    parser.add_argument("--num-servers", type=int, default=1)
+    parser.add_argument("--registry-path", type=str, default=DEFAULT_REGISTRY_PATH)
+    parser.add_argument(
+        "--transport", type=str, default="http", choices=["http", "tcp"]
+    )
+    parser.add_argument(
+        "--init-call",
+        type=str,
+        nargs="+",
+        action="append",
+        default=[],
+        metavar=("METHOD", "PARAMS_JSON"),
+        help="rpc call to make once each server has started, e.g. "
+        '--init-call rlInitAi \'{"accel": 1.0, "frame_skip": 0}\'. Can repeat.',
+    )
+    parser.add_argument(
+        "--reset-call",
+        type=str,
+        nargs="+",
+        action="append",
+        metavar=("METHOD", "PARAMS_JSON"),
+        help="rpc call to make when a server is returned. Can repeat. Default: reset",
+    )
+    parser.add_argument("--health-check-interval", type=float, default=5.0)
+    args = parser.parse_args()
+
+    def to_calls(call_args: List[List[str]]) -> List[RpcCall]:
+        return [
+            RpcCall(method, json.loads(params[0]) if params else None)
+            for method, *params in call_args
+        ]
+
+    ServerDaemon(
+        args.server_executable_path,
+        num_servers=args.num_servers,
+        registry_path=args.registry_path,
+        transport=args.transport,
+        init_calls=to_calls(args.init_call),
+        reset_calls=to_calls(args.reset_call or [["reset"]]),
+        health_check_interval=args.health_check_interval,
+    ).serve_forever()
@@ -0,0 +1,358 @@
+import atexit
+import json
+import os
+import signal
+import socket
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import IO, Any, Callable, List, Optional, Sequence
+
+from peaceful_pie.transports import create_transport
+from peaceful_pie.unity_comms import UnityComms
+
+# any json rpc response, even 'method not found', shows that the server is up, and its main
+# thread is processing requests. Every Simulation provides this method
+HEALTH_CHECK_METHOD = "getAutosimulation"
+
+
+class ServerStartError(Exception):
+    pass
+
+
+def find_free_ports(num_ports: int, hostname: str = "localhost") -> List[int]:
+    """
+    Asks the OS for num_ports distinct free ports. All sockets are held open until every
+    port has been allocated, so the OS cannot hand out the same port twice.
+    """
+    socks = []
+    try:
+        for _ in range(num_ports):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.bind((hostname, 0))
+            socks.append(sock)
+        return [sock.getsockname()[1] for sock in socks]
+    finally:
+        for sock in socks:
+            sock.close()
+
+
+def ping(
+    hostname: str, port: int, transport: str = "http", timeout: float = 1.0
+) -> bool:
+    """
+    Returns True if a server is listening on port, and responds to a json rpc request within
+    timeout seconds
+    """
+    payload = {"jsonrpc": "2.0", "method": HEALTH_CHECK_METHOD, "params": {}, "id": 0}
+    client = create_transport(transport, hostname=hostname, port=port, timeout=timeout)
+    try:
+        content = client.send(json.dumps(payload).encode("utf-8"))
+        json.loads(content)
+        return True
+    except Exception:
+        return False
+    finally:
+        client.close()
+
+
+class UnityServer:
+    """
+    One dedicated server process, listening on one port. Keeps the process handle, and runs the
+    process in its own process group, so that stop() also kills any child processes.
+    """
+
+    def __init__(
+        self,
+        server_executable_path: str,
+        port: int,
+        transport: str = "http",
+        extra_args: Optional[Sequence[str]] = None,
+        logfile: Optional[str] = None,
+    ) -> None:
+        """
+        :param server_executable_path: str Path to dedicated server executable
+        :param port: int Port the server should listen on. Passed as `--port {port}`
+        :param transport: str 'http' or 'tcp'. Passed as `--transport tcp`, if not 'http'
+        :param extra_args: Optional[Sequence[str]] Any further commandline arguments
+        :param logfile: Optional[str] Append the server's stdout and stderr to this file
+        """
+        self.server_executable_path = server_executable_path
+        self.port = port
+        self.transport = transport
+        self.extra_args = list(extra_args) if extra_args else []
+        self.logfile = logfile
+        self.process: Optional[subprocess.Popen] = None
+        self.num_starts = 0
+        self._log_f: Optional[IO] = None
+
+    def cmd_line(self) -> List[str]:
+        cmd_line = [self.server_executable_path, "--port", str(self.port)]
+        if self.transport != "http":
+            cmd_line += ["--transport", self.transport]
+        return cmd_line + self.extra_args
+
+    def start(self) -> None:
+        """
+        Launches the server, without waiting for it to be ready. See wait_ready.
+        """
+        cmd_line = self.cmd_line()
+        print(cmd_line)
+        if self.logfile is not None and self._log_f is None:
+            self._log_f = open(self.logfile, "a")
+        kwargs: Any = {}
+        if os.name == "posix":
+            kwargs["start_new_session"] = True
+        else:
+            kwargs["creationflags"] = subprocess.CREATE_NEW_PROCESS_GROUP  # type: ignore
+        self.process = subprocess.Popen(
+            cmd_line,
+            stdout=self._log_f,
+            stderr=subprocess.STDOUT if self._log_f is not None else None,
+            **kwargs,
+        )
+        self.num_starts += 1
+
+    def is_running(self) -> bool:
+        return self.process is not None and self.process.poll() is None
+
+    def wait_ready(
+        self,
+        timeout: float = 60.0,
+        initial_backoff: float = 0.05,
+        max_backoff: float = 2.0,
+    ) -> None:
+        """
+        Pings the server until it responds, with exponential backoff between attempts.
+
+        Raises ServerStartError if the process exits, or is not ready within timeout seconds.
+        """
+        deadline = time.monotonic() + timeout
+        backoff = initial_backoff
+        while True:
+            if not self.is_running():
+                raise ServerStartError(
+                    f"Server on port {self.port} exited during startup, with return code "
+                    f"{self.process.returncode if self.process is not None else None}"
+                )
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise ServerStartError(
+                    f"Server on port {self.port} not ready after {timeout} seconds"
+                )
+            if ping(
+                "localhost", self.port, self.transport, timeout=min(1.0, remaining)
+            ):
+                return
+            time.sleep(min(backoff, max(0.0, deadline - time.monotonic())))
+            backoff = min(backoff * 2, max_backoff)
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """
+        Terminates the server's whole process group, and kills it if it has not exited after
+        timeout seconds
+        """
+        if self.process is None:
+            return
+        if self.process.poll() is None:
+            self._signal(signal.SIGTERM)
+            try:
+                self.process.wait(timeout=timeout)
+            except subprocess.TimeoutExpired:
+                self._signal(signal.SIGKILL if os.name == "posix" else signal.SIGTERM)
+                self.process.wait()
+        self.process = None
+
+    def close(self) -> None:
+        self.stop()
+        if self._log_f is not None:
+            self._log_f.close()
+            self._log_f = None
+
+    def _signal(self, sig: int) -> None:
+        assert self.process is not None
+        if os.name == "posix":
+            try:
+                os.killpg(self.process.pid, sig)
+            except ProcessLookupError:
+                pass
+        elif sig == signal.SIGTERM:
+            self.process.terminate()
+        else:
+            self.process.kill()
+
+    def restart(self, timeout: float = 60.0) -> None:
+        self.stop()
+        self.start()
+        self.wait_ready(timeout=timeout)
+
+
+class UnityServerPool:
+    """
+    Launches several dedicated servers in parallel, on free ports, and keeps them healthy: a
+    background thread pings each server, and restarts any which have crashed, or which have
+    stopped responding. UnityComms clients keep retrying on connection errors, so they
+    reconnect to the restarted server on the same port, e.g.
+
+    with UnityServerPool(server_executable_path, num_servers=4) as pool:
+        envs = [MyUnityEnv(comms=comms) for comms in pool.create_comms()]
+
+    Note that a restarted server starts from a fresh scene. Use on_restart to e.g. re-initialize
+    it. Calls to non-idempotent methods, such as rlStep, which were in flight when the server
+    died, raise ResponseLostError rather than being re-sent. See RetryPolicy.
+    """
+
+    def __init__(
+        self,
+        server_executable_path: str,
+        num_servers: int,
+        ports: Optional[Sequence[int]] = None,
+        transport: str = "http",
+        extra_args: Optional[Sequence[str]] = None,
+        logfile_templ: Optional[str] = None,
+        startup_timeout: float = 60.0,
+        health_check_interval: float = 5.0,
+        hang_timeout: float = 30.0,
+        on_restart: Optional[Callable[[int, UnityServer], None]] = None,
+    ) -> None:
+        """
+        :param server_executable_path: str Path to dedicated server executable
+        :param num_servers: int How many servers to launch
+        :param ports: Optional[Sequence[int]] Ports to use. Defaults to free ports chosen by the OS
+        :param transport: str 'http' or 'tcp'
+        :param extra_args: Optional[Sequence[str]] Further commandline arguments for every server
+        :param logfile_templ: Optional[str] e.g. 'logs/server_{port}.log', to keep each server's
+            output
+        :param startup_timeout: float Seconds to wait for each server to become ready
+        :param health_check_interval: float Seconds between health checks. 0 disables them.
+        :param hang_timeout: float A server which takes longer than this to respond to a health
+            check is considered hung, and restarted. Should be longer than your slowest rpc call,
+            since Unity processes requests one at a time.
+        :param on_restart: Optional[Callable[[int, UnityServer], None]] Called with the server
+            index and server, after a server has been restarted
+        """
+        if ports is None:
+            ports = find_free_ports(num_servers)
+        if len(ports) != num_servers:
+            raise ValueError(f"Got {len(ports)} ports for {num_servers} servers")
+        self.transport = transport
+        self.startup_timeout = startup_timeout
+        self.health_check_interval = health_check_interval
+        self.hang_timeout = hang_timeout
+        self.on_restart = on_restart
+        self.servers = [
+            UnityServer(
+                server_executable_path,
+                port=port,
+                transport=transport,
+                extra_args=extra_args,
+                logfile=(
+                    logfile_templ.format(port=port)
+                    if logfile_templ is not None
+                    else None
+                ),
+            )
+            for port in ports
+        ]
+        self.num_restarts = 0
+        # guards num_restarts, since servers are restarted in parallel
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._monitor_thread: Optional[threading.Thread] = None
+        self._started = False
+
+    @property
+    def ports(self) -> List[int]:
+        return [server.port for server in self.servers]
+
+    def start(self) -> "UnityServerPool":
+        """
+        Launches every server, then waits for all of them to be ready, in parallel
+        """
+        atexit.register(self.stop)
+        self._started = True
+        for server in self.servers:
+            server.start()
+        with ThreadPoolExecutor(max_workers=len(self.servers)) as executor:
+            futures = [
+                executor.submit(server.wait_ready, timeout=self.startup_timeout)
+                for server in self.servers
+            ]
+            try:
+                for future in futures:
+                    future.result()
+            except Exception:
+                self.stop()
+                raise
+        if self.health_check_interval > 0:
+            self._monitor_thread = threading.Thread(
+                target=self._monitor, name="UnityServerPool-monitor", daemon=True
+            )
+            self._monitor_thread.start()
+        return self
+
+    def create_comms(self, **kwargs: Any) -> List[UnityComms]:
+        """
+        Returns one UnityComms per server. kwargs are passed to UnityComms
+        """
+        return [
+            UnityComms(port=server.port, transport=self.transport, **kwargs)
+            for server in self.servers
+        ]
+
+    def check_health(self) -> None:
+        """
+        Restarts any server which has exited, or which does not respond within hang_timeout.
+        Servers are checked, and restarted, in parallel, so that one hung server does not
+        delay the others
+        """
+        with ThreadPoolExecutor(max_workers=len(self.servers)) as executor:
+            futures = [
+                executor.submit(self._check_server, server_idx, server)
+                for server_idx, server in enumerate(self.servers)
+            ]
+            for future in futures:
+                future.result()
+
+    def _check_server(self, server_idx: int, server: UnityServer) -> None:
+        if self._stop_event.is_set():
+            return
+        if server.is_running() and ping(
+            "localhost", server.port, self.transport, timeout=self.hang_timeout
+        ):
+            return
+        if self._stop_event.is_set():
+            return
+        reason = "exited" if not server.is_running() else "not responding"
+        print(f"Server on port {server.port} {reason} => restarting")
+        server.restart(timeout=self.startup_timeout)
+        with self._lock:
+            self.num_restarts += 1
+        if self.on_restart is not None:
+            self.on_restart(server_idx, server)
+
+    def _monitor(self) -> None:
+        while not self._stop_event.wait(self.health_check_interval):
+            try:
+                self.check_health()
+            except Exception as e:
+                print("UnityServerPool health check failed", e)
+
+    def stop(self) -> None:
+        if not self._started:
+            return
+        self._started = False
+        self._stop_event.set()
+        if self._monitor_thread is not None:
+            self._monitor_thread.join()
+            self._monitor_thread = None
+        for server in self.servers:
+            server.close()
+        atexit.unregister(self.stop)
+
+    def __enter__(self) -> "UnityServerPool":
+        return self.start()
+
+    def __exit__(self, *args: Any) -> None:
+        self.stop()
@@ -0,0 +1,340 @@
+import multiprocessing as mp
+import pickle
+import sys
+import traceback
+from multiprocessing import shared_memory
+from multiprocessing.connection import Connection
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from numpy.typing import DTypeLike, NDArray
+
+# align each array in the shared memory block to a cache line
+_ALIGNMENT = 64
+
+
+class SharedArrays:
+    """
+    Lays out the observations, rewards, dones and actions of all envs in one shared memory
+    buffer, and gives numpy views onto them.
+
+    Observations, rewards and dones form a ring of num_slots slots, written in turn on each
+    step. Arrays returned for one step thus stay valid for the following num_slots - 1 steps,
+    e.g. while the learner stores the previous observation after stepping.
+    """
+
+    def __init__(
+        self,
+        buf: Any,
+        num_slots: int,
+        num_envs: int,
+        obs_shape: Tuple[int, ...],
+        obs_dtype: DTypeLike,
+        action_shape: Tuple[int, ...],
+        action_dtype: DTypeLike,
+    ) -> None:
+        arrays: Dict[str, NDArray] = {}
+        offset = 0
+        for name, shape, dtype in self._specs(
+            num_slots, num_envs, obs_shape, obs_dtype, action_shape, action_dtype
+        ):
+            arrays[name] = np.ndarray(shape, dtype=dtype, buffer=buf, offset=offset)
+            offset += _aligned(arrays[name].nbytes)
+        self.obs = arrays["obs"]
+        self.rewards = arrays["rewards"]
+        self.dones = arrays["dones"]
+        self.actions = arrays["actions"]
+
+    @staticmethod
+    def _specs(
+        num_slots: int,
+        num_envs: int,
+        obs_shape: Tuple[int, ...],
+        obs_dtype: DTypeLike,
+        action_shape: Tuple[int, ...],
+        action_dtype: DTypeLike,
+    ) -> List[Tuple[str, Tuple[int, ...], DTypeLike]]:
+        return [
+            ("obs", (num_slots, num_envs, *obs_shape), obs_dtype),
+            ("rewards", (num_slots, num_envs), np.float32),
+            ("dones", (num_slots, num_envs), np.bool_),
+            ("actions", (num_envs, *action_shape), action_dtype),
+        ]
+
+    @classmethod
+    def nbytes(cls, *args: Any) -> int:
+        return sum(
+            _aligned(int(np.prod(shape)) * np.dtype(dtype).itemsize)
+            for _, shape, dtype in cls._specs(*args)
+        )
+
+
+def _aligned(nbytes: int) -> int:
+    return (nbytes + _ALIGNMENT - 1) // _ALIGNMENT * _ALIGNMENT
+
+
+def _attach_shared_memory(name: str) -> shared_memory.SharedMemory:
+    """
+    Attaches to shared memory created by the parent process, without registering it with the
+    resource tracker, which would otherwise try to unlink it a second time, on shutdown. With
+    'spawn' and 'forkserver', the worker shares the parent's resource tracker, so we cannot
+    register and then unregister, which would drop the parent's registration.
+    """
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)  # type: ignore
+    from multiprocessing import resource_tracker
+
+    register = resource_tracker.register
+    resource_tracker.register = lambda *args, **kwargs: None  # type: ignore
+    try:
+        return shared_memory.SharedMemory(name=name)
+    finally:
+        resource_tracker.register = register  # type: ignore
+
+
+def _is_wrapped(env: Any, wrapper_class: type) -> bool:
+    while True:
+        if isinstance(env, wrapper_class):
+            return True
+        if not hasattr(env, "env"):
+            return False
+        env = env.env
+
+
+class CloudpickleWrapper:
+    """
+    Pickles an env_fn with cloudpickle, if installed, as stable baselines 3's SubprocVecEnv does,
+    so that lambdas and locally defined classes can be sent to workers started with 'spawn' or
+    'forkserver'. Without cloudpickle, falls back to pickle, which handles module-level
+    functions and classes.
+    """
+
+    def __init__(self, env_fn: Callable[[], Any]) -> None:
+        self.env_fn = env_fn
+
+    def __call__(self) -> Any:
+        return self.env_fn()
+
+    def __getstate__(self) -> bytes:
+        try:
+            import cloudpickle
+        except ImportError:
+            return pickle.dumps(self.env_fn)
+        return cloudpickle.dumps(self.env_fn)
+
+    def __setstate__(self, state: bytes) -> None:
+        self.env_fn = pickle.loads(state)
+
+
+def _worker(
+    remote: Connection,
+    parent_remote: Connection,
+    env_fn: Callable[[], Any],
+    env_idx: int,
+) -> None:
+    parent_remote.close()
+    env = env_fn()
+    shm = None
+    arrays: Optional[SharedArrays] = None
+    while True:
+        try:
+            cmd, data = remote.recv()
+        except EOFError:
+            break
+        try:
+            result: Any = None
+            if cmd == "step":
+                assert arrays is not None
+                obs, reward, done, info = env.step(np.array(arrays.actions[env_idx]))
+                if done:
+                    # save final observation where user can get it, then reset. Copy it, since
+                    # envs such as MyUnityEnv overwrite the same observation buffer on reset
+                    info["terminal_observation"] = np.array(obs)
+                    obs = env.reset()
+                arrays.obs[data, env_idx] = obs
+                arrays.rewards[data, env_idx] = reward
+                arrays.dones[data, env_idx] = done
+                result = info
+            elif cmd == "reset":
+                assert arrays is not None
+                arrays.obs[data, env_idx] = env.reset()
+            elif cmd == "get_spaces":
+                result = (env.observation_space, env.action_space)
+            elif cmd == "attach":
+                shm_name, layout_args = data
+                shm = _attach_shared_memory(shm_name)
+                arrays = SharedArrays(shm.buf, *layout_args)
+            elif cmd == "seed":
+                result = env.seed(data)
+            elif cmd == "env_method":
+                method_name, args, kwargs = data
+                result = getattr(env, method_name)(*args, **kwargs)
+            elif cmd == "get_attr":
+                result = getattr(env, data)
+            elif cmd == "set_attr":
+                setattr(env, data[0], data[1])
+            elif cmd == "is_wrapped":
+                result = _is_wrapped(env, data)
+            elif cmd == "close":
+                env.close()
+                remote.send((True, None))
+                break
+            else:
+                raise NotImplementedError(f"`{cmd}` is not implemented in the worker")
+            remote.send((True, result))
+        except Exception:
+            remote.send((False, traceback.format_exc()))
+    # release our views before closing, otherwise close complains of exported pointers
+    arrays = None
+    if shm is not None:
+        shm.close()
+    remote.close()
+
+
+class SharedMemoryEnvPool:
+    """
+    Runs one gym-style env per worker process, e.g. each owning a UnityComms, and exchanges
+    observations, rewards, dones and actions with them through shared memory, rather than
+    pickling them through pipes. Only infos, which are usually small, go through the pipes.
+
+    Observations are returned as numpy views onto the shared memory, without copying. See
+    SharedArrays for how long they stay valid. Observation spaces should be Boxes.
+
+    This has no dependency on stable baselines 3. See peaceful_pie.vec_env.SharedMemoryVecEnv for
+    a stable baselines 3 VecEnv using this.
+    """
+
+    def __init__(
+        self,
+        env_fns: Sequence[Callable[[], Any]],
+        num_slots: int = 2,
+        start_method: Optional[str] = None,
+    ) -> None:
+        """
+        :param env_fns: Sequence[Callable[[], Any]] Functions that each create one env. With the
+            'spawn' and 'forkserver' start methods, these are pickled with cloudpickle, if
+            installed, so may be e.g. lambdas. See CloudpickleWrapper
+        :param num_slots: int How many steps of observations to keep in the ring
+        :param start_method: Optional[str] multiprocessing start method. Defaults to the platform
+            default.
+        """
+        self.num_envs = len(env_fns)
+        self.num_slots = num_slots
+        self.closed = False
+        ctx = mp.get_context(start_method)
+        self.remotes, work_remotes = zip(*[ctx.Pipe() for _ in range(self.num_envs)])
+        self.processes = []
+        for env_idx, (work_remote, remote, env_fn) in enumerate(
+            zip(work_remotes, self.remotes, env_fns)
+        ):
+            process = ctx.Process(  # type: ignore[attr-defined]
+                target=_worker,
+                args=(work_remote, remote, CloudpickleWrapper(env_fn), env_idx),
+                daemon=True,
+            )
+            process.start()
+            self.processes.append(process)
+            work_remote.close()
+
+        self.observation_space, self.action_space = self._call("get_spaces", None, [0])[
+            0
+        ]
+        layout_args = (
+            num_slots,
+            self.num_envs,
+            tuple(self.observation_space.shape),
+            self.observation_space.dtype,
+            tuple(self.action_space.shape),
+            self.action_space.dtype,
+        )
+        self.shm = shared_memory.SharedMemory(
+            create=True, size=SharedArrays.nbytes(*layout_args)
+        )
+        self.arrays: Optional[SharedArrays] = SharedArrays(self.shm.buf, *layout_args)
+        self._call("attach", (self.shm.name, layout_args))
+        self.slot = 0
+        self.waiting = False
+
+    def _indices(self, indices: Optional[Sequence[int]]) -> Sequence[int]:
+        return range(self.num_envs) if indices is None else indices
+
+    def _send(
+        self, cmd: str, data: Any, indices: Optional[Sequence[int]] = None
+    ) -> None:
+        for i in self._indices(indices):
+            self.remotes[i].send((cmd, data))
+
+    def _recv(self, indices: Optional[Sequence[int]] = None) -> List[Any]:
+        results = [self.remotes[i].recv() for i in self._indices(indices)]
+        for ok, result in results:
+            if not ok:
+                raise RuntimeError(f"Exception in env worker:\n{result}")
+        return [result for _, result in results]
+
+    def _call(
+        self, cmd: str, data: Any, indices: Optional[Sequence[int]] = None
+    ) -> List[Any]:
+        self._send(cmd, data, indices)
+        return self._recv(indices)
+
+    def _next_slot(self) -> int:
+        self.slot = (self.slot + 1) % self.num_slots
+        return self.slot
+
+    def reset(self) -> NDArray:
+        assert self.arrays is not None
+        slot = self._next_slot()
+        self._call("reset", slot)
+        return self.arrays.obs[slot]
+
+    def step_async(self, actions: NDArray) -> None:
+        """
+        Writes all actions into shared memory at once, then tells each worker to step
+        """
+        assert self.arrays is not None
+        self.arrays.actions[:] = actions
+        self._send("step", self._next_slot())
+        self.waiting = True
+
+    def step_wait(self) -> Tuple[NDArray, NDArray, NDArray, List[Dict[str, Any]]]:
+        """
+        :return: observations, rewards, dones, infos. The first three are views onto shared
+            memory, see SharedArrays
+        """
+        assert self.arrays is not None
+        try:
+            infos = self._recv()
+        finally:
+            self.waiting = False
+        return (
+            self.arrays.obs[self.slot],
+            self.arrays.rewards[self.slot],
+            self.arrays.dones[self.slot],
+            infos,
+        )
+
+    def call(
+        self, cmd: str, data: Any, indices: Optional[Sequence[int]] = None
+    ) -> List[Any]:
+        """
+        Runs one of the worker commands 'seed', 'env_method', 'get_attr', 'set_attr', 'is_wrapped'
+        """
+        return self._call(cmd, data, indices)
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        if self.waiting:
+            self._recv()
+        self._call("close", None)
+        for process in self.processes:
+            process.join()
+        self.arrays = None
+        try:
+            self.shm.close()
+        except BufferError:
+            # the caller still holds views onto the observations. Leave it mapped until those
+            # are garbage collected
+            pass
+        self.shm.unlink()
+        self.closed = True
@@ -0,0 +1,651 @@
+import argparse
+import json
+import queue
+import random
+import socketserver
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+import numpy as np
+from numpy.typing import NDArray
+
+from peaceful_pie.ndarray_codec import encode_ndarray
+from peaceful_pie.transports import FRAME_HEADER
+
+
+def cs_exception_data(e: Exception) -> Dict[str, Any]:
+    """
+    Returns the error data that AustinHarris.JsonRpc sends for an exception thrown inside a
+    C# JsonRpcMethod
+    """
+    return {
+        "ClassName": type(e).__name__,
+        "Message": str(e),
+        "StackTraceString": "",
+    }
+
+
+class _ThreadingTCPServer(socketserver.ThreadingTCPServer):
+    # as for HTTPServer, so that a restarted server can listen on the same port straight away
+    allow_reuse_address = True
+
+
+class _NetworkEvent:
+    """
+    One request waiting for the stand-in main thread, as NetManager's NetworkEvent
+    """
+
+    def __init__(self, body: bytes) -> None:
+        self.body = body
+        self.res: Union[Dict[str, Any], List[Dict[str, Any]], None] = None
+        self.reply = ""
+        self.replied = threading.Event()
+        self.enqueued_at = time.perf_counter()
+        self.dequeued_at = 0.0
+        self.replied_at = 0.0
+
+
+class StandInServer:
+    """
+    Minimal JSON-RPC 2.0 server, listening on the same url as NetManager, or, with transport 'tcp',
+    speaking the same length-prefixed frames as NetManager in Tcp mode. Handles single requests
+    and batches. Methods are python callables, called with the request params
+    as keyword arguments, e.g.
+
+    with StandInServer(methods={"add": lambda a, b: a + b}) as server:
+        unity_comms = UnityComms(port=server.port)
+        print(unity_comms.add(a=1, b=2))
+    """
+
+    def __init__(
+        self,
+        methods: Dict[str, Callable[..., Any]],
+        hostname: str = "localhost",
+        port: int = 0,
+        transport: str = "http",
+        echo_timings: bool = False,
+        fixed_delta_time: Optional[float] = None,
+        max_requests_per_tick: int = 1,
+        tick_budget: Optional[float] = None,
+        empty_response_every: int = 0,
+    ) -> None:
+        """
+        :param methods: Dict[str, Callable] The methods to serve, keyed by method name
+        :param hostname: str Hostname to listen on
+        :param port: int Port to listen on. 0 means pick any free port. See `self.port`
+        :param transport: str 'http' or 'tcp'
+        :param echo_timings: bool Add the same 'timing' field to each response as NetManager does
+            with EchoTimings. Requests are then processed one at a time, as on Unity's main thread,
+            and the queue wait is the time spent waiting for earlier requests. Can be changed with
+            the 'setEchoTimings' method.
+        :param fixed_delta_time: Optional[float] If provided, requests are queued, and a main thread
+            processes them every fixed_delta_time seconds, following the same drain policy as
+            NetManager.FixedUpdate, i.e. with max_requests_per_tick and tick_budget. Use this to
+            measure how the drain policy limits throughput. If None, requests are processed as
+            soon as they arrive.
+        :param max_requests_per_tick: int As NetManager.MaxRequestsPerTick. 0 means no limit
+        :param tick_budget: Optional[float] As NetManager.TickBudgetMilliseconds, but in seconds
+        :param empty_response_every: int If > 0, every this many round trips gets an empty
+            response, without being processed, as NetManager sends when it has no reply
+        """
+        self.methods: Dict[str, Callable[..., Any]] = {
+            "setEchoTimings": self._set_echo_timings,
+            **methods,
+        }
+        self.echo_timings = echo_timings
+        self.fixed_delta_time = fixed_delta_time
+        self.max_requests_per_tick = max_requests_per_tick
+        self.tick_budget = tick_budget
+        self.num_ticks = 0
+        self.empty_response_every = empty_response_every
+        self._network_events: "queue.Queue[_NetworkEvent]" = queue.Queue()
+        self._stop_ticking = threading.Event()
+        self._tick_thread: Optional[threading.Thread] = None
+        # stands in for Unity's main thread, when echoing timings without ticking
+        self._main_thread_lock = threading.Lock()
+        self.num_round_trips = 0
+        self.num_rpc_requests = 0
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        stand_in_server = self
+
+        class HttpHandler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def do_POST(self) -> None:
+                body = self.rfile.read(int(self.headers["Content-Length"]))
+                res_body = stand_in_server.handle_body(body)
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(res_body)))
+                self.end_headers()
+                self.wfile.write(res_body)
+
+            def log_message(self, format: str, *args: Any) -> None:
+                pass
+
+        class TcpHandler(socketserver.StreamRequestHandler):
+            disable_nagle_algorithm = True
+
+            def handle(self) -> None:
+                # as NetManager, each request is processed as soon as it arrives, so a client
+                # can have several in flight, and replies are written in the order the
+                # requests arrived
+                in_flight: "queue.Queue[Optional[Future]]" = queue.Queue()
+                writer = threading.Thread(
+                    target=self._write_replies, args=(in_flight,), daemon=True
+                )
+                writer.start()
+                with ThreadPoolExecutor(max_workers=16) as executor:
+                    try:
+                        while True:
+                            header = self.rfile.read(FRAME_HEADER.size)
+                            if len(header) < FRAME_HEADER.size:
+                                return
+                            (length,) = FRAME_HEADER.unpack(header)
+                            body = self.rfile.read(length)
+                            in_flight.put(
+                                executor.submit(stand_in_server.handle_body, body)
+                            )
+                    finally:
+                        in_flight.put(None)
+                        writer.join()
+
+            def _write_replies(
+                self, in_flight: "queue.Queue[Optional[Future]]"
+            ) -> None:
+                try:
+                    while True:
+                        future = in_flight.get()
+                        if future is None:
+                            return
+                        res_body = future.result()
+                        self.wfile.write(FRAME_HEADER.pack(len(res_body)) + res_body)
+                except OSError:
+                    pass
+
+        self.socket_server: Union[ThreadingHTTPServer, socketserver.ThreadingTCPServer]
+        if transport == "http":
+            self.socket_server = ThreadingHTTPServer((hostname, port), HttpHandler)
+        elif transport == "tcp":
+            self.socket_server = _ThreadingTCPServer((hostname, port), TcpHandler)
+        else:
+            raise ValueError(f"Unknown transport {transport}")
+        self.socket_server.daemon_threads = True
+
+    @property
+    def port(self) -> int:
+        return self.socket_server.server_address[1]
+
+    def start(self) -> "StandInServer":
+        self._thread = threading.Thread(
+            target=self.socket_server.serve_forever,
+            kwargs={"poll_interval": 0.05},
+            daemon=True,
+        )
+        self._thread.start()
+        if self.fixed_delta_time is not None:
+            self._stop_ticking.clear()
+            self._tick_thread = threading.Thread(
+                target=self._tick_loop, name="StandInServer-main", daemon=True
+            )
+            self._tick_thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._stop_ticking.set()
+        if self._tick_thread is not None:
+            self._tick_thread.join()
+            self._tick_thread = None
+        self.socket_server.shutdown()
+        self.socket_server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self) -> "StandInServer":
+        return self.start()
+
+    def __exit__(self, *args: Any) -> None:
+        self.stop()
+
+    def _set_echo_timings(self, echoTimings: bool) -> None:
+        self.echo_timings = echoTimings
+
+    def _can_process_more(self, num_processed: int, tick_start: float) -> bool:
+        if 0 < self.max_requests_per_tick <= num_processed:
+            return False
+        return (
+            self.tick_budget is None
+            or time.perf_counter() - tick_start < self.tick_budget
+        )
+
+    def _tick_loop(self) -> None:
+        assert self.fixed_delta_time is not None
+        next_tick = time.perf_counter()
+        while not self._stop_ticking.is_set():
+            next_tick += self.fixed_delta_time
+            tick_start = time.perf_counter()
+            num_processed = 0
+            while self._can_process_more(num_processed, tick_start):
+                try:
+                    network_event = self._network_events.get_nowait()
+                except queue.Empty:
+                    break
+                self._process_event(network_event)
+                num_processed += 1
+            self.num_ticks += 1
+            self._stop_ticking.wait(max(0.0, next_tick - time.perf_counter()))
+
+    def _process_event(self, network_event: _NetworkEvent) -> None:
+        network_event.dequeued_at = time.perf_counter()
+        network_event.res = self._process(network_event.body)
+        # as NetManager, the json serialization counts towards handler_ms
+        network_event.reply = json.dumps(network_event.res)
+        network_event.replied_at = time.perf_counter()
+        network_event.replied.set()
+
+    def handle_body(self, body: bytes) -> bytes:
+        with self._lock:
+            self.num_round_trips += 1
+            num_round_trips = self.num_round_trips
+        if (
+            self.empty_response_every > 0
+            and num_round_trips % self.empty_response_every == 0
+        ):
+            return b""
+        if self.fixed_delta_time is None and not self.echo_timings:
+            return json.dumps(self._process(body)).encode("utf-8")
+        network_event = _NetworkEvent(body)
+        if self.fixed_delta_time is not None:
+            self._network_events.put(network_event)
+            network_event.replied.wait()
+        else:
+            with self._main_thread_lock:
+                self._process_event(network_event)
+        res = network_event.res
+        encode_start = time.perf_counter()
+        res_body = network_event.reply.encode("utf-8")
+        if not self.echo_timings or (isinstance(res, list) and len(res) == 0):
+            return res_body
+        enqueued_at, dequeued_at, replied_at = (
+            network_event.enqueued_at,
+            network_event.dequeued_at,
+            network_event.replied_at,
+        )
+        timing = {
+            "queue_wait_ms": (dequeued_at - enqueued_at) * 1000,
+            "handler_ms": (replied_at - dequeued_at) * 1000,
+            "encode_ms": (time.perf_counter() - encode_start) * 1000,
+        }
+        # as NetManager, splice the timing into the response, or the last response of a batch
+        insert_at = len(res_body) - (2 if isinstance(res, list) else 1)
+        return (
+            res_body[:insert_at]
+            + b', "timing": '
+            + json.dumps(timing).encode("utf-8")
+            + res_body[insert_at:]
+        )
+
+    def _process(self, body: bytes) -> Union[Dict[str, Any], List[Dict[str, Any]]]:
+        req: Union[Dict[str, Any], List[Dict[str, Any]]] = json.loads(body)
+        if isinstance(req, list):
+            return [self.handle_request(req_d) for req_d in req]
+        return self.handle_request(req)
+
+    def handle_request(self, req_d: Dict[str, Any]) -> Dict[str, Any]:
+        with self._lock:
+            self.num_rpc_requests += 1
+        res_d: Dict[str, Any] = {"jsonrpc": "2.0", "id": req_d.get("id")}
+        method = self.methods.get(req_d["method"])
+        if method is None:
+            res_d["error"] = {
+                "code": -32601,
+                "message": "Method not found",
+                "data": f"The method does not exist / is not available: {req_d['method']}",
+            }
+            return res_d
+        try:
+            res_d["result"] = method(**req_d.get("params", {}))
+        except Exception as e:
+            res_d["error"] = {
+                "code": -32603,
+                "message": "Internal error",
+                "data": cs_exception_data(e),
+            }
+        return res_d
+
+
+def make_rl_result(
+    num_players: int = 3,
+    ray_resolution: int = 5,
+    num_object_types: int = 6,
+    rng: Optional[random.Random] = None,
+) -> Dict[str, Any]:
+    """
+    Returns an rlStep result dict shaped like DungeonEscape's RLResult, with one ray_resolution x
+    ray_resolution grid of RayResults per player
+    """
+    rng = rng if rng is not None else random.Random()
+    return {
+        "reward": 0.0,
+        "episodeFinished": False,
+        "playerObservations": [
+            {
+                "IAmAlive": True,
+                "IHaveAKey": False,
+                "rayResults": {
+                    "rayDistances": [
+                        [rng.uniform(0.1, 40) for _ in range(ray_resolution)]
+                        for _ in range(ray_resolution)
+                    ],
+                    "rayHitObjectTypes": [
+                        [
+                            rng.randint(-1, num_object_types - 1)
+                            for _ in range(ray_resolution)
+                        ]
+                        for _ in range(ray_resolution)
+                    ],
+                    "NumObjectTypes": num_object_types,
+                },
+            }
+            for _ in range(num_players)
+        ],
+    }
+
+
+def rl_methods(
+    num_players: int = 3,
+    ray_resolution: int = 5,
+    episode_length: int = 200,
+    seed: int = 0,
+) -> Dict[str, Callable[..., Any]]:
+    """
+    Methods for StandInServer, simulating an RL environment such as DungeonEscape: reset and
+    rlStep return results from make_rl_result, with the episode finishing every episode_length
+    steps. Also provides the autosimulation methods, so UnityServerPool can health check it.
+    Observations are generated once, so that the server is not the bottleneck in benchmarks.
+    """
+    rl_result = make_rl_result(
+        num_players=num_players, ray_resolution=ray_resolution, rng=random.Random(seed)
+    )
+    lock = threading.Lock()
+    state = {"num_steps": 0, "autosimulation": True}
+
+    def reset() -> Dict[str, Any]:
+        with lock:
+            state["num_steps"] = 0
+        return rl_result
+
+    def rl_step(actions: List[str]) -> Dict[str, Any]:
+        with lock:
+            state["num_steps"] += 1
+            num_steps = state["num_steps"]
+        return {
+            **rl_result,
+            "reward": 0.01 * len(actions),
+            "episodeFinished": num_steps % episode_length == 0,
+        }
+
+    def set_autosimulation(autosimulation: bool) -> None:
+        state["autosimulation"] = autosimulation
+
+    return {
+        "reset": reset,
+        "rlStep": rl_step,
+        "getAutosimulation": lambda: state["autosimulation"],
+        "setAutosimulation": set_autosimulation,
+    }
+
+
+class RayDeltaEncoder:
+    """
+    Stand-in for RayCasts.GetDeltaObservation, for testing: turns each ray grid into the
+    DeltaRayResults json dict that RayCasts sends, and remembers what it has sent
+    """
+
+    def __init__(
+        self,
+        num_object_types: int,
+        keyframe_interval: int = 100,
+        distance_threshold: float = 0.01,
+    ) -> None:
+        """
+        :param num_object_types: int As len(RayCasts.DetectableTags)
+        :param keyframe_interval: int As RayCasts.DeltaKeyframeInterval
+        :param distance_threshold: float As RayCasts.DeltaDistanceThreshold
+        """
+        self.num_object_types = num_object_types
+        self.keyframe_interval = keyframe_interval
+        self.distance_threshold = distance_threshold
+        self.sequence = 0
+        self.frames_since_keyframe = 0
+        self.sent_distances: Optional[NDArray[np.float32]] = None
+        self.sent_object_types: Optional[NDArray[np.int16]] = None
+
+    def reset(self) -> None:
+        """
+        As RayCasts.ResetDelta: the next observation will be a keyframe
+        """
+        self.sent_distances = None
+        self.sent_object_types = None
+
+    def encode(self, distances: NDArray, object_types: NDArray) -> Dict[str, Any]:
+        """
+        :param distances: NDArray of shape (XResolution, YResolution), -1 where nothing was hit
+        :param object_types: NDArray of shape (XResolution, YResolution), -1 where nothing was hit
+        """
+        x_resolution, y_resolution = np.shape(distances)
+        flat_distances = np.asarray(distances, dtype=np.float32).reshape(-1)
+        flat_object_types = np.asarray(object_types, dtype=np.int16).reshape(-1)
+        res_d: Dict[str, Any] = {
+            "isKeyframe": False,
+            "sequence": self.sequence,
+            "XResolution": x_resolution,
+            "YResolution": y_resolution,
+            "NumObjectTypes": self.num_object_types,
+            "rayDistances": None,
+            "rayHitObjectTypes": None,
+            "changedIdxs": None,
+            "changedDistances": None,
+            "changedHitObjectTypes": None,
+        }
+        self.sequence += 1
+        if (
+            self.sent_distances is None
+            or self.sent_object_types is None
+            or self.sent_distances.shape != flat_distances.shape
+            or self.frames_since_keyframe + 1 >= self.keyframe_interval
+        ):
+            self.sent_distances = flat_distances.copy()
+            self.sent_object_types = flat_object_types.copy()
+            self.frames_since_keyframe = 0
+            shape = [x_resolution, y_resolution]
+            res_d["isKeyframe"] = True
+            res_d["rayDistances"] = encode_ndarray(flat_distances.reshape(shape))
+            res_d["rayHitObjectTypes"] = encode_ndarray(
+                flat_object_types.reshape(shape)
+            )
+            return res_d
+        self.frames_since_keyframe += 1
+        changed_idxs = np.flatnonzero(
+            (flat_object_types != self.sent_object_types)
+            | (np.abs(flat_distances - self.sent_distances) > self.distance_threshold)
+        ).astype(np.int32)
+        self.sent_distances[changed_idxs] = flat_distances[changed_idxs]
+        self.sent_object_types[changed_idxs] = flat_object_types[changed_idxs]
+        res_d["changedIdxs"] = encode_ndarray(changed_idxs)
+        res_d["changedDistances"] = encode_ndarray(flat_distances[changed_idxs])
+        res_d["changedHitObjectTypes"] = encode_ndarray(flat_object_types[changed_idxs])
+        return res_d
+
+
+class StandInServerProcess:
+    """
+    Runs a StandInServer serving rl_methods in a separate process, so that benchmarks measure
+    the client without the server competing for the GIL, e.g.
+
+    with StandInServerProcess(port=9000, transport="tcp"):
+        comms = UnityComms(port=9000, transport="tcp")
+
+    extra_args are passed to `python -m peaceful_pie.testing`, e.g. ['--fixed-delta-time', '0.02']
+    """
+
+    def __init__(
+        self,
+        port: int,
+        transport: str = "http",
+        extra_args: Optional[List[str]] = None,
+        startup_timeout: float = 30.0,
+    ) -> None:
+        self.port = port
+        self.transport = transport
+        self.extra_args = extra_args if extra_args else []
+        self.startup_timeout = startup_timeout
+        self.process: Optional[subprocess.Popen] = None
+
+    def start(self) -> "StandInServerProcess":
+        # imported here, since server_pool imports unity_comms, which is not needed otherwise
+        from peaceful_pie.server_pool import ping
+
+        self.process = subprocess.Popen(
+            [
+                sys.executable,
+                "-m",
+                "peaceful_pie.testing",
+                "--port",
+                str(self.port),
+                "--transport",
+                self.transport,
+                *self.extra_args,
+            ]
+        )
+        deadline = time.monotonic() + self.startup_timeout
+        while not ping("localhost", self.port, self.transport):
+            if self.process.poll() is not None or time.monotonic() > deadline:
+                self.stop()
+                raise RuntimeError(f"Stand-in server on port {self.port} did not start")
+            time.sleep(0.05)
+        return self
+
+    def stop(self) -> None:
+        if self.process is not None:
+            self.process.terminate()
+            self.process.wait()
+            self.process = None
+
+    def __enter__(self) -> "StandInServerProcess":
+        return self.start()
+
+    def __exit__(self, *args: Any) -> None:
+        self.stop()
+
+
+class StandInEnv:
+    """
+    Gym-style env which needs no Unity, for testing and benchmarking vector envs. Observations
+    are float32 vectors filled with the step count, actions are MultiDiscrete. Needs gym.
+    """
+
+    metadata: Dict[str, Any] = {"render_modes": []}
+
+    def __init__(
+        self,
+        obs_size: int = 276,
+        num_actions: int = 2,
+        episode_length: int = 10,
+        sim_time: float = 0.0,
+    ) -> None:
+        """
+        :param obs_size: int Size of the observation vector
+        :param num_actions: int Number of MultiDiscrete actions, each with 4 choices
+        :param episode_length: int Episodes finish after this many steps
+        :param sim_time: float Seconds to sleep in each step, to simulate waiting for Unity
+        """
+        import gym.spaces
+
+        self.observation_space = gym.spaces.Box(
+            low=0, high=np.inf, shape=(obs_size,), dtype=np.float32
+        )
+        self.action_space = gym.spaces.MultiDiscrete([4] * num_actions)
+        self.episode_length = episode_length
+        self.sim_time = sim_time
+        self.num_steps = 0
+        self.last_action: Optional[NDArray] = None
+        self._pending_action: Optional[NDArray] = None
+
+    @property
+    def unwrapped(self) -> "StandInEnv":
+        return self
+
+    def _obs(self) -> NDArray[np.float32]:
+        return np.full(self.observation_space.shape, self.num_steps, dtype=np.float32)
+
+    def reset(self) -> NDArray[np.float32]:
+        self.num_steps = 0
+        return self._obs()
+
+    def step(
+        self, action: NDArray
+    ) -> Tuple[NDArray[np.float32], float, bool, Dict[str, Any]]:
+        if self.sim_time > 0:
+            time.sleep(self.sim_time)
+        self.num_steps += 1
+        self.last_action = action
+        done = self.num_steps >= self.episode_length
+        return self._obs(), float(self.num_steps), done, {"num_steps": self.num_steps}
+
+    def step_async(self, action: NDArray) -> None:
+        self._pending_action = action
+
+    def step_wait(self) -> Tuple[NDArray[np.float32], float, bool, Dict[str, Any]]:
+        assert self._pending_action is not None
+        action, self._pending_action = self._pending_action, None
+        return self.step(action)
+
+    def seed(self, seed: Optional[int] = None) -> List[Optional[int]]:
+        return [seed]
+
+    def close(self) -> None:
+        pass
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Serves rl_methods from a StandInServer, until killed"
+    )
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument(
+        "--transport", type=str, default="http", choices=["http", "tcp"]
+    )
+    parser.add_argument("--num-players", type=int, default=3)
+    parser.add_argument("--ray-resolution", type=int, default=5)
+    parser.add_argument("--episode-length", type=int, default=200)
+    parser.add_argument("--fixed-delta-time", type=float)
+    parser.add_argument("--max-requests-per-tick", type=int, default=1)
+    parser.add_argument("--empty-response-every", type=int, default=0)
+    parser.add_argument("--echo-timings", action="store_true")
+    args = parser.parse_args()
+    server = StandInServer(
+        methods=rl_methods(
+            num_players=args.num_players,
+            ray_resolution=args.ray_resolution,
+            episode_length=args.episode_length,
+        ),
+        port=args.port,
+        transport=args.transport,
+        echo_timings=args.echo_timings,
+        fixed_delta_time=args.fixed_delta_time,
+        max_requests_per_tick=args.max_requests_per_tick,
+        empty_response_every=args.empty_response_every,
+    )
+    server.start()
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.stop()
@@ -0,0 +1,492 @@
+import select
+import socket
+import struct
+import threading
+from abc import ABC, abstractmethod
+from collections import deque
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import IO, Any, Deque, Dict, List, Optional, Tuple
+
+import requests
+import urllib3
+
+URL_TEMPL = "http://{hostname}:{port}/jsonrpc"
+
+# each tcp frame is a 4-byte big-endian unsigned length, followed by that many bytes of utf-8 json
+FRAME_HEADER = struct.Struct(">I")
+
+
+class FatalTransportError(Exception):
+    """
+    Raised by a transport for errors which retrying cannot fix. UnityComms does not retry these.
+    """
+
+
+class ResponseLostError(ConnectionError):
+    """
+    Raised when the connection fails after the request was sent, so Unity may have processed
+    it. UnityComms only retries these for idempotent methods. See RetryPolicy.
+    """
+
+
+class ReplayExhaustedError(FatalTransportError):
+    pass
+
+
+class ReplayMismatchError(FatalTransportError):
+    pass
+
+
+class Transport(ABC):
+    """
+    Sends an encoded json rpc request to Unity, and returns the encoded response. Should raise
+    ConnectionError if Unity could not be reached, so that UnityComms can retry,
+    ResponseLostError if the connection failed after sending, and TimeoutError if Unity did not
+    respond within the timeout. Transports must be safe to call from several threads at once.
+    """
+
+    @abstractmethod
+    def send(self, body: bytes, timeout: Optional[float] = None) -> bytes:
+        """
+        :param timeout: Optional[float] Seconds to wait for Unity to respond to this request,
+            e.g. the time left before a deadline. None uses the transport's own timeout
+        """
+        ...
+
+    def close(self) -> None:
+        pass
+
+
+class HttpTransport(Transport):
+    """
+    Default transport. One HTTP POST per request, to NetManager's HttpListener. Each thread
+    gets its own requests.Session, and so its own keep-alive connection, since sessions are not
+    thread-safe.
+    """
+
+    def __init__(
+        self, hostname: str, port: int, timeout: Optional[float] = None
+    ) -> None:
+        """
+        :param timeout: Optional[float] Seconds to wait for Unity to respond. None waits forever.
+        """
+        self.url = URL_TEMPL.format(hostname=hostname, port=port)
+        self.timeout = timeout
+        self._init_sessions()
+
+    def _init_sessions(self) -> None:
+        self._local = threading.local()
+        self._sessions: List[requests.Session] = []
+        self._lock = threading.Lock()
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # sessions and locks cannot be pickled, e.g. to send to a SubprocVecEnv worker, so the
+        # unpickled copy opens its own
+        state = self.__dict__.copy()
+        del state["_local"], state["_sessions"], state["_lock"]
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        self._init_sessions()
+
+    @property
+    def session(self) -> requests.Session:
+        """
+        The calling thread's session
+        """
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = requests.Session()
+            with self._lock:
+                self._sessions.append(session)
+        return session
+
+    def send(self, body: bytes, timeout: Optional[float] = None) -> bytes:
+        try:
+            res = self.session.post(
+                self.url,
+                data=body,
+                headers={"Content-Type": "application/json"},
+                timeout=self.timeout if timeout is None else timeout,
+            )
+        except requests.exceptions.ConnectionError as e:
+            if e.args and isinstance(e.args[0], urllib3.exceptions.ProtocolError):
+                # e.g. Unity crashed whilst processing the request
+                raise ResponseLostError(e)
+            # otherwise we could not connect, e.g. Unity is not listening yet. Includes
+            # ConnectTimeout
+            raise ConnectionError(e)
+        except requests.exceptions.Timeout as e:
+            raise TimeoutError(e)
+        except requests.exceptions.ChunkedEncodingError as e:
+            raise ResponseLostError(e)
+        return res.content
+
+    def close(self) -> None:
+        with self._lock:
+            sessions, self._sessions = self._sessions, []
+            self._local = threading.local()
+        for session in sessions:
+            session.close()
+
+
+class TcpTransport(Transport):
+    """
+    Persistent TCP connection, sending length-prefixed json frames. Avoids the overhead of the
+    http stack for each request. Needs NetManager to be listening in Tcp mode, e.g. by
+    starting the dedicated server with `--transport tcp`. Each thread gets its own connection.
+    See PipelinedTcpTransport to share one connection between threads instead.
+    """
+
+    def __init__(
+        self, hostname: str, port: int, timeout: Optional[float] = None
+    ) -> None:
+        """
+        :param timeout: Optional[float] Seconds to wait for Unity to respond. None waits forever.
+        """
+        self.hostname = hostname
+        self.port = port
+        self.timeout = timeout
+        self._init_socks()
+
+    def _init_socks(self) -> None:
+        self._local = threading.local()
+        self._socks: List[socket.socket] = []
+        self._lock = threading.Lock()
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # the unpickled copy opens its own connections. See HttpTransport.__getstate__
+        state = self.__dict__.copy()
+        del state["_local"], state["_socks"], state["_lock"]
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        self._init_socks()
+
+    @property
+    def sock(self) -> Optional[socket.socket]:
+        """
+        The calling thread's connection, if connected
+        """
+        return getattr(self._local, "sock", None)
+
+    @sock.setter
+    def sock(self, sock: Optional[socket.socket]) -> None:
+        with self._lock:
+            old_sock = self.sock
+            if old_sock is not None:
+                if old_sock in self._socks:
+                    self._socks.remove(old_sock)
+                old_sock.close()
+            if sock is not None:
+                self._socks.append(sock)
+            self._local.sock = sock
+
+    def _connect(self, timeout: Optional[float]) -> socket.socket:
+        sock = socket.create_connection((self.hostname, self.port), timeout=timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return sock
+
+    def _is_dropped(self, sock: socket.socket) -> bool:
+        # Unity never sends unprompted, so a readable idle socket has been closed, e.g. because
+        # Unity restarted
+        readable, _, _ = select.select([sock], [], [], 0)
+        return len(readable) > 0
+
+    def send(self, body: bytes, timeout: Optional[float] = None) -> bytes:
+        if timeout is None:
+            timeout = self.timeout
+        sent = False
+        try:
+            sock = self.sock
+            if sock is not None and self._is_dropped(sock):
+                sock = self.sock = None
+            if sock is None:
+                sock = self.sock = self._connect(timeout)
+            elif sock.gettimeout() != timeout:
+                sock.settimeout(timeout)
+            sock.sendall(FRAME_HEADER.pack(len(body)) + body)
+            sent = True
+            (length,) = FRAME_HEADER.unpack(recv_exactly(sock, FRAME_HEADER.size))
+            return recv_exactly(sock, length)
+        except socket.timeout as e:
+            # the rest of the response might still arrive, so we cannot reuse the connection
+            self.sock = None
+            if not sent:
+                raise ConnectionError(e)
+            raise TimeoutError(e)
+        except OSError as e:
+            self.sock = None
+            if sent:
+                raise ResponseLostError(e)
+            raise ConnectionError(e)
+
+    def close(self) -> None:
+        with self._lock:
+            socks, self._socks = self._socks, []
+            self._local = threading.local()
+        for sock in socks:
+            sock.close()
+
+
+class PipelinedTcpTransport(Transport):
+    """
+    One TCP connection, shared by every thread, with any number of requests in flight at once.
+    Requests are written as soon as they are sent, without waiting for earlier responses, and a
+    background thread reads the responses. NetManager replies to the requests on a connection
+    in the order they arrived, so responses are matched to requests by their order on the
+    connection.
+
+    If the connection fails, or a response times out, every request in flight fails with
+    ResponseLostError, and the next request reconnects.
+    """
+
+    def __init__(
+        self, hostname: str, port: int, timeout: Optional[float] = None
+    ) -> None:
+        """
+        :param timeout: Optional[float] Seconds to wait for Unity to respond. None waits forever.
+        """
+        self.hostname = hostname
+        self.port = port
+        self.timeout = timeout
+        self._init_sock()
+
+    def _init_sock(self) -> None:
+        # guards sock and pending, and keeps each frame, and its place in pending, together
+        self._lock = threading.Lock()
+        self.sock: Optional[socket.socket] = None
+        self._pending: Deque[Future] = deque()
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # the unpickled copy opens its own connection. See HttpTransport.__getstate__
+        state = self.__dict__.copy()
+        del state["_lock"], state["sock"], state["_pending"]
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        self._init_sock()
+
+    def _connect(self, timeout: Optional[float]) -> socket.socket:
+        sock = socket.create_connection((self.hostname, self.port), timeout=timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        # the reader thread waits indefinitely; timeouts are applied to each response
+        sock.settimeout(None)
+        threading.Thread(
+            target=self._read_responses,
+            args=(sock,),
+            name=f"PipelinedTcpTransport-{self.port}",
+            daemon=True,
+        ).start()
+        return sock
+
+    def send(self, body: bytes, timeout: Optional[float] = None) -> bytes:
+        if timeout is None:
+            timeout = self.timeout
+        future: Future = Future()
+        with self._lock:
+            try:
+                if self.sock is None:
+                    self.sock = self._connect(timeout)
+            except OSError as e:
+                raise ConnectionError(e)
+            sock = self.sock
+            self._pending.append(future)
+            send_error: Optional[OSError] = None
+            try:
+                sock.sendall(FRAME_HEADER.pack(len(body)) + body)
+            except OSError as e:
+                send_error = e
+        if send_error is not None:
+            # the other requests in flight fail with ResponseLostError, but this one never
+            # reached Unity, so may be retried, whatever the method
+            self._drop(sock, send_error)
+            raise ConnectionError(send_error)
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError as e:
+            # any later response would be matched to the wrong request
+            self._drop(sock, e)
+            raise TimeoutError(f"No response after {timeout} seconds")
+
+    def _read_responses(self, sock: socket.socket) -> None:
+        try:
+            while True:
+                (length,) = FRAME_HEADER.unpack(recv_exactly(sock, FRAME_HEADER.size))
+                content = recv_exactly(sock, length)
+                with self._lock:
+                    if self.sock is not sock:
+                        return
+                    future = self._pending.popleft() if self._pending else None
+                if future is None:
+                    # we can no longer tell which response belongs to which request
+                    self._drop(sock, ConnectionError("Response without a request"))
+                    return
+                future.set_result(content)
+        except OSError as e:
+            self._drop(sock, e)
+
+    def _drop(self, sock: socket.socket, e: Exception) -> None:
+        """
+        Closes sock, and fails the requests in flight on it, if it is still the current
+        connection
+        """
+        with self._lock:
+            if self.sock is not sock:
+                return
+            self.sock = None
+            pending, self._pending = self._pending, deque()
+        sock.close()
+        for future in pending:
+            if not future.done():
+                future.set_exception(ResponseLostError(e))
+
+    def close(self) -> None:
+        sock = self.sock
+        if sock is not None:
+            self._drop(sock, ConnectionError("Transport closed"))
+
+
+def recv_exactly(sock: socket.socket, num_bytes: int) -> bytes:
+    buf = bytearray(num_bytes)
+    view = memoryview(buf)
+    received = 0
+    while received < num_bytes:
+        n = sock.recv_into(view[received:])
+        if n == 0:
+            raise ConnectionResetError("Connection closed by server")
+        received += n
+    return bytes(buf)
+
+
+class RecordingTransport(Transport):
+    """
+    Wraps another transport, and appends each request, and the response received, to a recording
+    file, for replay by ReplayTransport. Each exchange is stored as two length-prefixed frames,
+    as for TcpTransport: the request, then the response.
+    """
+
+    def __init__(self, transport: Transport, path: str) -> None:
+        self.transport = transport
+        self.path = path
+        self._f: Optional[IO[bytes]] = open(path, "ab")
+        self._lock = threading.Lock()
+
+    def send(self, body: bytes, timeout: Optional[float] = None) -> bytes:
+        content = self.transport.send(body, timeout=timeout)
+        with self._lock:
+            if self._f is not None:
+                self._f.write(
+                    FRAME_HEADER.pack(len(body))
+                    + body
+                    + FRAME_HEADER.pack(len(content))
+                    + content
+                )
+        return content
+
+    def close_recording(self) -> None:
+        with self._lock:
+            if self._f is not None:
+                self._f.close()
+                self._f = None
+
+    def close(self) -> None:
+        self.close_recording()
+        self.transport.close()
+
+
+def read_recording(path: str) -> List[Tuple[bytes, bytes]]:
+    """
+    Returns the (request, response) pairs written by RecordingTransport. Ignores a partial
+    exchange at the end, e.g. if the recording process was killed.
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    frames = []
+    offset = 0
+    while offset + FRAME_HEADER.size <= len(data):
+        (length,) = FRAME_HEADER.unpack_from(data, offset)
+        offset += FRAME_HEADER.size
+        if offset + length > len(data):
+            break
+        frames.append(data[offset : offset + length])
+        offset += length
+    return list(zip(frames[::2], frames[1::2]))
+
+
+class ReplayTransport(Transport):
+    """
+    Returns the responses in a recording written by RecordingTransport, in order, whatever the
+    request. Raises ReplayExhaustedError once every response has been returned. See rewind.
+    """
+
+    def __init__(self, path: str, strict: bool = False) -> None:
+        """
+        :param path: str Recording file written by RecordingTransport
+        :param strict: bool If True, raise ReplayMismatchError unless each request is identical
+            to the recorded request
+        """
+        self.path = path
+        self.strict = strict
+        self.exchanges = read_recording(path)
+        self.position = 0
+        self._lock = threading.Lock()
+
+    def __getstate__(self) -> Dict[str, Any]:
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def rewind(self) -> None:
+        with self._lock:
+            self.position = 0
+
+    @property
+    def num_remaining(self) -> int:
+        return len(self.exchanges) - self.position
+
+    def send(self, body: bytes, timeout: Optional[float] = None) -> bytes:
+        # several threads may share one UnityComms, so claim each response exactly once
+        with self._lock:
+            if self.position >= len(self.exchanges):
+                raise ReplayExhaustedError(
+                    f"All {len(self.exchanges)} responses in {self.path} have been replayed"
+                )
+            request, response = self.exchanges[self.position]
+            if self.strict and body != request:
+                raise ReplayMismatchError(
+                    f"Request {self.position} differs from the recording:\n"
+                    f"recorded {request[:200]!r}\nreplayed {body[:200]!r}"
+                )
+            self.position += 1
+        return response
+
+
+def create_transport(
+    transport: str,
+    hostname: str,
+    port: int,
+    timeout: Optional[float] = None,
+    pipelined: bool = False,
+) -> Transport:
+    """
+    :param transport: str One of 'http' or 'tcp'
+    :param timeout: Optional[float] Seconds to wait for Unity to respond. None waits forever.
+    :param pipelined: bool For 'tcp', share one connection between threads, with several
+        requests in flight. See PipelinedTcpTransport
+    """
+    if transport == "http":
+        return HttpTransport(hostname=hostname, port=port, timeout=timeout)
+    if transport == "tcp" and pipelined:
+        return PipelinedTcpTransport(hostname=hostname, port=port, timeout=timeout)
+    if transport == "tcp":
+        return TcpTransport(hostname=hostname, port=port, timeout=timeout)
+    raise ValueError(f"Unknown transport {transport}, should be one of 'http', 'tcp'")
@@ -1,23 +1,171 @@
 import atexit
 import dataclasses
 import datetime
-import subprocess
+import json
+import threading
 import time
+from concurrent.futures import Future, ThreadPoolExecutor
 from contextlib import contextmanager
-from typing import Any, Dict, Generator, Optional, Type
+from dataclasses import dataclass
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    Callable,
+    Dict,
+    Generator,
+    List,
+    Optional,
+    Sequence,
+    Type,
+    Union,
+)
 
-import chili
-import requests
+from peaceful_pie import dataclass_codec, ndarray_codec
+from peaceful_pie.metrics import CommsMetrics
+from peaceful_pie.retry import (  # noqa: F401
+    RetriesExhaustedError,
+    RetryPolicy,
+    RetryState,
+    RpcTimeoutError,
+)
+from peaceful_pie.transports import (  # noqa: F401
+    URL_TEMPL,
+    FatalTransportError,
+    HttpTransport,
+    PipelinedTcpTransport,
+    RecordingTransport,
+    ReplayTransport,
+    ResponseLostError,
+    TcpTransport,
+    Transport,
+    create_transport,
+)
 
-URL_TEMPL = "http://{hostname}:{port}/jsonrpc"
+if TYPE_CHECKING:
+    from peaceful_pie.server_pool import UnityServer
+
+ndarray_codec.register_chili_strategies()
 
 
 class CSException(Exception):
     pass
 
 
+class UnityCommsGroupError(Exception):
+    """
+    Raised by UnityCommsGroup when a call failed on some of its servers. errors and results
+    have one entry per server, in order. errors is None for servers which succeeded, and
+    results is None for servers which failed.
+    """
+
+    def __init__(
+        self, message: str, errors: List[Optional[BaseException]], results: List[Any]
+    ) -> None:
+        super().__init__(message)
+        self.errors = errors
+        self.results = results
+
+
+@dataclass
+class RpcCall:
+    """
+    One call within a batch sent by UnityComms.rpc_batch
+    """
+
+    method: str
+    params_dict: Optional[Dict[str, Any]] = None
+    ResultClass: Optional[Type] = None
+
+
+def encode_params(params_dict: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Converts any dataclass values in params_dict into dicts, ready to send as json
+    """
+    new_dict = {}
+    for k, v in params_dict.items():
+        if dataclasses.is_dataclass(v):
+            v = dataclass_codec.get_encoder(type(v))(v)
+        new_dict[k] = v
+    return new_dict
+
+
+def decode_response(res_d: Dict[str, Any], ResultClass: Optional[Type]) -> Any:
+    """
+    Returns the result from a json rpc response dict, converted into ResultClass, if provided.
+    Raises CSException if the response contains an error.
+    """
+    if "error" in res_d:
+        print("res_d", res_d)
+        err_data = res_d["error"]["data"]
+        if isinstance(err_data, dict):
+            print(err_data["ClassName"])
+            print(err_data["Message"])
+            print(err_data["StackTraceString"].replace("\\n", "\n"))
+            raise CSException(err_data["Message"])
+        else:
+            raise CSException(err_data)
+    if ResultClass is None:
+        return res_d["result"]
+    return dataclass_codec.get_decoder(ResultClass)(res_d["result"])
+
+
+def decode_batch_response(
+    res_l: Union[List[Dict[str, Any]], Dict[str, Any]],
+    calls: List[RpcCall],
+    payloads: List[Dict[str, Any]],
+    return_exceptions: bool = False,
+) -> List[Any]:
+    """
+    Matches the responses to a json rpc batch back to the calls, by id, and returns the decoded
+    results, in the same order as `calls`
+
+    :param return_exceptions: bool If True, the CSException for each call which failed is
+        returned in place of its result, rather than raised
+    """
+    if isinstance(res_l, dict):
+        # the whole batch was rejected, e.g. a parse error
+        return decode_response(res_l, None)
+    res_by_id = {res_d.get("id"): res_d for res_d in res_l}
+    results = []
+    for call, payload in zip(calls, payloads):
+        try:
+            if payload["id"] not in res_by_id:
+                raise CSException(f"No response for {call.method} id {payload['id']}")
+            results.append(decode_response(res_by_id[payload["id"]], call.ResultClass))
+        except CSException as e:
+            if not return_exceptions:
+                raise
+            results.append(e)
+    return results
+
+
+def pop_server_timing(
+    res: Union[List[Dict[str, Any]], Dict[str, Any]]
+) -> Optional[Dict[str, float]]:
+    """
+    Removes the 'timing' field that NetManager adds to responses when EchoTimings is on, and
+    returns it, converted to seconds, keyed by metrics phase. For a batch, the timing is in the
+    last response. Returns None if there is no timing. NetManager serializes the reply to json
+    as part of running the handler, so server_handler includes the json serialization, and
+    server_encode is only the utf-8 encoding.
+    """
+    res_d = res[-1] if isinstance(res, list) and len(res) > 0 else res
+    if not isinstance(res_d, dict) or "timing" not in res_d:
+        return None
+    timing = res_d.pop("timing")
+    return {
+        "server_queue_wait": timing["queue_wait_ms"] / 1000,
+        "server_handler": timing["handler_ms"] / 1000,
+        "server_encode": timing["encode_ms"] / 1000,
+    }
+
+
 class UnityCommsFn:
-    def __init__(self, unity_comms: "UnityComms", method_name: str):
+    def __init__(
+        self,
+        unity_comms: Union["UnityComms", "UnityCommsBatch", "UnityCommsGroup"],
+        method_name: str,
+    ):
         self.unity_comms = unity_comms
         self.method_name = method_name
 
@@ -32,6 +180,97 @@ class UnityCommsFn:
         )
 
 
+class UnityCommsBatch:
+    """
+    Queues up calls, and sends them to Unity as a single JSON-RPC 2.0 batch, using one
+    HTTP request. Obtain using `UnityComms.batch()`. Each queued call returns a Future, whose
+    result is available once the batch has been sent, e.g.
+
+    with unity_comms.batch() as batch:
+        step_future = batch.rlStep(actions=actions, ResultClass=RLResult)
+        pos_future = batch.getPos(ResultClass=Vector3)
+    rl_result = step_future.result()
+    """
+
+    def __init__(self, unity_comms: "UnityComms"):
+        self.unity_comms = unity_comms
+        self.calls: List[RpcCall] = []
+        self.futures: List[Future] = []
+        self.retry = True
+
+    def __getattr__(self, method_name: str) -> UnityCommsFn:
+        if method_name.startswith("_"):
+            raise AttributeError()
+        return UnityCommsFn(unity_comms=self, method_name=method_name)
+
+    def __getitem__(self, method_name: str) -> UnityCommsFn:
+        return UnityCommsFn(unity_comms=self, method_name=method_name)
+
+    def rpc_call(
+        self,
+        method: str,
+        params_dict: Optional[Dict[str, Any]] = None,
+        ResultClass: Optional[Type] = None,
+        retry: bool = True,
+        **kwargs: Any,
+    ) -> Future:
+        """
+        Queues a call. Same parameters as UnityComms.rpc_call. If any queued call has retry False,
+        then the whole batch is sent without retrying.
+        """
+        params_dict = dict(params_dict) if params_dict else {}
+        params_dict.update(kwargs)
+        self.calls.append(
+            RpcCall(method=method, params_dict=params_dict, ResultClass=ResultClass)
+        )
+        self.retry = self.retry and retry
+        future: Future = Future()
+        self.futures.append(future)
+        return future
+
+    def send(self) -> List[Any]:
+        """
+        Sends all queued calls, and resolves their futures. Returns the list of results, in the
+        same order as the calls were queued. If any call raised in Unity, its future holds the
+        CSException, the other futures hold their results, and the first CSException is raised.
+        """
+        calls, futures = self.calls, self.futures
+        self.calls, self.futures = [], []
+        if len(calls) == 0:
+            return []
+        try:
+            results = self.unity_comms.rpc_batch(
+                calls, retry=self.retry, return_exceptions=True
+            )
+        except Exception as e:
+            for future in futures:
+                future.set_exception(e)
+            raise e
+        if results is None:
+            # connection error, with retry False
+            results = [None] * len(calls)
+        errors = []
+        for future, result in zip(futures, results):
+            if isinstance(result, CSException):
+                future.set_exception(result)
+                errors.append(result)
+            else:
+                future.set_result(result)
+        if len(errors) > 0:
+            self.unity_comms.metrics.count("batch", "errors")
+            raise errors[0]
+        return results
+
+    def cancel(self) -> None:
+        """
+        Discards all queued calls, without sending them, and cancels their futures
+        """
+        futures = self.futures
+        self.calls, self.futures = [], []
+        for future in futures:
+            future.cancel()
+
+
 class UnityComms:
     def __init__(
         self,
@@ -39,8 +278,16 @@ class UnityComms:
         server_executable_path: Optional[str] = None,
         logfile: Optional[str] = None,
         hostname: str = "localhost",
+        transport: Union[str, Transport] = "http",
+        metrics: bool = True,
+        retry_policy: Optional[RetryPolicy] = None,
+        pipelined: bool = False,
     ) -> None:
         """
+        UnityComms is thread-safe, so one instance can be shared by e.g. a ThreadPoolExecutor, or a
+        monitoring thread. With the 'http' and 'tcp' transports, each thread gets its own
+        connection.
+
         :param port: int The port that Unity will run on. Always mandatory. If server_executable_path is provided, we
             will start the server with commandline `--port {port}`
         :param server_executable_path: Optional[str] Path to dedicatd server executable to run
@@ -48,6 +295,16 @@ class UnityComms:
         :param hostname: str  If providing server_executable_path, must be 'localhost', otherwise the hostname where
             the Unity process is running. Reminder that all network communications are insecure, so best to set this
             to localhost. (For secure network communciations you could use e.g. ssh tunnels)
+        :param transport: Union[str, Transport] How to send requests to Unity. 'http' (the default) or 'tcp'.
+            'tcp' uses a persistent socket with length-prefixed json frames, which has less overhead per call, and
+            needs NetManager to listen in Tcp mode. If providing server_executable_path, we will start the server
+            with commandline `--transport tcp`. Can also be a Transport instance.
+        :param metrics: bool Whether to collect per-method counters and latency histograms. See stats()
+        :param retry_policy: Optional[RetryPolicy] How to retry failed calls. Its timeout is passed to the
+            transport, unless transport is a Transport instance. Defaults to RetryPolicy(), which retries
+            forever, with exponential backoff, and never re-sends rlStep once it might have reached Unity.
+        :param pipelined: bool With transport 'tcp', share one connection between all threads, with several
+            requests in flight at once, rather than one connection per thread. See PipelinedTcpTransport
         """
         self.server_executable_path = server_executable_path
         if server_executable_path is not None:
@@ -56,35 +313,75 @@ class UnityComms:
             ), "Must use hostname localhost if passing in server_executable_path"
         self.hostname = hostname
         self.port = port
-        self.session = requests.Session()
+        self.retry_policy = retry_policy if retry_policy is not None else RetryPolicy()
+        self.transport_name = transport if isinstance(transport, str) else None
+        self.transport = (
+            create_transport(
+                transport,
+                hostname=hostname,
+                port=port,
+                timeout=self.retry_policy.timeout,
+                pipelined=pipelined,
+            )
+            if isinstance(transport, str)
+            else transport
+        )
         self.jsonrpc_id = 0
+        self._id_lock = threading.Lock()
         self.logfile = logfile
+        self.server: Optional["UnityServer"] = None
+        self.metrics = CommsMetrics(enabled=metrics)
+        # runs rpc_call_async calls, created on first use
+        self._executor: Optional[ThreadPoolExecutor] = None
 
         if server_executable_path is not None:
             atexit.register(self._kill_server)
             self._start_server()
 
+    def __getstate__(self) -> Dict[str, Any]:
+        """
+        Lets a UnityComms be pickled, e.g. inside an env factory passed to SubprocVecEnv. The
+        copy connects to the same port, but does not own any server process that we started
+        """
+        state = self.__dict__.copy()
+        del state["_id_lock"]
+        state["server"] = None
+        state["_executor"] = None
+        return state
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        self._id_lock = threading.Lock()
+
     def _start_server(self) -> None:
+        # imported here, since server_pool imports UnityComms
+        from peaceful_pie.server_pool import UnityServer
+
         assert self.server_executable_path is not None
-        cmd_line = [self.server_executable_path, "--port", str(self.port)]
-        print(cmd_line)
-        subprocess.Popen(
-            cmd_line,
+        self.server = UnityServer(
+            self.server_executable_path,
+            port=self.port,
+            transport=self.transport_name or "http",
         )
+        self.server.start()
 
     def _kill_server(self, *args: Any, **kwargs: Any) -> None:
         print("Asking unity to die")
         self.rpc_call("shutdownUnity", retry=False)
+        if self.server is not None:
+            # in case unity did not respond, and to clean up any child processes
+            self.server.stop()
 
     def _rpc_request_dict(self, method: str, params: Dict[str, Any]) -> Dict[str, Any]:
-        res = {
+        with self._id_lock:
+            jsonrpc_id = self.jsonrpc_id
+            self.jsonrpc_id += 1
+        return {
             "method": method,
             "params": params,
             "jsonrpc": "2.0",
-            "id": self.jsonrpc_id,
+            "id": jsonrpc_id,
         }
-        self.jsonrpc_id += 1
-        return res
 
     @contextmanager
     def blocking_listen(self) -> Generator:
@@ -118,6 +415,29 @@ class UnityComms:
     def get_autosimulation(self) -> bool:
         return self.rpc_call("getAutosimulation")
 
+    def start_recording(self, path: str) -> None:
+        """
+        Appends every request sent, and response received, from now on, to path, for replay by
+        ReplayUnityComms, e.g. to benchmark decoding without Unity
+        """
+        self.stop_recording()
+        self.transport = RecordingTransport(self.transport, path)
+
+    def stop_recording(self) -> None:
+        if isinstance(self.transport, RecordingTransport):
+            self.transport.close_recording()
+            self.transport = self.transport.transport
+
+    def set_echo_timings(self, echo_timings: bool) -> None:
+        """
+        Asks NetManager to send its timings with each response: how long the request waited for
+        FixedUpdate, how long processing it took, including serializing the reply to json, and
+        how long utf-8 encoding the reply took. These are recorded in self.metrics, as the phases
+        server_queue_wait, server_handler and server_encode, along with 'transport', the network
+        time not spent inside Unity.
+        """
+        self.rpc_call("setEchoTimings", {"echoTimings": echo_timings})
+
     def __getattr__(self, method_name: str) -> UnityCommsFn:
         if method_name.startswith("_"):
             raise AttributeError()
@@ -141,71 +461,449 @@ class UnityComms:
             keyed by parameter name
             Can provide structured data using dataclasses
         :param ResultClass: Optional[Type] If not None, then the returned json dict will be converted
-            into this type, using Chili. Should be a dataclass. If None, then the raw result dict will
-            be returned instead.
+            into this type, using a decoder generated for this type the first time it is seen (see
+            dataclass_codec), falling back to Chili. Should be a dataclass. If None, then the raw result
+            dict will be returned instead.
         :param **kwargs: dict[str, Any]  You can also simply pass in parameters by name
         """
+        start_time = time.perf_counter()
         params_dict = params_dict if params_dict else {}
         params_dict.update(kwargs)
-        new_dict = {}
-        for k, v in params_dict.items():
-            if dataclasses.is_dataclass(v):
-                v = chili.asdict(v)
-            new_dict[k] = v
-        params_dict = new_dict
-        payload = self._rpc_request_dict(method, params_dict)
-        url = URL_TEMPL.format(port=self.port, hostname=self.hostname)
-        response = None
-        res = None
-        while response is None:
+        payload = self._rpc_request_dict(method, encode_params(params_dict))
+        return self._post(
+            payload,
+            decode=lambda res_d: decode_response(res_d, ResultClass),
+            retry=retry,
+            method=method,
+            start_time=start_time,
+            idempotent=self.retry_policy.is_idempotent(method),
+        )
+
+    def rpc_call_async(
+        self,
+        method: str,
+        params_dict: Optional[Dict[str, Any]] = None,
+        ResultClass: Optional[Type] = None,
+        retry: bool = True,
+        **kwargs: Any,
+    ) -> Future:
+        """
+        Same as rpc_call, but returns immediately, with a Future for the result. The call runs on
+        a background thread, so python can e.g. run inference for one environment while Unity
+        simulates another, e.g.
+
+        step_future = unity_comms.rpc_call_async("rlStep", actions=actions, ResultClass=RLResult)
+        # do other stuff here
+        rl_result = step_future.result()
+
+        Calls made using rpc_call_async run one at a time, in the order they were made. Wait for
+        any pending futures before making blocking calls on the same UnityComms.
+        """
+        params_dict = dict(params_dict) if params_dict else {}
+        params_dict.update(kwargs)
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix=f"UnityComms-{self.port}"
+            )
+        return self._executor.submit(
+            self.rpc_call,
+            method=method,
+            params_dict=params_dict,
+            ResultClass=ResultClass,
+            retry=retry,
+        )
+
+    @contextmanager
+    def batch(self) -> Generator[UnityCommsBatch, None, None]:
+        """
+        Sends all calls made on the yielded UnityCommsBatch as a single JSON-RPC 2.0 batch, in one
+        HTTP round-trip, when the `with` block exits. See UnityCommsBatch.
+        """
+        batch = UnityCommsBatch(unity_comms=self)
+        try:
+            yield batch
+        except BaseException:
+            # nothing was sent, so make sure no one waits on the futures forever
+            batch.cancel()
+            raise
+        batch.send()
+
+    def rpc_batch(
+        self, calls: List[RpcCall], retry: bool = True, return_exceptions: bool = False
+    ) -> List[Any]:
+        """
+        Sends several calls to Unity as a single JSON-RPC 2.0 batch, in one HTTP round-trip.
+        Responses are matched back to calls by id, and each result is converted using the
+        ResultClass of its call, as for rpc_call.
+
+        :param calls: List[RpcCall] The calls to send
+        :param retry: bool Whether to retry the whole batch on connection errors
+        :param return_exceptions: bool If True, return the CSException of each call which
+            raised in Unity in place of its result, rather than raising the first
+        :return: List[Any] the result for each call, in the same order as `calls`
+        """
+        start_time = time.perf_counter()
+        payloads = [
+            self._rpc_request_dict(call.method, encode_params(call.params_dict or {}))
+            for call in calls
+        ]
+
+        return self._post(
+            payloads,
+            decode=lambda res_l: decode_batch_response(
+                res_l, calls, payloads, return_exceptions
+            ),
+            retry=retry,
+            method="batch",
+            start_time=start_time,
+            idempotent=all(
+                self.retry_policy.is_idempotent(call.method) for call in calls
+            ),
+        )
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Returns a snapshot of the counters and latency histograms of each method called so far, as
+        {method: {"counters": {...}, "latencies": {phase: {"p50": ..., ...}}}}, with latencies in
+        seconds. Batches are recorded under 'batch'. See CommsMetrics for the phases and counters.
+        Use self.metrics.format() for a printable table.
+        """
+        return self.metrics.snapshot()
+
+    def start_stats_dump(self, interval: float, logfile: Optional[str] = None) -> None:
+        """
+        Prints the stats every interval seconds, or appends them to logfile, if provided
+        """
+        self.metrics.start_periodic_dump(interval, logfile=logfile)
+
+    def _post(
+        self,
+        payload: Union[Dict[str, Any], List[Dict[str, Any]]],
+        decode: Callable[[Any], Any],
+        retry: bool,
+        method: str,
+        start_time: float,
+        idempotent: bool,
+    ) -> Any:
+        """
+        Sends payload, retrying according to self.retry_policy
+
+        :param retry: bool If False, return None on connection errors and empty responses,
+            rather than retrying
+        :param method: str Name to record metrics under
+        :param start_time: float time.perf_counter() before the params were encoded
+        :param idempotent: bool Whether the payload may be re-sent after Unity might have
+            processed it
+        """
+        metrics = self.metrics
+        policy = self.retry_policy
+        body = json.dumps(payload, allow_nan=False).encode("utf-8")
+        send_time = time.perf_counter()
+        metrics.count(method, "calls")
+        metrics.record(method, "serialize", send_time - start_time)
+        retry_state = RetryState(policy, method, idempotent, start_time=start_time)
+        while True:
+            content = None
+            error: Optional[Exception] = None
+            send_time = time.perf_counter()
+            timeout = retry_state.start_attempt()
             try:
-                res = self.session.post(url, json=payload)
-                if res.content is None:
-                    print("content is None => skipping")
-                    continue
-                if res.content == "".encode("utf-8"):
-                    # no json content detected => retry
-                    continue
-                if res.content.decode("utf-8").strip() == "":
-                    print("stripped content is empty string => skipping")
-                    continue
-                res_d = res.json()
-                if "error" in res_d:
-                    print("res_d", res_d)
-                    err_data = res_d["error"]["data"]
-                    if isinstance(err_data, dict):
-                        print(err_data["ClassName"])
-                        print(err_data["Message"])
-                        print(err_data["StackTraceString"].replace("\\n", "\n"))
-                        raise CSException(err_data["Message"])
-                    else:
-                        raise CSException(err_data)
-                if ResultClass is None:
-                    return res_d["result"]
-                response = chili.init_dataclass(res_d["result"], ResultClass)
-            except requests.exceptions.ConnectionError:
-                if retry:
-                    print("requests.exceptions.ConnectionError => ignoring, retrying")
-                    time.sleep(0.1)
+                content = self.transport.send(body, timeout=timeout)
+            except FatalTransportError:
+                raise
+            except ConnectionError as e:
+                # includes ResponseLostError
+                if not retry:
+                    return None
+                error = e
+            except TimeoutError as e:
+                metrics.count(method, "timeouts")
+                if not retry:
+                    raise retry_state.timeout_error() from e
+                error = e
+            if content is not None and content.strip() == b"":
+                metrics.count(method, "empty_skips")
+                if not retry:
+                    return None
+            elif content is not None:
+                recv_time = time.perf_counter()
+                try:
+                    res = json.loads(content)
+                except ValueError as e:
+                    self._log_error(payload, content, e)
+                    if not retry:
+                        raise
+                    error = e
                 else:
-                    return
-            except CSException as e:
-                print("payload", payload)
-                print("res", res)
-                raise e
-            except Exception as e:
-                print("payload", payload)
-                print("res", res)
-                if res is not None:
-                    print("res.content", res.content)
-                print("e", e)
-                if self.logfile is not None:
-                    with open(self.logfile, "a") as f:
-                        datetime_str = datetime.datetime.now().strftime("%Y%m%d %H%M%S")
-                        f.write(f"{datetime_str}: payload {payload}\n")
-                        f.write(f"{datetime_str}: res {res}\n")
-                        if res is not None:
-                            f.write(f"{datetime_str}: res.content {str(res.content)}\n")
-                        f.write(f"{datetime_str}: e {e}\n")
-                time.sleep(0.1)
-        return response
+                    server_timing = pop_server_timing(res)
+                    parse_time = time.perf_counter()
+                    try:
+                        result = decode(res)
+                    except CSException:
+                        metrics.count(method, "errors")
+                        print("payload", payload)
+                        print("content", content)
+                        raise
+                    except Exception as e:
+                        # e.g. the result does not match ResultClass. Retrying will not help
+                        self._log_error(payload, content, e)
+                        raise
+                    end_time = time.perf_counter()
+                    metrics.record(method, "network", recv_time - send_time)
+                    if server_timing is not None:
+                        for phase, seconds in server_timing.items():
+                            metrics.record(method, phase, seconds)
+                        metrics.record(
+                            method,
+                            "transport",
+                            max(
+                                0.0,
+                                recv_time - send_time - sum(server_timing.values()),
+                            ),
+                        )
+                    metrics.record(method, "parse", parse_time - recv_time)
+                    metrics.record(method, "decode", end_time - parse_time)
+                    metrics.record(method, "total", end_time - start_time)
+                    return result
+
+            backoff = retry_state.on_failure(error)
+            if retry_state.attempt == 1 and isinstance(error, ConnectionError):
+                print(f"{type(error).__name__} => retrying {method}")
+            metrics.count(method, "retries")
+            time.sleep(backoff)
+
+    def _log_error(
+        self,
+        payload: Union[Dict[str, Any], List[Dict[str, Any]]],
+        content: Optional[bytes],
+        e: Exception,
+    ) -> None:
+        print("payload", payload)
+        print("content", content)
+        print("e", e)
+        if self.logfile is not None:
+            with open(self.logfile, "a") as f:
+                datetime_str = datetime.datetime.now().strftime("%Y%m%d %H%M%S")
+                f.write(f"{datetime_str}: payload {payload}\n")
+                f.write(f"{datetime_str}: content {str(content)}\n")
+                f.write(f"{datetime_str}: e {e}\n")
+
+
+class ReplayUnityComms(UnityComms):
+    """
+    Replays a recording made with UnityComms.start_recording, without Unity, returning the
+    recorded responses in order, as fast as they can be decoded. Use it to profile, or
+    regression test, everything on the python side of rpc_call, e.g.
+
+    comms = ReplayUnityComms("rollout.rec")
+    my_env = MyUnityEnv(comms=comms)
+    while comms.num_remaining > 0:
+        my_env.step(actions)
+
+    Requests are not checked against the recording, unless strict is True, so the calls must
+    be made in the same order as when recording.
+    """
+
+    def __init__(self, path: str, strict: bool = False, metrics: bool = True) -> None:
+        """
+        :param path: str Recording file
+        :param strict: bool Raise ReplayMismatchError if a request differs from the recording
+        :param metrics: bool See UnityComms
+        """
+        self.replay_transport = ReplayTransport(path, strict=strict)
+        super().__init__(port=0, transport=self.replay_transport, metrics=metrics)
+        self.rewind()
+
+    @property
+    def num_remaining(self) -> int:
+        return self.replay_transport.num_remaining
+
+    def rewind(self) -> None:
+        """
+        Starts again from the first recorded response. Request ids restart from the first
+        recorded id, so that batch responses match up
+        """
+        self.replay_transport.rewind()
+        if len(self.replay_transport.exchanges) > 0:
+            first_req = json.loads(self.replay_transport.exchanges[0][0])
+            if isinstance(first_req, list):
+                first_req = first_req[0]
+            self.jsonrpc_id = first_req["id"]
+
+
+class UnityCommsGroup:
+    """
+    Sends each call to many Unity servers concurrently, so that e.g. initializing or resetting
+    a fleet of servers takes one round-trip of wall time, rather than one per server:
+
+    group = UnityCommsGroup.from_ports(args.ports)
+    group.set_autosimulation(False)
+    group.rlInitAi(accel=1.0, frame_skip=0)
+
+    Calls return a list with one result per server, in the same order as comms. If the call
+    fails on any server, we still wait for the others, then raise UnityCommsGroupError, holding
+    every result and exception. Use rpc_call_each to send different params to each server.
+    """
+
+    def __init__(
+        self, comms: Sequence[UnityComms], max_workers: Optional[int] = None
+    ) -> None:
+        """
+        :param comms: Sequence[UnityComms] One per server
+        :param max_workers: Optional[int] How many calls to have in flight at once. Defaults to one
+            per server
+        """
+        self.comms = list(comms)
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers or max(1, len(self.comms)),
+            thread_name_prefix="UnityCommsGroup",
+        )
+
+    @classmethod
+    def from_ports(
+        cls,
+        ports: Sequence[int],
+        hostname: Union[str, Sequence[str]] = "localhost",
+        **kwargs: Any,
+    ) -> "UnityCommsGroup":
+        """
+        :param ports: Sequence[int] The port of each server
+        :param hostname: Union[str, Sequence[str]] The hostname of every server, or of each server
+        :param kwargs: Passed to each UnityComms, e.g. transport
+        """
+        hostnames = [hostname] * len(ports) if isinstance(hostname, str) else hostname
+        if len(hostnames) != len(ports):
+            raise ValueError(f"Got {len(hostnames)} hostnames for {len(ports)} ports")
+        return cls(
+            [
+                UnityComms(port=port, hostname=hostname, **kwargs)
+                for port, hostname in zip(ports, hostnames)
+            ]
+        )
+
+    def __len__(self) -> int:
+        return len(self.comms)
+
+    def __getattr__(self, method_name: str) -> UnityCommsFn:
+        if method_name.startswith("_"):
+            raise AttributeError()
+        return UnityCommsFn(unity_comms=self, method_name=method_name)
+
+    def __getitem__(self, method_name: str) -> UnityCommsFn:
+        return UnityCommsFn(unity_comms=self, method_name=method_name)
+
+    def rpc_call(
+        self,
+        method: str,
+        params_dict: Optional[Dict[str, Any]] = None,
+        ResultClass: Optional[Type] = None,
+        retry: bool = True,
+        **kwargs: Any,
+    ) -> List[Any]:
+        """
+        Same parameters as UnityComms.rpc_call. Sends the same params to every server.
+
+        :return: List[Any] the result from each server
+        """
+        params_dict = dict(params_dict) if params_dict else {}
+        params_dict.update(kwargs)
+        return self.rpc_call_each(
+            method,
+            [params_dict] * len(self.comms),
+            ResultClass=ResultClass,
+            retry=retry,
+        )
+
+    def rpc_call_each(
+        self,
+        method: str,
+        params_dicts: Sequence[Optional[Dict[str, Any]]],
+        ResultClass: Optional[Type] = None,
+        retry: bool = True,
+    ) -> List[Any]:
+        """
+        Calls method on every server concurrently, with params_dicts[i] as the params for server i,
+        e.g. to send each server its own actions
+
+        :return: List[Any] the result from each server
+        """
+        if len(params_dicts) != len(self.comms):
+            raise ValueError(
+                f"Got {len(params_dicts)} params dicts for {len(self.comms)} servers"
+            )
+        futures = [
+            self._executor.submit(
+                comms.rpc_call,
+                method=method,
+                params_dict=dict(params_dict) if params_dict else {},
+                ResultClass=ResultClass,
+                retry=retry,
+            )
+            for comms, params_dict in zip(self.comms, params_dicts)
+        ]
+        return self._gather(method, futures)
+
+    def rpc_batch(self, calls: List[RpcCall], retry: bool = True) -> List[List[Any]]:
+        """
+        Sends the same batch to every server concurrently. See UnityComms.rpc_batch
+
+        :return: List[List[Any]] the results of the batch, from each server
+        """
+        futures = [
+            self._executor.submit(comms.rpc_batch, calls, retry=retry)
+            for comms in self.comms
+        ]
+        return self._gather("batch", futures)
+
+    def _gather(self, method: str, futures: List[Future]) -> List[Any]:
+        errors: List[Optional[BaseException]] = [
+            future.exception() for future in futures
+        ]
+        results = [
+            future.result() if error is None else None
+            for future, error in zip(futures, errors)
+        ]
+        failed = [
+            f"{comms.hostname}:{comms.port}: {type(error).__name__}: {error}"
+            for comms, error in zip(self.comms, errors)
+            if error is not None
+        ]
+        if len(failed) > 0:
+            raise UnityCommsGroupError(
+                f"{method} failed on {len(failed)} of {len(self.comms)} servers:\n"
+                + "\n".join(failed),
+                errors=errors,
+                results=results,
+            )
+        return results
+
+    @contextmanager
+    def blocking_listen(self) -> Generator:
+        """
+        See UnityComms.blocking_listen
+        """
+        self.rpc_call("setBlockingListen", {"blocking": True})
+        try:
+            yield None
+        finally:
+            self.rpc_call("setBlockingListen", {"blocking": False}, retry=False)
+
+    def set_autosimulation(self, auto_simulation: bool) -> None:
+        """
+        See UnityComms.set_autosimulation
+        """
+        self.rpc_call("setAutosimulation", {"autosimulation": auto_simulation})
+
+    def get_autosimulation(self) -> List[bool]:
+        return self.rpc_call("getAutosimulation")
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=True)
+        for comms in self.comms:
+            comms.transport.close()
+
+    def __enter__(self) -> "UnityCommsGroup":
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
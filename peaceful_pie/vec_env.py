@@ -0,0 +1,284 @@
+from abc import abstractmethod
+from concurrent.futures import Future
+from copy import deepcopy
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Type
+
+import gym
+import numpy as np
+from stable_baselines3.common.vec_env import DummyVecEnv
+from stable_baselines3.common.vec_env.base_vec_env import (
+    VecEnv,
+    VecEnvIndices,
+    VecEnvObs,
+    VecEnvStepReturn,
+)
+
+from peaceful_pie import dataclass_codec
+from peaceful_pie.shared_memory_env_pool import SharedMemoryEnvPool
+from peaceful_pie.unity_comms import UnityComms
+
+
+class SharedMemoryVecEnv(VecEnv):
+    """
+    Drop-in replacement for stable baselines 3's SubprocVecEnv, e.g.
+
+    my_env = SharedMemoryVecEnv(env_fns=env_factories)
+
+    Workers write observations, rewards and dones into shared memory, and the learner reads them
+    as numpy views, rather than having them pickled through a pipe on every step. Observations
+    returned by reset and step_wait stay valid for one further step, which is what
+    stable baselines 3's on-policy and off-policy algorithms need. Copy them if you need them for
+    longer. See SharedMemoryEnvPool.
+    """
+
+    def __init__(
+        self,
+        env_fns: Sequence[Callable[[], Any]],
+        start_method: Optional[str] = None,
+        num_slots: int = 2,
+    ) -> None:
+        """
+        :param env_fns: Sequence[Callable[[], Any]] Functions that each create one gym-style env.
+            See SharedMemoryEnvPool
+        :param start_method: Optional[str] multiprocessing start method. Defaults to the platform
+            default.
+        :param num_slots: int Number of steps of observations to keep in shared memory. At least 2.
+        """
+        if num_slots < 2:
+            raise ValueError("num_slots should be at least 2")
+        self.pool = SharedMemoryEnvPool(
+            env_fns, num_slots=num_slots, start_method=start_method
+        )
+        VecEnv.__init__(
+            self,
+            num_envs=self.pool.num_envs,
+            observation_space=self.pool.observation_space,
+            action_space=self.pool.action_space,
+        )
+
+    def reset(self) -> VecEnvObs:
+        return self.pool.reset()
+
+    def step_async(self, actions: np.ndarray) -> None:
+        self.pool.step_async(actions)
+
+    def step_wait(self) -> VecEnvStepReturn:
+        obs, rewards, dones, infos = self.pool.step_wait()
+        return obs, rewards, dones, infos
+
+    def close(self) -> None:
+        self.pool.close()
+
+    def seed(self, seed: Optional[int] = None) -> List[Optional[int]]:
+        if seed is None:
+            return self.pool.call("seed", None)
+        return [
+            self.pool.call("seed", seed + idx, [idx])[0] for idx in range(self.num_envs)
+        ]
+
+    def get_attr(self, attr_name: str, indices: VecEnvIndices = None) -> List[Any]:
+        return self.pool.call("get_attr", attr_name, list(self._get_indices(indices)))
+
+    def set_attr(
+        self, attr_name: str, value: Any, indices: VecEnvIndices = None
+    ) -> None:
+        self.pool.call("set_attr", (attr_name, value), list(self._get_indices(indices)))
+
+    def env_method(
+        self,
+        method_name: str,
+        *method_args: Any,
+        indices: VecEnvIndices = None,
+        **method_kwargs: Any,
+    ) -> List[Any]:
+        return self.pool.call(
+            "env_method",
+            (method_name, method_args, method_kwargs),
+            list(self._get_indices(indices)),
+        )
+
+    def env_is_wrapped(
+        self, wrapper_class: Type[gym.Wrapper], indices: VecEnvIndices = None
+    ) -> List[bool]:
+        return self.pool.call(
+            "is_wrapped", wrapper_class, list(self._get_indices(indices))
+        )
+
+
+class PipelinedVecEnv(DummyVecEnv):
+    """
+    Like stable baselines 3's DummyVecEnv, running all envs in the learner process, but for envs
+    which provide step_async and step_wait, such as MyUnityEnv in the DungeonEscape example, e.g.
+    using UnityComms.rpc_call_async. Every env is sent its actions before we wait for any
+    result, so each Unity process simulates at the same time, without one python process per
+    env.
+    """
+
+    def step_async(self, actions: np.ndarray) -> None:
+        for env, action in zip(self.envs, actions):
+            env.step_async(action)  # type: ignore
+
+    def step_wait(self) -> VecEnvStepReturn:
+        for env_idx, env in enumerate(self.envs):
+            (
+                obs,
+                self.buf_rews[env_idx],
+                self.buf_dones[env_idx],
+                self.buf_infos[env_idx],
+            ) = env.step_wait()  # type: ignore
+            if self.buf_dones[env_idx]:
+                # save final observation where user can get it, then reset. Copy it, since
+                # envs such as MyUnityEnv overwrite the same observation buffer on reset
+                self.buf_infos[env_idx]["terminal_observation"] = np.array(obs)
+                obs = env.reset()
+            self._save_obs(env_idx, obs)
+        return (
+            self._obs_from_buf(),
+            np.copy(self.buf_rews),
+            np.copy(self.buf_dones),
+            deepcopy(self.buf_infos),
+        )
+
+
+class MultiArenaVecEnv(VecEnv):
+    """
+    VecEnv over the K arenas of a single Unity process, served by a MultiArenaRLService on the
+    C# side. Each step sends the actions for all K arenas in one rlStepBatch call, and gets back
+    all K results in one response. Arenas which finish their episode are reset together, in one
+    resetArenas call.
+
+    Derive from this, and implement arena_actions, to convert one env's actions into what the
+    C# side expects, and decode_result, to convert one arena's result into an observation,
+    reward, done and info.
+    """
+
+    def __init__(
+        self,
+        comms: UnityComms,
+        ResultClass: Type,
+        action_space: gym.spaces.Space,
+        obs_low: float = -np.inf,
+        obs_high: float = np.inf,
+    ) -> None:
+        """
+        :param comms: UnityComms Connection to the Unity process holding the arenas
+        :param ResultClass: Type Dataclass to convert each arena's result into
+        :param action_space: gym.spaces.Space Action space of each arena
+        :param obs_low: float Lower bound of the observation space. The shape and dtype of the
+            observation space are taken from the first observations.
+        :param obs_high: float Upper bound of the observation space
+
+        The arenas are reset here, to find the observation shape, so subclasses should set up
+        anything decode_result needs before calling this.
+        """
+        self.comms = comms
+        self._decode = dataclass_codec.get_decoder(ResultClass)
+        self._step_future: Optional[Future] = None
+        num_arenas = comms.getNumArenas()
+        first_obs = self._reset_arenas(list(range(num_arenas)))
+        observation_space = gym.spaces.Box(
+            low=obs_low,
+            high=obs_high,
+            shape=first_obs[0].shape,
+            dtype=first_obs[0].dtype.type,
+        )
+        VecEnv.__init__(
+            self,
+            num_envs=num_arenas,
+            observation_space=observation_space,
+            action_space=action_space,
+        )
+        self.buf_obs = np.stack(first_obs)
+        self.buf_rews = np.zeros((num_arenas,), dtype=np.float32)
+        self.buf_dones = np.zeros((num_arenas,), dtype=bool)
+
+    @abstractmethod
+    def arena_actions(self, actions: np.ndarray) -> Any:
+        """
+        Converts the actions for one arena into the json-serializable value that its
+        IRLArena.Step expects
+        """
+
+    @abstractmethod
+    def decode_result(
+        self, arena_idx: int, result: Any
+    ) -> Tuple[np.ndarray, float, bool, Dict[str, Any]]:
+        """
+        Converts one arena's result, an instance of ResultClass, into an observation, reward,
+        done and info. The observation is copied, so may be a buffer reused on each call.
+        """
+
+    def _reset_arenas(self, arena_indices: List[int]) -> List[np.ndarray]:
+        results = self.comms.resetArenas(arenaIndices=arena_indices)
+        return [
+            np.array(self.decode_result(arena_idx, self._decode(result))[0])
+            for arena_idx, result in zip(arena_indices, results)
+        ]
+
+    def reset(self) -> VecEnvObs:
+        self.buf_obs[:] = self._reset_arenas(list(range(self.num_envs)))
+        return self.buf_obs.copy()
+
+    def step_async(self, actions: np.ndarray) -> None:
+        self._step_future = self.comms.rpc_call_async(
+            "rlStepBatch", actions=[self.arena_actions(action) for action in actions]
+        )
+
+    def step_wait(self) -> VecEnvStepReturn:
+        assert self._step_future is not None, "step_async must be called first"
+        step_future, self._step_future = self._step_future, None
+        results = step_future.result()
+        if len(results) != self.num_envs:
+            raise ValueError(f"Expected {self.num_envs} results, got {len(results)}")
+        infos = []
+        for arena_idx, result in enumerate(results):
+            obs, reward, done, info = self.decode_result(
+                arena_idx, self._decode(result)
+            )
+            self.buf_obs[arena_idx] = obs
+            self.buf_rews[arena_idx] = reward
+            self.buf_dones[arena_idx] = done
+            infos.append(info)
+        done_indices = np.flatnonzero(self.buf_dones).tolist()
+        if len(done_indices) > 0:
+            for arena_idx in done_indices:
+                # save final observation where user can get it, then reset
+                infos[arena_idx]["terminal_observation"] = self.buf_obs[
+                    arena_idx
+                ].copy()
+            self.buf_obs[done_indices] = self._reset_arenas(done_indices)
+        return self.buf_obs.copy(), self.buf_rews.copy(), self.buf_dones.copy(), infos
+
+    def close(self) -> None:
+        if self._step_future is not None:
+            self._step_future.result()
+            self._step_future = None
+
+    def seed(self, seed: Optional[int] = None) -> List[Optional[int]]:
+        # arenas are seeded on the Unity side
+        return [None] * self.num_envs
+
+    def get_attr(self, attr_name: str, indices: VecEnvIndices = None) -> List[Any]:
+        return [getattr(self, attr_name) for _ in self._get_indices(indices)]
+
+    def set_attr(
+        self, attr_name: str, value: Any, indices: VecEnvIndices = None
+    ) -> None:
+        setattr(self, attr_name, value)
+
+    def env_method(
+        self,
+        method_name: str,
+        *method_args: Any,
+        indices: VecEnvIndices = None,
+        **method_kwargs: Any,
+    ) -> List[Any]:
+        method = getattr(self, method_name)
+        return [
+            method(*method_args, **method_kwargs) for _ in self._get_indices(indices)
+        ]
+
+    def env_is_wrapped(
+        self, wrapper_class: Type[gym.Wrapper], indices: VecEnvIndices = None
+    ) -> List[bool]:
+        return [False for _ in self._get_indices(indices)]
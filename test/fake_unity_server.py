@@ -0,0 +1,61 @@
+# Stands in for a dedicated Unity server executable, for testing UnityServerPool
+import argparse
+import os
+import signal
+import sys
+import threading
+import time
+from os import path
+from typing import Any, Dict
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+from peaceful_pie.testing import StandInServer  # noqa: E402
+
+
+def run(args: argparse.Namespace) -> None:
+    time.sleep(args.startup_delay)
+    hang = threading.Event()
+
+    def get_autosimulation() -> bool:
+        if hang.is_set():
+            time.sleep(3600)
+        return False
+
+    def crash() -> None:
+        os.kill(os.getpid(), signal.SIGKILL)
+
+    state: Dict[str, Any] = {"num_resets": 0, "init_params": None, "fail_reset": False}
+
+    def reset() -> None:
+        if state["fail_reset"]:
+            raise Exception("reset failed")
+        state["num_resets"] += 1
+
+    def fail_reset() -> None:
+        state["fail_reset"] = True
+
+    def rl_init_ai(**params: Any) -> None:
+        state["init_params"] = params
+
+    methods = {
+        "getAutosimulation": get_autosimulation,
+        "getPid": os.getpid,
+        "crash": crash,
+        "hang": hang.set,
+        "reset": reset,
+        "failReset": fail_reset,
+        "rlInitAi": rl_init_ai,
+        "getState": lambda: state,
+    }
+    server = StandInServer(methods=methods, port=args.port, transport=args.transport)
+    server.socket_server.serve_forever(poll_interval=0.05)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, required=True)
+    parser.add_argument("--transport", type=str, default="http")
+    parser.add_argument("--startup-delay", type=float, default=0.0)
+    args = parser.parse_args()
+    run(args)
@@ -0,0 +1,221 @@
+import asyncio
+import http.server
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Generator, List, Optional, Tuple
+
+import pytest
+
+from peaceful_pie.async_unity_comms import AsyncUnityComms
+from peaceful_pie.retry import RetriesExhaustedError, RetryPolicy, RpcTimeoutError
+from peaceful_pie.testing import StandInServer
+from peaceful_pie.transports import FatalTransportError, ResponseLostError
+from peaceful_pie.unity_comms import CSException, RpcCall
+
+
+@dataclass
+class Pos:
+    x: float
+    y: float
+
+
+def _fast_policy(**kwargs: Any) -> RetryPolicy:
+    return RetryPolicy(initial_backoff=0.01, max_backoff=0.02, **kwargs)
+
+
+def _raise_error(message: str) -> None:
+    raise ValueError(message)
+
+
+def _make_server(server_idx: int) -> StandInServer:
+    return StandInServer(
+        methods={
+            "getIdx": lambda: server_idx,
+            "getPos": lambda: {"x": server_idx, "y": 0.5},
+            "raiseError": _raise_error,
+        }
+    )
+
+
+def test_rpc_call() -> None:
+    async def run(port: int) -> None:
+        comms = AsyncUnityComms(port=port)
+        assert await comms.getIdx() == 3
+        assert await comms["getPos"](ResultClass=Pos) == Pos(x=3, y=0.5)
+        with pytest.raises(CSException, match="some message"):
+            await comms.raiseError(message="some message")
+        results = await comms.rpc_batch(
+            [RpcCall("getIdx"), RpcCall("getPos", ResultClass=Pos)]
+        )
+        assert results == [3, Pos(x=3, y=0.5)]
+        await comms.close()
+
+    with _make_server(3) as server:
+        asyncio.run(run(server.port))
+
+
+def test_many_servers() -> None:
+    async def run(ports: List[int]) -> List[int]:
+        comms_l = [AsyncUnityComms(port=port) for port in ports]
+        results = await asyncio.gather(*[comms.getIdx() for comms in comms_l])
+        for comms in comms_l:
+            await comms.close()
+        return results
+
+    servers = [_make_server(i).start() for i in range(5)]
+    try:
+        results = asyncio.run(run([server.port for server in servers]))
+    finally:
+        for server in servers:
+            server.stop()
+    assert results == list(range(5))
+
+
+def test_no_retry_when_no_server() -> None:
+    with _make_server(0) as server:
+        port = server.port
+    comms = AsyncUnityComms(port=port)
+    assert asyncio.run(comms.getIdx(retry=False)) is None
+
+
+def test_reuse_across_event_loops() -> None:
+    with _make_server(2) as server:
+        comms = AsyncUnityComms(port=server.port)
+        # the second asyncio.run has a new event loop, so needs a new lock and connection
+        assert asyncio.run(comms.getIdx()) == 2
+        assert asyncio.run(comms.getIdx()) == 2
+
+
+def test_deadline() -> None:
+    with _make_server(0) as server:
+        port = server.port
+    comms = AsyncUnityComms(port=port, retry_policy=_fast_policy(deadline=0.3))
+    start = time.perf_counter()
+    with pytest.raises(RetriesExhaustedError):
+        asyncio.run(comms.getIdx())
+    assert 0.2 < time.perf_counter() - start < 1.0
+
+
+@pytest.fixture
+def hung_server() -> Generator[StandInServer, None, None]:
+    hang = threading.Event()
+    methods: Dict[str, Any] = {
+        "rlStep": lambda actions: hang.wait(2),
+        "getPos": lambda: hang.wait(2),
+    }
+    with StandInServer(methods=methods) as server:
+        yield server
+        hang.set()
+
+
+def test_timeout_non_idempotent(hung_server: StandInServer) -> None:
+    comms = AsyncUnityComms(
+        port=hung_server.port, retry_policy=RetryPolicy(timeout=0.1)
+    )
+    start = time.perf_counter()
+    with pytest.raises(RpcTimeoutError):
+        asyncio.run(comms.rlStep(actions=["nop"]))
+    assert time.perf_counter() - start < 0.5
+    assert hung_server.num_round_trips == 1
+
+
+def test_timeout_idempotent_retries_until_deadline(hung_server: StandInServer) -> None:
+    comms = AsyncUnityComms(
+        port=hung_server.port, retry_policy=_fast_policy(timeout=0.1, deadline=0.5)
+    )
+    with pytest.raises(RpcTimeoutError):
+        asyncio.run(comms.getPos())
+    assert hung_server.num_round_trips >= 2
+
+
+def test_deadline_without_timeout(hung_server: StandInServer) -> None:
+    comms = AsyncUnityComms(
+        port=hung_server.port, retry_policy=_fast_policy(deadline=0.5)
+    )
+    # each attempt only waits for the time left before the deadline
+    start = time.perf_counter()
+    with pytest.raises(RpcTimeoutError):
+        asyncio.run(comms.getPos())
+    assert time.perf_counter() - start < 1.0
+    start = time.perf_counter()
+    with pytest.raises(RpcTimeoutError):
+        asyncio.run(comms.rlStep(actions=["nop"]))
+    assert time.perf_counter() - start < 1.0
+
+
+def test_empty_responses_back_off() -> None:
+    with StandInServer(
+        methods={"getPos": lambda: {}}, empty_response_every=1
+    ) as server:
+        comms = AsyncUnityComms(
+            port=server.port, retry_policy=_fast_policy(max_attempts=3)
+        )
+        with pytest.raises(RetriesExhaustedError, match="empty response"):
+            asyncio.run(comms.getPos())
+        assert server.num_round_trips == 3
+
+
+class BadServer(http.server.HTTPServer):
+    """
+    Replies to every request with reply, a (status, body) tuple, or, if reply is None, closes
+    the connection without replying, as if Unity crashed
+    """
+
+    reply: Optional[Tuple[int, bytes]] = (200, b"")
+    num_requests = 0
+
+
+class BadHandler(http.server.BaseHTTPRequestHandler):
+    server: BadServer
+
+    def do_POST(self) -> None:
+        self.rfile.read(int(self.headers["Content-Length"]))
+        self.server.num_requests += 1
+        if self.server.reply is None:
+            self.close_connection = True
+            return
+        status, body = self.server.reply
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args: object) -> None:
+        pass
+
+
+@pytest.fixture
+def bad_server() -> Generator[BadServer, None, None]:
+    server = BadServer(("localhost", 0), BadHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def test_malformed_reply_raises(bad_server: BadServer) -> None:
+    bad_server.reply = (200, b"{not json")
+    comms = AsyncUnityComms(port=bad_server.server_address[1])
+    with pytest.raises(ValueError):
+        asyncio.run(asyncio.wait_for(comms.getIdx(), timeout=5))
+
+
+def test_http_error_status_raises(bad_server: BadServer) -> None:
+    bad_server.reply = (500, b"Internal Server Error")
+    comms = AsyncUnityComms(port=bad_server.server_address[1])
+    with pytest.raises(FatalTransportError, match="HTTP 500"):
+        asyncio.run(asyncio.wait_for(comms.getIdx(), timeout=5))
+
+
+def test_response_lost(bad_server: BadServer) -> None:
+    bad_server.reply = None
+    comms = AsyncUnityComms(
+        port=bad_server.server_address[1], retry_policy=_fast_policy(max_attempts=3)
+    )
+    with pytest.raises(ResponseLostError):
+        asyncio.run(comms.rlStep(actions=["nop"]))
+    assert bad_server.num_requests == 1
+    with pytest.raises(RetriesExhaustedError):
+        asyncio.run(comms.getIdx())
+    assert bad_server.num_requests == 4
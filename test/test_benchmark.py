@@ -0,0 +1,65 @@
+import time
+
+import pytest
+
+from peaceful_pie.benchmark import CLIENT_MODES, run_clients, stress
+from peaceful_pie.server_pool import find_free_ports
+from peaceful_pie.testing import StandInServer, StandInServerProcess, rl_methods
+from peaceful_pie.unity_comms import UnityComms
+
+
+def _requests_per_sec(max_requests_per_tick: int) -> float:
+    with StandInServer(
+        methods={"getAutosimulation": lambda: True},
+        fixed_delta_time=0.02,
+        max_requests_per_tick=max_requests_per_tick,
+    ) as server:
+        requests_per_sec, latencies = stress(server.port, num_clients=4, duration=0.5)
+        assert len(latencies) > 0
+        return requests_per_sec
+
+
+def test_one_request_per_tick_caps_throughput() -> None:
+    # at most one request per 20ms tick
+    assert _requests_per_sec(1) <= 55
+
+
+def test_draining_lifts_throughput() -> None:
+    assert _requests_per_sec(4) > 100
+    assert _requests_per_sec(0) > 100
+
+
+def test_tick_budget() -> None:
+    with StandInServer(
+        methods={"slow": lambda: time.sleep(0.01)},
+        fixed_delta_time=0.02,
+        max_requests_per_tick=0,
+        tick_budget=0.005,
+    ) as server:
+        # each request overruns the budget, so only one is processed per tick
+        requests_per_sec, _ = stress(
+            server.port, num_clients=4, duration=0.5, method="slow"
+        )
+    assert requests_per_sec <= 55
+
+
+@pytest.mark.parametrize("mode", CLIENT_MODES)
+def test_run_clients(mode: str) -> None:
+    with StandInServer(methods=rl_methods(ray_resolution=3)) as server:
+        calls_per_sec, latencies = run_clients(
+            mode, server.port, num_calls=40, num_clients=2, batch_size=4
+        )
+        assert calls_per_sec > 0
+        assert len(latencies) == (10 if mode == "batch" else 40)
+        assert server.num_rpc_requests == 40
+
+
+def test_stand_in_server_process() -> None:
+    port = find_free_ports(1)[0]
+    with StandInServerProcess(port, "tcp", extra_args=["--ray-resolution", "2"]):
+        comms = UnityComms(port=port, transport="tcp")
+        rl_result = comms.rlStep(actions=["nop"])
+        assert len(rl_result["playerObservations"]) == 3
+        rays = rl_result["playerObservations"][0]["rayResults"]
+        assert len(rays["rayDistances"]) == 2
+        comms.transport.close()
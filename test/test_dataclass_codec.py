@@ -0,0 +1,128 @@
+import datetime
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+import chili
+import numpy as np
+from numpy.typing import NDArray
+
+from peaceful_pie import dataclass_codec, ndarray_codec, ray_results_helper
+
+
+@dataclass
+class PlayerObservation:
+    IAmAlive: bool
+    IHaveAKey: bool
+    rayResults: ray_results_helper.RayResults
+
+
+@dataclass
+class RLResult:
+    reward: float
+    episodeFinished: bool
+    playerObservations: List[PlayerObservation]
+
+
+@dataclass
+class Misc:
+    name: str
+    when: datetime.date
+    scores: Dict[str, List[int]]
+    distances: NDArray[np.float32]
+    parent: Optional["Misc"] = None
+    tags: List[str] = field(default_factory=list)
+    count: int = 3
+
+
+RL_RESULT_D = {
+    "reward": 0.5,
+    "episodeFinished": False,
+    "playerObservations": [
+        {
+            "IAmAlive": True,
+            "IHaveAKey": i == 1,
+            "rayResults": {
+                "rayDistances": [[0.5, -1], [2, 4]],
+                "rayHitObjectTypes": [[0, -1], [1, 1]],
+                "NumObjectTypes": 2,
+            },
+        }
+        for i in range(3)
+    ],
+}
+
+
+def test_decode_matches_chili() -> None:
+    decoder = dataclass_codec.get_decoder(RLResult)
+    actual = decoder(RL_RESULT_D)
+    assert actual == chili.init_dataclass(RL_RESULT_D, RLResult)
+    assert isinstance(actual.playerObservations[0].rayResults.rayDistances[1][0], float)
+    assert dataclass_codec.get_decoder(RLResult) is decoder
+
+
+def test_encode_matches_chili() -> None:
+    rl_result = chili.init_dataclass(RL_RESULT_D, RLResult)
+    encoder = dataclass_codec.get_encoder(RLResult)
+    assert encoder(rl_result) == chili.asdict(rl_result)
+
+
+def test_decode_encode_misc() -> None:
+    ndarray_codec.register_chili_strategies()
+    misc_d = {
+        "name": "child",
+        "when": "2023-01-02",
+        "scores": {"a": [1, 2]},
+        "distances": [0.5, 2],
+        "parent": {
+            "name": "parent",
+            "when": "2022-12-31",
+            "scores": {},
+            "distances": ndarray_codec.encode_ndarray(np.array([1], dtype=np.float32)),
+        },
+    }
+    misc = dataclass_codec.get_decoder(Misc)(misc_d)
+    assert misc.when == datetime.date(2023, 1, 2)
+    assert misc.scores == {"a": [1, 2]}
+    assert misc.distances.dtype == np.float32
+    assert misc.tags == [] and misc.count == 3
+    assert misc.parent is not None
+    assert misc.parent.name == "parent"
+    assert misc.parent.parent is None
+    assert np.all(misc.parent.distances == [1])
+
+    encoded = dataclass_codec.get_encoder(Misc)(misc)
+    assert encoded["when"] == "2023-01-02"
+    assert encoded["parent"]["parent"] is None
+    assert np.all(ndarray_codec.decode_ndarray(encoded["distances"]) == [0.5, 2])
+
+
+@dataclass
+class Hidden:
+    x: int
+    ys: List[int]
+    name: str
+    secret: int = field(repr=False, default=5)
+
+
+def test_encode_round_trip() -> None:
+    encoder = dataclass_codec.get_encoder(Hidden)
+    decoder = dataclass_codec.get_decoder(Hidden)
+    hidden = Hidden(x=2, ys=[1, 2], name="a", secret=9)
+    encoded = encoder(hidden)
+    for key, value in chili.asdict(hidden).items():
+        assert encoded[key] == value
+    # repr=False only affects repr, so the field must still be sent
+    assert encoded["secret"] == 9
+    assert decoder(encoded) == hidden
+
+    # ints holding non-integral values are passed through, not truncated
+    encoded = encoder(Hidden(x=2.7, ys=[1.5], name="b"))  # type: ignore
+    assert encoded == {"x": 2.7, "ys": [1.5], "name": "b", "secret": 5}
+
+
+def test_falls_back_to_chili_for_non_dataclass() -> None:
+    class NotADataclass:
+        pass
+
+    encoder = dataclass_codec.get_encoder(NotADataclass)
+    assert encoder is chili.asdict
@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+
+from peaceful_pie import ray_results_helper
+from peaceful_pie.frame_stack import FrameStack
+
+
+def test_push() -> None:
+    frame_stack = FrameStack(num_frames=3, frame_shape=(2,))
+    stacked = frame_stack.reset(np.array([1, 1]))
+    assert np.all(stacked == [[0, 0], [0, 0], [1, 1]])
+    for t in range(2, 10):
+        stacked = frame_stack.push(np.array([t, t]))
+        expected = [[max(t_, 0)] * 2 for t_ in [t - 2, t - 1, t]]
+        assert np.all(stacked == expected)
+        # a view onto the slab, not a copy
+        assert np.shares_memory(stacked, frame_stack.slab)
+        assert stacked.flags.c_contiguous
+    copied = frame_stack.copy()
+    frame_stack.push(np.array([10, 10]))
+    assert np.all(copied == [[7, 7], [8, 8], [9, 9]])
+    assert np.all(frame_stack.frames == [[8, 8], [9, 9], [10, 10]])
+
+
+def test_reset() -> None:
+    frame_stack = FrameStack(num_frames=3, frame_shape=(2,))
+    for t in range(5):
+        frame_stack.push(np.array([t, t]))
+    assert np.all(frame_stack.reset() == 0)
+    assert np.all(frame_stack.reset(np.array([5, 5])) == [[0, 0], [0, 0], [5, 5]])
+
+    frame_stack = FrameStack(num_frames=3, frame_shape=(2,), pad_with_first=True)
+    frame_stack.push(np.array([1, 1]))
+    assert np.all(frame_stack.reset(np.array([5, 5])) == 5)
+    assert np.all(frame_stack.push(np.array([6, 6])) == [[5, 5], [5, 5], [6, 6]])
+
+
+def test_single_frame() -> None:
+    frame_stack = FrameStack(num_frames=1, frame_shape=(2,))
+    assert np.all(frame_stack.push(np.array([1, 2])) == [[1, 2]])
+    assert np.all(frame_stack.push(np.array([3, 4])) == [[3, 4]])
+    with pytest.raises(ValueError):
+        FrameStack(num_frames=0, frame_shape=(2,))
+
+
+def test_push_ray_results() -> None:
+    rng = np.random.default_rng(123)
+    frame_stack = FrameStack(num_frames=2, frame_shape=(3, 4, 5))
+    encoder = ray_results_helper.RayFeatureEncoder(
+        num_object_types=3, encoding="normalized", ray_length=40
+    )
+    expected = []
+    for _ in range(3):
+        ray_results = ray_results_helper.ArrayRayResults(
+            rayDistances=rng.uniform(0.1, 40, size=(4, 5)).astype(np.float32),
+            rayHitObjectTypes=rng.integers(-1, 3, size=(4, 5)).astype(np.int16),
+            NumObjectTypes=3,
+        )
+        expected.append(
+            ray_results_helper.ray_results_to_feature_np(ray_results, encoder=encoder)
+        )
+        stacked = frame_stack.push_ray_results(ray_results, encoder=encoder)
+    assert np.all(stacked == np.stack(expected[-2:]))
+    stacked = frame_stack.push_ray_results(ray_results)
+    assert np.all(
+        stacked[-1] == ray_results_helper.ray_results_to_feature_np(ray_results)
+    )
@@ -0,0 +1,79 @@
+import random
+from pathlib import Path
+
+import pytest
+
+from peaceful_pie.metrics import CommsMetrics, LatencyHistogram
+
+
+def test_histogram_percentiles() -> None:
+    r = random.Random(123)
+    values = [r.uniform(0.0001, 0.5) for _ in range(10000)]
+    histogram = LatencyHistogram()
+    for value in values:
+        histogram.record(value)
+    values.sort()
+    for percentile in [50, 90, 99]:
+        expected = values[int(len(values) * percentile / 100) - 1]
+        assert histogram.percentile(percentile) == pytest.approx(expected, rel=0.04)
+    assert histogram.percentile(100) == values[-1]
+    assert histogram.mean == pytest.approx(sum(values) / len(values))
+    assert histogram.snapshot()["min"] == values[0]
+
+
+def test_histogram_empty() -> None:
+    snapshot = LatencyHistogram().snapshot()
+    assert snapshot["count"] == 0
+    assert snapshot["p99"] == 0.0
+    assert snapshot["min"] == 0.0
+
+
+def test_histogram_small_and_huge_values() -> None:
+    histogram = LatencyHistogram()
+    histogram.record(0.0)
+    histogram.record(0.000003)
+    histogram.record(1e9)
+    assert histogram.percentile(0) == 0.0
+    assert histogram.percentile(50) == pytest.approx(0.000003)
+    assert histogram.percentile(100) == 1e9
+
+
+def test_comms_metrics() -> None:
+    metrics = CommsMetrics()
+    metrics.count("rlStep", "calls")
+    metrics.count("rlStep", "calls")
+    metrics.count("rlStep", "retries", 3)
+    metrics.record("rlStep", "network", 0.002)
+    snapshot = metrics.snapshot()
+    assert snapshot["rlStep"]["counters"] == {"calls": 2, "retries": 3}
+    assert snapshot["rlStep"]["latencies"]["network"]["p50"] == pytest.approx(
+        0.002, rel=0.04
+    )
+    text = metrics.format()
+    assert "rlStep: calls=2 retries=3" in text
+    assert "network" in text
+    metrics.reset()
+    assert metrics.snapshot() == {}
+
+
+def test_comms_metrics_disabled() -> None:
+    metrics = CommsMetrics(enabled=False)
+    metrics.count("rlStep", "calls")
+    metrics.record("rlStep", "network", 0.002)
+    assert metrics.snapshot() == {}
+
+
+def test_periodic_dump(tmp_path: Path) -> None:
+    logfile = str(tmp_path / "stats.log")
+    metrics = CommsMetrics()
+    metrics.count("rlStep", "calls")
+    metrics.start_periodic_dump(0.01, logfile=logfile)
+    try:
+        for _ in range(100):
+            if (tmp_path / "stats.log").exists():
+                break
+            metrics._dump_stop.wait(0.01)
+    finally:
+        metrics.stop_periodic_dump()
+    with open(logfile) as f:
+        assert "rlStep: calls=1" in f.read()
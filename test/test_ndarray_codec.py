@@ -0,0 +1,72 @@
+import base64
+from dataclasses import dataclass
+
+import numpy as np
+import pytest
+from numpy.typing import NDArray
+
+from peaceful_pie import ndarray_codec, ray_results_helper
+from peaceful_pie.testing import StandInServer
+from peaceful_pie.unity_comms import UnityComms
+
+
+@pytest.mark.parametrize(
+    "array",
+    [
+        np.array([[0.5, -1, 3.25], [2, 4, 8]], dtype=np.float32),
+        np.array([[0, -1], [3, 2]], dtype=np.int16),
+        np.array([1, 2, 3], dtype=">i4"),
+    ],
+)
+def test_encode_decode(array: NDArray) -> None:
+    encoded = ndarray_codec.encode_ndarray(array)
+    assert encoded["shape"] == list(array.shape)
+    decoded = ndarray_codec.decode_ndarray(encoded)
+    assert decoded.dtype == array.dtype.newbyteorder("<")
+    assert np.all(decoded == array)
+
+
+def test_decode_from_cs_format() -> None:
+    # as sent by EncodedArray.FromFloats
+    data = base64.b64encode(np.array([1.5, -1], dtype="<f4").tobytes()).decode()
+    decoded = ndarray_codec.decode_ndarray(
+        {"dtype": "<f4", "shape": [1, 2], "data": data}
+    )
+    assert decoded.shape == (1, 2)
+    assert np.all(decoded == [[1.5, -1]])
+
+
+def test_decode_list() -> None:
+    decoded = ndarray_codec.decode_ndarray([[1, 2]], dtype=np.float32)
+    assert decoded.dtype == np.float32
+    assert np.all(decoded == [[1, 2]])
+
+
+@dataclass
+class PlayerObservation:
+    IAmAlive: bool
+    rayResults: ray_results_helper.EncodedRayResults
+
+
+def test_rpc_call_fills_arrays() -> None:
+    distances = np.array([[0.5, -1], [2, 4]], dtype=np.float32)
+    object_types = np.array([[0, -1], [1, 0]], dtype=np.int16)
+
+    def get_observation() -> dict:
+        return {
+            "IAmAlive": True,
+            "rayResults": {
+                "rayDistances": ndarray_codec.encode_ndarray(distances),
+                "rayHitObjectTypes": ndarray_codec.encode_ndarray(object_types),
+                "NumObjectTypes": 2,
+            },
+        }
+
+    with StandInServer(methods={"getObservation": get_observation}) as server:
+        comms = UnityComms(port=server.port)
+        obs = comms.getObservation(ResultClass=PlayerObservation)
+    assert isinstance(obs.rayResults.rayDistances, np.ndarray)
+    assert obs.rayResults.rayDistances.dtype == np.float32
+    assert obs.rayResults.rayHitObjectTypes.dtype == np.int16
+    assert np.all(obs.rayResults.rayDistances == distances)
+    assert np.all(obs.rayResults.rayHitObjectTypes == object_types)
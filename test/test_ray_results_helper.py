@@ -1,10 +1,13 @@
-from typing import List
+import json
+import math
+from typing import List, Tuple
 
 import numpy as np
 import pytest
 from numpy.typing import NDArray
 
-from peaceful_pie import ray_results_helper
+from peaceful_pie import dataclass_codec, ndarray_codec, ray_results_helper
+from peaceful_pie.testing import RayDeltaEncoder
 
 
 @pytest.mark.parametrize(
@@ -55,3 +58,254 @@ def test_ray_results_to_feature_np(
     print("expected", expected_results, expected_results.shape)
     print("actual", actual, actual.shape)
     assert np.all(actual == expected_results)
+
+
+def test_ray_results_to_feature_np_encoded() -> None:
+    distances = [[0.5, 0.25, 0.5], [0.25, -1, 2]]
+    object_types = [[0, 2, -1], [1, -1, 1]]
+    expected = ray_results_helper.ray_results_to_feature_np(
+        ray_results_helper.RayResults(
+            NumObjectTypes=3, rayDistances=distances, rayHitObjectTypes=object_types
+        )
+    )
+    actual = ray_results_helper.ray_results_to_feature_np(
+        ray_results_helper.EncodedRayResults(
+            NumObjectTypes=3,
+            rayDistances=np.array(distances, dtype=np.float32),
+            rayHitObjectTypes=np.array(object_types, dtype=np.int16),
+        )
+    )
+    assert actual.dtype == np.float32
+    assert np.all(actual == expected)
+
+
+def test_ray_results_to_feature_np_batch() -> None:
+    rng = np.random.default_rng(123)
+    ray_results_list = [
+        ray_results_helper.RayResults(
+            rayDistances=rng.uniform(0.1, 10, size=(4, 3)).tolist(),
+            rayHitObjectTypes=rng.integers(-1, 3, size=(4, 3)).tolist(),
+            NumObjectTypes=3,
+        )
+        for _ in range(5)
+    ]
+    expected = np.stack(
+        [ray_results_helper.ray_results_to_feature_np(rr) for rr in ray_results_list]
+    )
+    actual = ray_results_helper.ray_results_to_feature_np_batch(ray_results_list)
+    assert actual.shape == (5, 3, 4, 3)
+    assert actual.dtype == np.float32
+    assert np.all(actual == expected)
+
+    out = np.full((5, 3, 4, 3), 123, dtype=np.float32)
+    actual = ray_results_helper.ray_results_to_feature_np_batch(
+        ray_results_list, out=out
+    )
+    assert actual is out
+    assert np.all(out == expected)
+
+
+def test_ray_arrays_to_feature_np_batch_bad_out() -> None:
+    with pytest.raises(ValueError):
+        ray_results_helper.ray_arrays_to_feature_np_batch(
+            distances=np.ones((2, 3, 4)),
+            object_types=np.zeros((2, 3, 4), dtype=np.int16),
+            num_object_types=2,
+            out=np.zeros((2, 3, 4, 2), dtype=np.float32),
+        )
+
+
+def test_ray_results_to_feature_np_batch_empty() -> None:
+    with pytest.raises(ValueError):
+        ray_results_helper.ray_results_to_feature_np_batch([])
+
+
+def test_array_ray_results_decoding() -> None:
+    ndarray_codec.register_chili_strategies()
+    distances = [[0.5, 0.25, 0.5], [0.25, -1, 2]]
+    object_types = [[0, 2, -1], [1, -1, 1]]
+    expected = ray_results_helper.ray_results_to_feature_np(
+        ray_results_helper.RayResults(
+            NumObjectTypes=3, rayDistances=distances, rayHitObjectTypes=object_types
+        )
+    )
+    decoder = dataclass_codec.get_decoder(ray_results_helper.ArrayRayResults)
+    for res_d in [
+        # as sent by RayCasts.GetObservation
+        {
+            "rayDistances": distances,
+            "rayHitObjectTypes": object_types,
+            "NumObjectTypes": 3,
+        },
+        # as sent by RayCasts.GetEncodedObservation
+        {
+            "rayDistances": ndarray_codec.encode_ndarray(
+                np.array(distances, dtype=np.float32)
+            ),
+            "rayHitObjectTypes": ndarray_codec.encode_ndarray(
+                np.array(object_types, dtype=np.int16)
+            ),
+            "NumObjectTypes": 3,
+        },
+    ]:
+        ray_results = decoder(res_d)
+        assert isinstance(ray_results, ray_results_helper.ArrayRayResults)
+        assert not hasattr(ray_results, "__dict__")
+        assert ray_results.rayDistances.dtype == np.float32
+        assert ray_results.rayHitObjectTypes.dtype == np.int16
+        assert ray_results.rayDistances.shape == (2, 3)
+        actual = ray_results_helper.ray_results_to_feature_np(ray_results)
+        assert actual.dtype == np.float32
+        assert np.all(actual == expected)
+
+
+def _random_walk(
+    rng: np.random.Generator, num_steps: int, shape: Tuple[int, int]
+) -> List[Tuple[NDArray[np.float32], NDArray[np.int16]]]:
+    distances = rng.uniform(0.1, 40, size=shape).astype(np.float32)
+    object_types = rng.integers(-1, 3, size=shape).astype(np.int16)
+    frames = []
+    for _ in range(num_steps):
+        # a few rays change a lot, the rest barely move
+        distances = distances + rng.normal(0, 0.001, size=shape).astype(np.float32)
+        changed = rng.random(size=shape) < 0.1
+        distances[changed] = rng.uniform(0.1, 40, size=int(changed.sum()))
+        object_types[changed] = rng.integers(-1, 3, size=int(changed.sum()))
+        frames.append((distances.copy(), object_types.copy()))
+    return frames
+
+
+def test_ray_delta_roundtrip() -> None:
+    rng = np.random.default_rng(123)
+    encoder = RayDeltaEncoder(
+        num_object_types=3, keyframe_interval=10, distance_threshold=0.01
+    )
+    decoder = dataclass_codec.get_decoder(ray_results_helper.DeltaRayResults)
+    state = ray_results_helper.RayDeltaState()
+    num_keyframes = 0
+    for distances, object_types in _random_walk(rng, 25, (8, 6)):
+        res_d = json.loads(json.dumps(encoder.encode(distances, object_types)))
+        delta = decoder(res_d)
+        num_keyframes += delta.isKeyframe
+        if not delta.isKeyframe:
+            assert 0 < len(delta.changedIdxs) < 8 * 6
+        ray_results = state.apply(delta)
+        assert ray_results.rayDistances.shape == (8, 6)
+        assert np.all(ray_results.rayHitObjectTypes == object_types)
+        assert np.all(np.abs(ray_results.rayDistances - distances) <= 0.01 + 1e-6)
+    # at steps 0, 10 and 20
+    assert num_keyframes == 3
+
+
+def test_ray_delta_exact() -> None:
+    rng = np.random.default_rng(123)
+    encoder = RayDeltaEncoder(num_object_types=3, distance_threshold=0)
+    decoder = dataclass_codec.get_decoder(ray_results_helper.DeltaRayResults)
+    state = ray_results_helper.RayDeltaState()
+    for distances, object_types in _random_walk(rng, 10, (4, 5)):
+        ray_results = state.apply(decoder(encoder.encode(distances, object_types)))
+        assert np.all(ray_results.rayDistances == distances)
+        assert np.all(ray_results.rayHitObjectTypes == object_types)
+
+
+def test_ray_delta_lost_observation() -> None:
+    rng = np.random.default_rng(123)
+    frames = _random_walk(rng, 4, (4, 5))
+    encoder = RayDeltaEncoder(num_object_types=3)
+    decoder = dataclass_codec.get_decoder(ray_results_helper.DeltaRayResults)
+    state = ray_results_helper.RayDeltaState()
+    state.apply(decoder(encoder.encode(*frames[0])))
+    # lost in transit
+    encoder.encode(*frames[1])
+    with pytest.raises(ray_results_helper.RayDeltaError):
+        state.apply(decoder(encoder.encode(*frames[2])))
+    encoder.reset()
+    ray_results = state.apply(decoder(encoder.encode(*frames[3])))
+    assert np.all(ray_results.rayHitObjectTypes == frames[3][1])
+
+    with pytest.raises(ray_results_helper.RayDeltaError):
+        ray_results_helper.RayDeltaState().apply(decoder(encoder.encode(*frames[3])))
+
+
+def _reference_features(
+    distances: NDArray,
+    object_types: NDArray,
+    encoder: ray_results_helper.RayFeatureEncoder,
+) -> NDArray[np.float32]:
+    """
+    Encodes one ray at a time, for comparison
+    """
+    num_bins = encoder.num_bins
+    ray_length = encoder.ray_length or 0.0
+    features = np.zeros(
+        (distances.shape[0], encoder.num_channels, *distances.shape[1:]),
+        dtype=np.float32,
+    )
+    for b, x, y in np.ndindex(*distances.shape):
+        object_type: int = int(object_types[b, x, y])
+        distance: float = float(distances[b, x, y])
+        if object_type < 0:
+            continue
+        channel, value = object_type, 0.0
+        if encoder.encoding == "inverse":
+            value = 1 / distance
+        elif encoder.encoding == "clipped_inverse":
+            value = min(1 / distance, encoder.max_value)
+        elif encoder.encoding == "log":
+            value = 1 - math.log1p(distance) / math.log1p(ray_length)
+        elif encoder.encoding == "normalized":
+            value = 1 - distance / ray_length
+        else:
+            bin_idx = min(int(distance / ray_length * num_bins), num_bins - 1)
+            channel, value = object_type * num_bins + bin_idx, 1.0
+        features[b, channel, x, y] = value
+    return features
+
+
+@pytest.mark.parametrize("encoding", ray_results_helper.RAY_ENCODINGS)
+def test_ray_feature_encoder(encoding: str) -> None:
+    rng = np.random.default_rng(123)
+    distances = rng.uniform(0.1, 40, size=(2, 4, 3)).astype(np.float32)
+    object_types = rng.integers(-1, 3, size=(2, 4, 3)).astype(np.int16)
+    encoder = ray_results_helper.RayFeatureEncoder(
+        num_object_types=3, encoding=encoding, ray_length=40, num_bins=4
+    )
+    expected = _reference_features(distances, object_types, encoder)
+    actual = encoder.encode(distances, object_types, batch_ndim=1)
+    assert actual.shape == (2, 12 if encoding == "depth_bins" else 3, 4, 3)
+    assert actual.dtype == np.float32
+    assert np.allclose(actual, expected)
+    if encoding != "inverse":
+        assert actual.min() >= 0 and actual.max() <= 1
+
+    # into part of a larger buffer, as ObsBuffer does
+    buf = np.full((2, actual[0].size + 2), 123, dtype=np.float32)
+    out = buf[:, : actual[0].size].reshape(actual.shape)
+    assert not out.flags.c_contiguous
+    encoder.encode(distances, object_types, batch_ndim=1, out=out)
+    assert np.allclose(out, expected)
+    assert np.all(buf[:, actual[0].size :] == 123)
+
+    single = ray_results_helper.ray_results_to_feature_np(
+        ray_results_helper.ArrayRayResults(
+            rayDistances=distances[0],
+            rayHitObjectTypes=object_types[0],
+            NumObjectTypes=3,
+        ),
+        encoder=encoder,
+    )
+    assert np.allclose(single, expected[0])
+
+
+def test_ray_feature_encoder_bad_args() -> None:
+    with pytest.raises(ValueError):
+        ray_results_helper.RayFeatureEncoder(num_object_types=3, encoding="sqrt")
+    with pytest.raises(ValueError):
+        ray_results_helper.RayFeatureEncoder(num_object_types=3, encoding="log")
+
+    encoder = ray_results_helper.RayFeatureEncoder(num_object_types=3)
+    with pytest.raises(ValueError):
+        encoder.encode(np.ones((2, 2)), np.array([[0, 1], [3, -1]]))
+    # empty batches have nothing to check
+    empty = encoder.encode(np.ones((0, 2)), np.ones((0, 2)), batch_ndim=1)
+    assert empty.shape == (0, 3, 2)
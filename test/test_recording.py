@@ -0,0 +1,108 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+import pytest
+
+from peaceful_pie.testing import StandInServer
+from peaceful_pie.transports import (
+    FRAME_HEADER,
+    ReplayExhaustedError,
+    ReplayMismatchError,
+    read_recording,
+)
+from peaceful_pie.unity_comms import ReplayUnityComms, RpcCall, UnityComms
+
+
+@dataclass
+class Pos:
+    x: float
+    y: float
+
+
+def _record(path: str) -> None:
+    methods: Dict[str, Any] = {
+        "add": lambda a, b: a + b,
+        "getPos": lambda: {"x": 1.5, "y": 2.5},
+    }
+    with StandInServer(methods=methods) as server:
+        comms = UnityComms(port=server.port)
+        # calls before recording starts are not recorded
+        comms.add(a=0, b=0)
+        comms.start_recording(path)
+        assert comms.add(a=1, b=2) == 3
+        assert comms.getPos(ResultClass=Pos) == Pos(x=1.5, y=2.5)
+        assert comms.rpc_batch([RpcCall("add", {"a": 3, "b": 4}), RpcCall("getPos")])
+        comms.stop_recording()
+        comms.add(a=0, b=0)
+        comms.transport.close()
+
+
+def _replay(comms: UnityComms) -> None:
+    assert comms.add(a=1, b=2) == 3
+    assert comms.getPos(ResultClass=Pos) == Pos(x=1.5, y=2.5)
+    assert comms.rpc_batch(
+        [RpcCall("add", {"a": 3, "b": 4}), RpcCall("getPos", ResultClass=Pos)]
+    ) == [7, Pos(x=1.5, y=2.5)]
+
+
+def test_record_and_replay(tmp_path: Path) -> None:
+    path = str(tmp_path / "session.rec")
+    _record(path)
+    assert len(read_recording(path)) == 3
+
+    comms = ReplayUnityComms(path, strict=True)
+    _replay(comms)
+    assert comms.num_remaining == 0
+    with pytest.raises(ReplayExhaustedError):
+        comms.add(a=1, b=2)
+    comms.rewind()
+    _replay(comms)
+    assert comms.stats()["add"]["counters"] == {"calls": 3}
+
+
+def test_replay_ignores_requests_unless_strict(tmp_path: Path) -> None:
+    path = str(tmp_path / "session.rec")
+    _record(path)
+    assert ReplayUnityComms(path).add(a=5, b=5) == 3
+    with pytest.raises(ReplayMismatchError):
+        ReplayUnityComms(path, strict=True).add(a=5, b=5)
+
+
+class _SlowList(List[Tuple[bytes, bytes]]):
+    def __getitem__(self, index: Any) -> Any:
+        # widens the window between reading and advancing the replay position
+        time.sleep(0.001)
+        return super().__getitem__(index)
+
+
+def test_replay_from_many_threads(tmp_path: Path) -> None:
+    path = str(tmp_path / "session.rec")
+    with StandInServer(methods={"add": lambda a, b: a + b}) as server:
+        comms = UnityComms(port=server.port)
+        comms.start_recording(path)
+        for i in range(40):
+            comms.add(a=i, b=0)
+        comms.stop_recording()
+        comms.transport.close()
+
+    replay_comms = ReplayUnityComms(path)
+    replay_comms.replay_transport.exchanges = _SlowList(
+        replay_comms.replay_transport.exchanges
+    )
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(lambda _: replay_comms.add(a=0, b=0), range(40)))
+    # each recorded response is returned exactly once
+    assert sorted(results) == list(range(40))
+    assert replay_comms.num_remaining == 0
+
+
+def test_recording_appends_and_ignores_partial_exchange(tmp_path: Path) -> None:
+    path = str(tmp_path / "session.rec")
+    _record(path)
+    _record(path)
+    with open(path, "ab") as f:
+        f.write(FRAME_HEADER.pack(100) + b"{")
+    assert len(read_recording(path)) == 6
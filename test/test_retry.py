@@ -0,0 +1,185 @@
+import socketserver
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, Generator, Tuple
+
+import pytest
+
+from peaceful_pie.retry import RetriesExhaustedError, RetryPolicy, RpcTimeoutError
+from peaceful_pie.testing import StandInServer
+from peaceful_pie.transports import FRAME_HEADER, ResponseLostError
+from peaceful_pie.unity_comms import UnityComms
+
+
+def _fast_policy(**kwargs: Any) -> RetryPolicy:
+    return RetryPolicy(initial_backoff=0.01, max_backoff=0.02, **kwargs)
+
+
+@dataclass
+class Pos:
+    x: float
+    y: float
+
+
+def test_backoff() -> None:
+    policy = RetryPolicy(initial_backoff=0.1, max_backoff=1.0, jitter=0.2)
+    for attempt, expected in [(1, 0.1), (2, 0.2), (3, 0.4), (4, 0.8), (5, 1.0)]:
+        for _ in range(20):
+            assert expected * 0.8 <= policy.backoff(attempt) <= expected * 1.2
+    assert not policy.is_idempotent("rlStep")
+    assert policy.is_idempotent("reset")
+
+
+def test_attempt_timeout() -> None:
+    assert RetryPolicy().attempt_timeout(elapsed=1.0) is None
+    assert RetryPolicy(timeout=2.0).attempt_timeout(elapsed=1.0) == 2.0
+    assert RetryPolicy(deadline=3.0).attempt_timeout(elapsed=1.0) == 2.0
+    assert RetryPolicy(timeout=0.5, deadline=3.0).attempt_timeout(elapsed=1.0) == 0.5
+    assert RetryPolicy(timeout=0.5, deadline=3.0).attempt_timeout(elapsed=2.75) == 0.25
+    assert RetryPolicy(deadline=3.0).attempt_timeout(elapsed=4.0) == 0.001
+
+
+@pytest.mark.parametrize("transport", ["http", "tcp"])
+def test_max_attempts_when_no_server(transport: str) -> None:
+    with StandInServer(methods={}, transport=transport) as server:
+        port = server.port
+    comms = UnityComms(
+        port=port,
+        transport=transport,
+        retry_policy=_fast_policy(max_attempts=3),
+    )
+    with pytest.raises(RetriesExhaustedError):
+        comms.getPos()
+    assert comms.stats()["getPos"]["counters"]["retries"] == 2
+    # connecting failed, so even non-idempotent methods are retried
+    with pytest.raises(RetriesExhaustedError):
+        comms.rlStep(actions=[])
+    assert comms.stats()["rlStep"]["counters"]["retries"] == 2
+
+
+def test_deadline() -> None:
+    with StandInServer(methods={}) as server:
+        port = server.port
+    comms = UnityComms(port=port, retry_policy=_fast_policy(deadline=0.3))
+    start = time.perf_counter()
+    with pytest.raises(RetriesExhaustedError):
+        comms.getPos()
+    assert 0.2 < time.perf_counter() - start < 1.0
+
+
+@pytest.fixture(params=["http", "tcp"])
+def hung_server(
+    request: pytest.FixtureRequest,
+) -> Generator[Tuple[StandInServer, str], None, None]:
+    hang = threading.Event()
+    methods: Dict[str, Any] = {
+        "rlStep": lambda actions: hang.wait(2),
+        "getPos": lambda: hang.wait(2),
+    }
+    with StandInServer(methods=methods, transport=request.param) as server:
+        yield server, request.param
+        hang.set()
+
+
+def test_timeout_non_idempotent(hung_server: Tuple[StandInServer, str]) -> None:
+    server, transport = hung_server
+    comms = UnityComms(
+        port=server.port,
+        transport=transport,
+        retry_policy=RetryPolicy(timeout=0.1),
+    )
+    start = time.perf_counter()
+    with pytest.raises(RpcTimeoutError):
+        comms.rlStep(actions=["nop"])
+    assert time.perf_counter() - start < 0.5
+    assert server.num_round_trips == 1
+
+
+def test_timeout_idempotent_retries_until_deadline(
+    hung_server: Tuple[StandInServer, str]
+) -> None:
+    server, transport = hung_server
+    comms = UnityComms(
+        port=server.port,
+        transport=transport,
+        retry_policy=_fast_policy(timeout=0.1, deadline=0.5),
+    )
+    with pytest.raises(RpcTimeoutError):
+        comms.getPos()
+    assert server.num_round_trips >= 2
+    assert comms.stats()["getPos"]["counters"]["timeouts"] >= 2
+
+
+def test_deadline_without_timeout(hung_server: Tuple[StandInServer, str]) -> None:
+    server, transport = hung_server
+    comms = UnityComms(
+        port=server.port,
+        transport=transport,
+        retry_policy=_fast_policy(deadline=0.5),
+    )
+    # each attempt only waits for the time left before the deadline
+    start = time.perf_counter()
+    with pytest.raises(RpcTimeoutError):
+        comms.getPos()
+    assert time.perf_counter() - start < 1.0
+    start = time.perf_counter()
+    with pytest.raises(RpcTimeoutError):
+        comms.rlStep(actions=["nop"])
+    assert time.perf_counter() - start < 1.0
+
+
+class _HangUpHandler(socketserver.StreamRequestHandler):
+    """
+    Reads one tcp frame, then closes the connection without replying, as if Unity crashed
+    """
+
+    def handle(self) -> None:
+        (length,) = FRAME_HEADER.unpack(self.rfile.read(FRAME_HEADER.size))
+        self.rfile.read(length)
+
+
+@pytest.fixture
+def hang_up_port() -> Generator[int, None, None]:
+    server = socketserver.ThreadingTCPServer(("localhost", 0), _HangUpHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server.server_address[1]
+    server.shutdown()
+    server.server_close()
+
+
+def test_response_lost(hang_up_port: int) -> None:
+    comms = UnityComms(
+        port=hang_up_port,
+        transport="tcp",
+        retry_policy=_fast_policy(max_attempts=3),
+    )
+    with pytest.raises(ResponseLostError):
+        comms.rlStep(actions=["nop"])
+    assert "retries" not in comms.stats()["rlStep"]["counters"]
+    with pytest.raises(RetriesExhaustedError):
+        comms.getPos()
+    assert comms.stats()["getPos"]["counters"]["retries"] == 2
+
+
+def test_empty_responses_back_off() -> None:
+    with StandInServer(
+        methods={"getPos": lambda: {}}, empty_response_every=1
+    ) as server:
+        comms = UnityComms(
+            port=server.port,
+            retry_policy=_fast_policy(max_attempts=3),
+        )
+        with pytest.raises(RetriesExhaustedError, match="empty response"):
+            comms.getPos()
+        assert server.num_round_trips == 3
+
+
+def test_decode_error_is_not_retried() -> None:
+    with StandInServer(methods={"getPos": lambda: {"x": 1.0}}) as server:
+        comms = UnityComms(port=server.port)
+        with pytest.raises(KeyError):
+            comms.getPos(ResultClass=Pos)
+        assert server.num_round_trips == 1
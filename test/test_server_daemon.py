@@ -0,0 +1,87 @@
+import os
+import stat
+import sys
+from os import path
+from typing import Generator
+
+import pytest
+
+from peaceful_pie.server_daemon import ServerDaemon, ServerDaemonError, ServerLease
+from peaceful_pie.unity_comms import RpcCall
+
+pytestmark = pytest.mark.skipif(os.name != "posix", reason="uses a shell script")
+
+
+@pytest.fixture
+def daemon(tmp_path: str) -> Generator[ServerDaemon, None, None]:
+    script_path = path.join(tmp_path, "fake_server.sh")
+    fake_server = path.join(path.dirname(__file__), "fake_unity_server.py")
+    with open(script_path, "w") as f:
+        f.write(f'#!/bin/sh\nexec {sys.executable} {fake_server} "$@"\n')
+    os.chmod(script_path, os.stat(script_path).st_mode | stat.S_IEXEC)
+    daemon = ServerDaemon(
+        script_path,
+        num_servers=2,
+        registry_path=path.join(tmp_path, "registry.json"),
+        init_calls=[RpcCall("rlInitAi", {"accel": 2.0})],
+        health_check_interval=0,
+    )
+    daemon.start()
+    yield daemon
+    daemon.stop()
+
+
+def test_lease_initialized_server(daemon: ServerDaemon) -> None:
+    with ServerLease(daemon.registry_path) as lease:
+        comms = lease.create_comms()
+        assert comms.getState()["init_params"] == {"accel": 2.0}
+        assert daemon.num_free == 1
+
+
+def test_release_resets_server(daemon: ServerDaemon) -> None:
+    lease_1 = ServerLease(daemon.registry_path)
+    lease_2 = ServerLease(daemon.registry_path)
+    assert {lease_1.port, lease_2.port} == set(daemon.pool.ports)
+    assert lease_1.create_comms().getState()["num_resets"] == 0
+    lease_1.release()
+    lease_2.release()
+    assert daemon.num_free == 2
+    with ServerLease(daemon.registry_path) as lease:
+        assert lease.create_comms().getState()["num_resets"] == 1
+
+
+def test_failed_reset_restarts_server(daemon: ServerDaemon) -> None:
+    lease = ServerLease(daemon.registry_path)
+    server_idx = daemon.pool.ports.index(lease.port)
+    comms = lease.create_comms()
+    pid = comms.getPid()
+    comms.rlInitAi(accel=5.0)
+    comms.failReset()
+    lease.release()
+    assert daemon.num_free == 2
+    state = daemon.comms[server_idx].getState()
+    # a fresh server, initialized again by the daemon, rather than left as the client left it
+    assert daemon.comms[server_idx].getPid() != pid
+    assert state["init_params"] == {"accel": 2.0}
+    assert not state["fail_reset"]
+
+
+def test_no_free_server(daemon: ServerDaemon) -> None:
+    with ServerLease(daemon.registry_path), ServerLease(daemon.registry_path):
+        with pytest.raises(ServerDaemonError, match="No server available"):
+            ServerLease(daemon.registry_path, timeout=0.1)
+
+
+def test_disconnected_client_returns_server(daemon: ServerDaemon) -> None:
+    lease = ServerLease(daemon.registry_path)
+    assert daemon.num_free == 1
+    lease.close()
+    with ServerLease(daemon.registry_path, timeout=5), ServerLease(
+        daemon.registry_path, timeout=5
+    ):
+        pass
+
+
+def test_no_daemon(tmp_path: str) -> None:
+    with pytest.raises(ServerDaemonError, match="Is the daemon running"):
+        ServerLease(path.join(tmp_path, "missing.json"))
@@ -0,0 +1,129 @@
+import os
+import stat
+import sys
+import time
+from os import path
+from typing import Callable, Generator
+
+import pytest
+
+from peaceful_pie.server_pool import (
+    ServerStartError,
+    UnityServer,
+    UnityServerPool,
+    find_free_ports,
+    ping,
+)
+
+pytestmark = pytest.mark.skipif(os.name != "posix", reason="uses a shell script")
+
+
+@pytest.fixture
+def fake_server_path(tmp_path: str) -> Callable[..., str]:
+    def make(*extra_args: str) -> str:
+        script_path = path.join(tmp_path, f"fake_server_{len(extra_args)}.sh")
+        fake_server = path.join(path.dirname(__file__), "fake_unity_server.py")
+        with open(script_path, "w") as f:
+            f.write(
+                f'#!/bin/sh\nexec {sys.executable} {fake_server} {" ".join(extra_args)} "$@"\n'
+            )
+        os.chmod(script_path, os.stat(script_path).st_mode | stat.S_IEXEC)
+        return script_path
+
+    return make
+
+
+@pytest.fixture
+def pool(
+    fake_server_path: Callable[..., str]
+) -> Generator[UnityServerPool, None, None]:
+    with UnityServerPool(
+        fake_server_path(),
+        num_servers=2,
+        health_check_interval=0,
+        hang_timeout=0.5,
+        startup_timeout=10,
+    ) as pool:
+        yield pool
+
+
+def test_find_free_ports() -> None:
+    ports = find_free_ports(5)
+    assert len(set(ports)) == 5
+
+
+def test_pool_starts_servers(pool: UnityServerPool) -> None:
+    comms_l = pool.create_comms()
+    pids = [comms.getPid() for comms in comms_l]
+    assert pids == [server.process.pid for server in pool.servers]  # type: ignore
+
+
+def test_pool_restarts_crashed_server(pool: UnityServerPool) -> None:
+    comms_l = pool.create_comms()
+    old_pid = comms_l[0].getPid()
+    comms_l[0].crash(retry=False)
+    pool.servers[0].process.wait()  # type: ignore
+    pool.check_health()
+    assert pool.num_restarts == 1
+    assert comms_l[0].getPid() != old_pid
+    assert pool.servers[1].num_starts == 1
+
+
+def test_pool_restarts_hung_server(pool: UnityServerPool) -> None:
+    comms_l = pool.create_comms()
+    old_pid = comms_l[1].getPid()
+    comms_l[1].hang()
+    pool.check_health()
+    assert pool.num_restarts == 1
+    assert comms_l[1].getPid() != old_pid
+
+
+def test_pool_restarts_hung_servers_in_parallel(
+    fake_server_path: Callable[..., str]
+) -> None:
+    with UnityServerPool(
+        fake_server_path(),
+        num_servers=3,
+        health_check_interval=0,
+        hang_timeout=2.0,
+        startup_timeout=10,
+    ) as pool:
+        for comms in pool.create_comms():
+            comms.hang()
+        start = time.monotonic()
+        pool.check_health()
+        assert pool.num_restarts == 3
+        # one at a time would take over 3 * hang_timeout
+        assert time.monotonic() - start < 5.5
+
+
+def test_monitor_restarts_in_background(fake_server_path: Callable[..., str]) -> None:
+    with UnityServerPool(
+        fake_server_path(), num_servers=1, health_check_interval=0.1, hang_timeout=0.5
+    ) as pool:
+        comms = pool.create_comms()[0]
+        comms.crash(retry=False)
+        # the client retries until the restarted server responds
+        assert comms.getPid() != 0
+        assert pool.servers[0].num_starts == 2
+
+
+def test_stop_kills_servers(fake_server_path: Callable[..., str]) -> None:
+    pool = UnityServerPool(fake_server_path(), num_servers=2, health_check_interval=0)
+    pool.start()
+    processes = [server.process for server in pool.servers]
+    pool.stop()
+    assert all(process.poll() is not None for process in processes)  # type: ignore
+    assert not any(ping("localhost", port) for port in pool.ports)
+
+
+def test_wait_ready_times_out(fake_server_path: Callable[..., str]) -> None:
+    server = UnityServer(
+        fake_server_path("--startup-delay", "5"), port=find_free_ports(1)[0]
+    )
+    server.start()
+    start = time.monotonic()
+    with pytest.raises(ServerStartError, match="not ready"):
+        server.wait_ready(timeout=0.5)
+    assert time.monotonic() - start < 2
+    server.stop()
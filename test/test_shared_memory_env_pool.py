@@ -0,0 +1,96 @@
+from typing import Iterator
+
+import numpy as np
+import pytest
+
+from peaceful_pie.shared_memory_env_pool import SharedMemoryEnvPool
+from peaceful_pie.testing import StandInEnv
+
+pytest.importorskip("gym")
+
+
+class FailingEnv(StandInEnv):
+    def step(self, action):  # type: ignore
+        raise ValueError("step failed")
+
+
+@pytest.fixture
+def pool() -> Iterator[SharedMemoryEnvPool]:
+    env_fns = [
+        lambda: StandInEnv(obs_size=5, episode_length=3),
+        lambda: StandInEnv(obs_size=5, episode_length=2),
+    ]
+    pool = SharedMemoryEnvPool(env_fns, start_method="fork")
+    yield pool
+    pool.close()
+
+
+def test_reset_and_step(pool: SharedMemoryEnvPool) -> None:
+    obs = pool.reset()
+    assert obs.shape == (2, 5)
+    assert obs.dtype == np.float32
+    assert (obs == 0).all()
+
+    pool.step_async(np.array([[1, 2], [3, 0]]))
+    obs, rewards, dones, infos = pool.step_wait()
+    assert (obs == 1).all()
+    assert rewards.tolist() == [1, 1]
+    assert dones.tolist() == [False, False]
+    assert [info["num_steps"] for info in infos] == [1, 1]
+    last_actions = pool.call("get_attr", "last_action")
+    assert [action.tolist() for action in last_actions] == [[1, 2], [3, 0]]
+
+
+def test_previous_obs_stays_valid_for_one_step(pool: SharedMemoryEnvPool) -> None:
+    prev_obs = pool.reset()
+    pool.step_async(np.zeros((2, 2), dtype=np.int64))
+    obs, _, _, _ = pool.step_wait()
+    assert (prev_obs == 0).all()
+    assert (obs == 1).all()
+
+
+def test_auto_reset_keeps_terminal_observation(pool: SharedMemoryEnvPool) -> None:
+    pool.reset()
+    for _ in range(2):
+        pool.step_async(np.zeros((2, 2), dtype=np.int64))
+        obs, _, dones, infos = pool.step_wait()
+    assert dones.tolist() == [False, True]
+    assert "terminal_observation" not in infos[0]
+    assert (infos[1]["terminal_observation"] == 2).all()
+    assert (obs[0] == 2).all()
+    assert (obs[1] == 0).all()
+
+
+def test_env_method_and_set_attr(pool: SharedMemoryEnvPool) -> None:
+    pool.call("set_attr", ("episode_length", 7), [1])
+    assert pool.call("get_attr", "episode_length") == [3, 7]
+    assert pool.call("env_method", ("seed", (5,), {}), [0]) == [[5]]
+
+
+def test_worker_exception_is_raised() -> None:
+    pool = SharedMemoryEnvPool([FailingEnv], start_method="fork")
+    pool.reset()
+    pool.step_async(np.zeros((1, 2), dtype=np.int64))
+    with pytest.raises(RuntimeError, match="step failed"):
+        pool.step_wait()
+    pool.close()
+
+
+@pytest.mark.parametrize("start_method", ["spawn", "forkserver"])
+def test_unpicklable_env_fns(start_method: str) -> None:
+    pytest.importorskip("cloudpickle")
+
+    class EnvFactory:
+        # locally defined, so only cloudpickle can send it to the workers
+        def __call__(self) -> StandInEnv:
+            return StandInEnv(obs_size=3, episode_length=2)
+
+    pool = SharedMemoryEnvPool(
+        [EnvFactory(), lambda: StandInEnv(obs_size=3, episode_length=2)],
+        start_method=start_method,
+    )
+    assert (pool.reset() == 0).all()
+    pool.step_async(np.zeros((2, 2), dtype=np.int64))
+    obs, _, _, _ = pool.step_wait()
+    assert (obs == 1).all()
+    pool.close()
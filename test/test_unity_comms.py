@@ -0,0 +1,422 @@
+import json
+import pickle
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Dict, Generator, List
+
+import pytest
+
+from peaceful_pie.retry import RetryPolicy, RpcTimeoutError
+from peaceful_pie.testing import StandInServer
+from peaceful_pie.transports import (
+    FRAME_HEADER,
+    PipelinedTcpTransport,
+    ResponseLostError,
+    create_transport,
+    recv_exactly,
+)
+from peaceful_pie.unity_comms import (
+    CSException,
+    RpcCall,
+    UnityComms,
+    UnityCommsGroup,
+    UnityCommsGroupError,
+)
+
+
+@dataclass
+class Pos:
+    x: float
+    y: float
+
+
+def _raise_error(message: str) -> None:
+    raise ValueError(message)
+
+
+@pytest.fixture(params=["http", "tcp"])
+def transport(request: pytest.FixtureRequest) -> str:
+    return request.param
+
+
+@pytest.fixture
+def server(transport: str) -> Generator[StandInServer, None, None]:
+    methods: Dict[str, Any] = {
+        "add": lambda a, b: a + b,
+        "getPos": lambda: {"x": 1.5, "y": 2.5},
+        "echo": lambda value: value,
+        "raiseError": _raise_error,
+    }
+    with StandInServer(methods=methods, transport=transport) as server:
+        yield server
+
+
+def test_rpc_call(server: StandInServer, transport: str) -> None:
+    comms = UnityComms(port=server.port, transport=transport)
+    assert comms.add(a=3, b=4) == 7
+    assert comms.getPos(ResultClass=Pos) == Pos(x=1.5, y=2.5)
+    assert comms.echo(value=Pos(x=1, y=2)) == {"x": 1, "y": 2}
+
+
+def test_rpc_call_error(server: StandInServer, transport: str) -> None:
+    comms = UnityComms(port=server.port, transport=transport)
+    with pytest.raises(CSException, match="some message"):
+        comms.raiseError(message="some message")
+
+
+def test_rpc_batch(server: StandInServer, transport: str) -> None:
+    comms = UnityComms(port=server.port, transport=transport)
+    calls: List[RpcCall] = [
+        RpcCall("add", {"a": 1, "b": 2}),
+        RpcCall("getPos", ResultClass=Pos),
+        RpcCall("echo", {"value": Pos(x=3, y=4)}),
+    ]
+    results = comms.rpc_batch(calls)
+    assert results == [3, Pos(x=1.5, y=2.5), {"x": 3, "y": 4}]
+    assert server.num_round_trips == 1
+    assert server.num_rpc_requests == 3
+
+
+def test_batch_context(server: StandInServer, transport: str) -> None:
+    comms = UnityComms(port=server.port, transport=transport)
+    with comms.batch() as batch:
+        sum_future = batch.add(a=5, b=6)
+        pos_future = batch["getPos"](ResultClass=Pos)
+        assert not sum_future.done()
+    assert sum_future.result() == 11
+    assert pos_future.result() == Pos(x=1.5, y=2.5)
+    assert server.num_round_trips == 1
+
+
+def test_batch_error(server: StandInServer, transport: str) -> None:
+    comms = UnityComms(port=server.port, transport=transport)
+    with pytest.raises(CSException, match="bad thing"):
+        with comms.batch() as batch:
+            sum_future = batch.add(a=5, b=6)
+            error_future = batch.raiseError(message="bad thing")
+    # only the call which raised fails
+    assert sum_future.result() == 11
+    with pytest.raises(CSException, match="bad thing"):
+        error_future.result()
+    assert comms.stats()["batch"]["counters"]["errors"] == 1
+
+
+def test_batch_body_raises(server: StandInServer, transport: str) -> None:
+    comms = UnityComms(port=server.port, transport=transport)
+    with pytest.raises(KeyError):
+        with comms.batch() as batch:
+            sum_future = batch.add(a=5, b=6)
+            raise KeyError()
+    assert sum_future.cancelled()
+    assert server.num_round_trips == 0
+
+
+def test_rpc_call_async_overlaps_calls(transport: str) -> None:
+    # each server blocks until both calls have arrived, so this only completes if the second
+    # call is sent whilst the first is still in flight
+    barrier = threading.Barrier(2, timeout=5)
+    methods = {"sim": lambda: barrier.wait() is not None}
+    with StandInServer(methods=methods, transport=transport) as server_a:
+        with StandInServer(methods=methods, transport=transport) as server_b:
+            comms_a = UnityComms(port=server_a.port, transport=transport)
+            comms_b = UnityComms(port=server_b.port, transport=transport)
+            future_a = comms_a.rpc_call_async("sim")
+            future_b = comms_b.rpc_call_async("sim")
+            assert future_a.result() is True
+            assert future_b.result() is True
+
+
+def test_rpc_call_async_error(server: StandInServer, transport: str) -> None:
+    comms = UnityComms(port=server.port, transport=transport)
+    sum_future = comms.rpc_call_async("add", a=1, b=2)
+    error_future = comms.rpc_call_async("raiseError", {"message": "async error"})
+    assert sum_future.result() == 3
+    with pytest.raises(CSException, match="async error"):
+        error_future.result()
+
+
+def test_no_retry_when_no_server(transport: str) -> None:
+    with StandInServer(methods={}, transport=transport) as server:
+        port = server.port
+    comms = UnityComms(port=port, transport=transport)
+    assert comms.getPos(retry=False) is None
+
+
+def test_stats(server: StandInServer, transport: str) -> None:
+    comms = UnityComms(port=server.port, transport=transport)
+    for i in range(3):
+        comms.add(a=i, b=1)
+    comms.rpc_batch([RpcCall("add", {"a": 1, "b": 2}), RpcCall("getPos")])
+    with pytest.raises(CSException):
+        comms.raiseError(message="oops")
+    stats = comms.stats()
+    assert stats["add"]["counters"] == {"calls": 3}
+    assert set(stats["add"]["latencies"]) == {
+        "serialize",
+        "network",
+        "parse",
+        "decode",
+        "total",
+    }
+    total = stats["add"]["latencies"]["total"]
+    assert total["count"] == 3
+    assert 0 < total["p50"] <= total["max"]
+    assert stats["add"]["latencies"]["network"]["p50"] <= total["max"]
+    assert stats["batch"]["counters"] == {"calls": 1}
+    assert stats["raiseError"]["counters"] == {"calls": 1, "errors": 1}
+    assert "add: calls=3" in comms.metrics.format()
+
+
+def test_stats_disabled(server: StandInServer, transport: str) -> None:
+    comms = UnityComms(port=server.port, transport=transport, metrics=False)
+    assert comms.add(a=1, b=2) == 3
+    assert comms.stats() == {}
+
+
+def test_server_timings(transport: str) -> None:
+    def slow_add(a: int, b: int) -> int:
+        time.sleep(0.01)
+        return a + b
+
+    methods: Dict[str, Any] = {"add": slow_add, "getPos": lambda: {"x": 1.5, "y": 2.5}}
+    with StandInServer(methods=methods, transport=transport) as server:
+        comms = UnityComms(port=server.port, transport=transport)
+        assert comms.add(a=1, b=2) == 3
+        assert "server_handler" not in comms.stats()["add"]["latencies"]
+
+        comms.set_echo_timings(True)
+        assert comms.add(a=1, b=2) == 3
+        assert comms.getPos(ResultClass=Pos) == Pos(x=1.5, y=2.5)
+        assert comms.rpc_batch(
+            [RpcCall("add", {"a": 1, "b": 2}), RpcCall("getPos")]
+        ) == [
+            3,
+            {"x": 1.5, "y": 2.5},
+        ]
+        latencies = comms.stats()["add"]["latencies"]
+        assert latencies["server_handler"]["count"] == 1
+        assert latencies["server_handler"]["p50"] >= 0.009
+        assert latencies["server_queue_wait"]["count"] == 1
+        assert latencies["server_encode"]["count"] == 1
+        assert latencies["transport"]["p50"] < latencies["network"]["max"]
+        assert comms.stats()["batch"]["latencies"]["server_handler"]["p50"] >= 0.009
+
+
+def test_server_queue_wait(transport: str) -> None:
+    methods = {"sleep": lambda seconds: time.sleep(seconds)}
+    with StandInServer(
+        methods=methods, transport=transport, echo_timings=True
+    ) as server:
+        comms = [UnityComms(port=server.port, transport=transport) for _ in range(2)]
+        threads = [
+            threading.Thread(target=lambda c=c: c.sleep(seconds=0.05)) for c in comms
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        queue_waits = [
+            c.stats()["sleep"]["latencies"]["server_queue_wait"]["max"] for c in comms
+        ]
+        # one request waited for the other, as on Unity's main thread
+        assert max(queue_waits) >= 0.04
+
+
+def test_empty_responses_are_retried(transport: str) -> None:
+    methods = {"add": lambda a, b: a + b}
+    with StandInServer(
+        methods=methods, transport=transport, empty_response_every=2
+    ) as server:
+        comms = UnityComms(port=server.port, transport=transport)
+        assert [comms.add(a=i, b=1) for i in range(3)] == [1, 2, 3]
+        assert comms.stats()["add"]["counters"]["empty_skips"] == 2
+
+
+def test_shared_between_threads(server: StandInServer, transport: str) -> None:
+    comms = UnityComms(port=server.port, transport=transport)
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        results = list(executor.map(lambda i: comms.add(a=i, b=1), range(200)))
+    assert results == [i + 1 for i in range(200)]
+    assert comms.jsonrpc_id == 200
+    assert comms.stats()["add"]["counters"] == {"calls": 200}
+    comms.transport.close()
+
+
+def test_pipelined_requests_in_flight() -> None:
+    def slow_add(a: int, b: int) -> int:
+        time.sleep(0.1)
+        return a + b
+
+    methods = {"slowAdd": slow_add}
+    with StandInServer(methods=methods, transport="tcp") as server:
+        comms = UnityComms(port=server.port, transport="tcp", pipelined=True)
+        assert isinstance(comms.transport, PipelinedTcpTransport)
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(lambda i: comms.slowAdd(a=i, b=1), range(8)))
+        assert results == [i + 1 for i in range(8)]
+        # all 8 requests were in flight at once, on one connection
+        assert time.perf_counter() - start < 0.5
+        comms.transport.close()
+
+
+def test_pipelined_timeout_then_reconnect() -> None:
+    hang = threading.Event()
+    methods: Dict[str, Any] = {"hang": lambda: hang.wait(2), "add": lambda a, b: a + b}
+    with StandInServer(methods=methods, transport="tcp") as server:
+        comms = UnityComms(
+            port=server.port,
+            transport="tcp",
+            pipelined=True,
+            retry_policy=RetryPolicy(timeout=0.1, max_attempts=1),
+        )
+        with pytest.raises(RpcTimeoutError):
+            comms.hang()
+        hang.set()
+        assert comms.add(a=1, b=2) == 3
+        comms.transport.close()
+
+
+def test_pipelined_unexpected_response_drops_connection() -> None:
+    listener = socket.create_server(("localhost", 0))
+    port = listener.getsockname()[1]
+
+    def serve() -> None:
+        # replies twice to the first request on each connection
+        for num_replies in [2, 1]:
+            conn, _ = listener.accept()
+            with conn:
+                (length,) = FRAME_HEADER.unpack(recv_exactly(conn, FRAME_HEADER.size))
+                body = recv_exactly(conn, length)
+                conn.sendall((FRAME_HEADER.pack(len(body)) + body) * num_replies)
+                # until the client closes the connection
+                conn.recv(1)
+
+    thread = threading.Thread(target=serve, daemon=True)
+    thread.start()
+    transport = PipelinedTcpTransport(hostname="localhost", port=port)
+    assert transport.send(b"first") == b"first"
+    deadline = time.perf_counter() + 2
+    while transport.sock is not None and time.perf_counter() < deadline:
+        time.sleep(0.01)
+    # the reader gave up on the connection, so the next request reconnects, rather than
+    # waiting forever
+    assert transport.sock is None
+    assert transport.send(b"second") == b"second"
+    transport.close()
+    thread.join(timeout=2)
+    listener.close()
+
+
+def test_pipelined_send_failure_is_retryable() -> None:
+    transport = PipelinedTcpTransport(hostname="localhost", port=1)
+    closed_sock, other_sock = socket.socketpair()
+    closed_sock.close()
+    other_sock.close()
+    transport.sock = closed_sock
+    with pytest.raises(ConnectionError) as e:
+        transport.send(b"request")
+    # the request never reached Unity, so may be retried, whatever the method
+    assert not isinstance(e.value, ResponseLostError)
+
+
+@pytest.mark.parametrize("pipelined", [False, True])
+def test_transport_pickle(
+    server: StandInServer, transport: str, pipelined: bool
+) -> None:
+    body = b'{"jsonrpc": "2.0", "method": "add", "params": {"a": 1, "b": 2}, "id": 0}'
+    client = create_transport(
+        transport, hostname="localhost", port=server.port, pipelined=pipelined
+    )
+    assert json.loads(client.send(body))["result"] == 3
+    # e.g. sent to a SubprocVecEnv worker, whilst connected
+    client_copy = pickle.loads(pickle.dumps(client))
+    assert json.loads(client_copy.send(body))["result"] == 3
+    assert json.loads(client.send(body))["result"] == 3
+    client.close()
+    client_copy.close()
+
+
+@pytest.mark.parametrize("pipelined", [False, True])
+def test_unity_comms_pickle(
+    server: StandInServer, transport: str, pipelined: bool
+) -> None:
+    comms = UnityComms(port=server.port, transport=transport, pipelined=pipelined)
+    assert comms.add(a=1, b=2) == 3
+    comms.metrics.start_periodic_dump(interval=60)
+    # as when an env factory holding a UnityComms is sent to a spawned SubprocVecEnv worker
+    comms_copy = pickle.loads(pickle.dumps(comms))
+    comms.metrics.stop_periodic_dump()
+    assert comms_copy.add(a=3, b=4) == 7
+    assert comms_copy.stats()["add"]["counters"]["calls"] == 2
+    assert comms.stats()["add"]["counters"]["calls"] == 1
+    comms_copy.transport.close()
+    comms.transport.close()
+
+
+@pytest.fixture
+def servers(transport: str) -> Generator[List[StandInServer], None, None]:
+    def slow_add(a: int, b: int) -> int:
+        time.sleep(0.1)
+        return a + b
+
+    def make_server() -> StandInServer:
+        state = {"autosimulation": True}
+        methods: Dict[str, Any] = {
+            "add": lambda a, b: a + b,
+            "slowAdd": slow_add,
+            "setAutosimulation": lambda autosimulation: state.update(
+                autosimulation=autosimulation
+            ),
+            "getAutosimulation": lambda: state["autosimulation"],
+        }
+        return StandInServer(methods=methods, transport=transport).start()
+
+    servers = [make_server() for _ in range(4)]
+    yield servers
+    for server in servers:
+        server.stop()
+
+
+def test_group(servers: List[StandInServer], transport: str) -> None:
+    ports = [server.port for server in servers]
+    with UnityCommsGroup.from_ports(ports, transport=transport) as group:
+        assert len(group) == 4
+        assert group.add(a=1, b=2) == [3, 3, 3, 3]
+        assert group["add"](a=2, b=2) == [4, 4, 4, 4]
+        assert group.rpc_call_each("add", [{"a": i, "b": 1} for i in range(4)]) == [
+            1,
+            2,
+            3,
+            4,
+        ]
+        assert group.rpc_batch([RpcCall("add", {"a": 1, "b": 1})]) == [[2]] * 4
+        group.set_autosimulation(False)
+        assert group.get_autosimulation() == [False] * 4
+
+        start = time.perf_counter()
+        assert group.slowAdd(a=1, b=1) == [2, 2, 2, 2]
+        # one round-trip of wall time, not four
+        assert time.perf_counter() - start < 0.3
+
+        with pytest.raises(ValueError):
+            group.rpc_call_each("add", [{"a": 1, "b": 1}])
+
+
+def test_group_error(servers: List[StandInServer], transport: str) -> None:
+    servers[2].methods["add"] = _raise_error
+    ports = [server.port for server in servers]
+    with UnityCommsGroup.from_ports(ports, transport=transport) as group:
+        with pytest.raises(UnityCommsGroupError) as exc_info:
+            group.add(a=1, b=2)
+        assert exc_info.value.results == [3, 3, None, 3]
+        assert [type(error) for error in exc_info.value.errors] == [
+            type(None),
+            type(None),
+            CSException,
+            type(None),
+        ]
+        assert "1 of 4 servers" in str(exc_info.value)
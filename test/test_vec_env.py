@@ -0,0 +1,132 @@
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Tuple
+
+import gym.spaces
+import numpy as np
+import pytest
+
+from peaceful_pie.testing import StandInEnv, StandInServer
+from peaceful_pie.unity_comms import UnityComms
+
+pytest.importorskip("stable_baselines3")
+
+from peaceful_pie.vec_env import (  # noqa: E402
+    MultiArenaVecEnv,
+    PipelinedVecEnv,
+    SharedMemoryVecEnv,
+)
+
+
+def test_matches_subproc_vec_env() -> None:
+    from stable_baselines3.common.vec_env import SubprocVecEnv
+
+    env_fns = [lambda: StandInEnv(obs_size=4, episode_length=3) for _ in range(3)]
+    actions = np.ones((3, 2), dtype=np.int64)
+    shm_env = SharedMemoryVecEnv(env_fns, start_method="fork")
+    subproc_env = SubprocVecEnv(env_fns, start_method="fork")
+    try:
+        assert (shm_env.reset() == subproc_env.reset()).all()
+        for _ in range(4):
+            shm_obs, shm_rewards, shm_dones, shm_infos = shm_env.step(actions)
+            obs, rewards, dones, infos = subproc_env.step(actions)
+            assert (shm_obs == obs).all()
+            assert (shm_rewards == rewards).all()
+            assert (shm_dones == dones).all()
+            assert [info["num_steps"] for info in shm_infos] == [
+                info["num_steps"] for info in infos
+            ]
+        assert shm_env.get_attr("episode_length", indices=0) == [3]
+        assert shm_env.env_method("seed", 3) == [[3]] * 3
+    finally:
+        shm_env.close()
+        subproc_env.close()
+
+
+def test_pipelined_matches_dummy_vec_env() -> None:
+    from stable_baselines3.common.vec_env import DummyVecEnv
+
+    env_fns = [lambda: StandInEnv(obs_size=4, episode_length=3) for _ in range(3)]
+    actions = np.ones((3, 2), dtype=np.int64)
+    pipelined_env = PipelinedVecEnv(env_fns)
+    dummy_env = DummyVecEnv(env_fns)
+    assert (pipelined_env.reset() == dummy_env.reset()).all()
+    for _ in range(4):
+        (
+            pipelined_obs,
+            pipelined_rewards,
+            pipelined_dones,
+            pipelined_infos,
+        ) = pipelined_env.step(actions)
+        obs, rewards, dones, infos = dummy_env.step(actions)
+        assert (pipelined_obs == obs).all()
+        assert (pipelined_rewards == rewards).all()
+        assert (pipelined_dones == dones).all()
+        assert [info["num_steps"] for info in pipelined_infos] == [
+            info["num_steps"] for info in infos
+        ]
+
+
+@dataclass
+class ArenaResult:
+    reward: float
+    episodeFinished: bool
+    stepCount: int
+
+
+class StandInArenas:
+    def __init__(self, episode_lengths: List[int]) -> None:
+        self.episode_lengths = episode_lengths
+        self.step_counts = [0] * len(episode_lengths)
+        self.num_step_calls = 0
+
+    def result(self, arena_idx: int) -> Dict[str, Any]:
+        step_count = self.step_counts[arena_idx]
+        return {
+            "reward": float(step_count),
+            "episodeFinished": step_count >= self.episode_lengths[arena_idx],
+            "stepCount": step_count,
+        }
+
+    def rl_step_batch(self, actions: List[int]) -> List[Dict[str, Any]]:
+        self.num_step_calls += 1
+        for arena_idx, action in enumerate(actions):
+            self.step_counts[arena_idx] += action
+        return [self.result(arena_idx) for arena_idx in range(len(actions))]
+
+    def reset_arenas(self, arenaIndices: List[int]) -> List[Dict[str, Any]]:
+        for arena_idx in arenaIndices:
+            self.step_counts[arena_idx] = 0
+        return [self.result(arena_idx) for arena_idx in arenaIndices]
+
+
+class CountingVecEnv(MultiArenaVecEnv):
+    def arena_actions(self, actions: np.ndarray) -> Any:
+        return int(actions)
+
+    def decode_result(
+        self, arena_idx: int, result: ArenaResult
+    ) -> Tuple[np.ndarray, float, bool, Dict[str, Any]]:
+        obs = np.array([arena_idx, result.stepCount], dtype=np.float32)
+        return obs, result.reward, result.episodeFinished, {}
+
+
+def test_multi_arena_vec_env() -> None:
+    arenas = StandInArenas(episode_lengths=[2, 3])
+    methods: Dict[str, Callable[..., Any]] = {
+        "getNumArenas": lambda: 2,
+        "rlStepBatch": arenas.rl_step_batch,
+        "resetArenas": arenas.reset_arenas,
+    }
+    with StandInServer(methods=methods) as server:
+        comms = UnityComms(port=server.port)
+        vec_env = CountingVecEnv(comms, ArenaResult, gym.spaces.Discrete(2))
+        assert vec_env.num_envs == 2
+        assert vec_env.reset().tolist() == [[0, 0], [1, 0]]
+        obs, rewards, dones, infos = vec_env.step(np.array([1, 1]))
+        assert obs.tolist() == [[0, 1], [1, 1]]
+        obs, rewards, dones, infos = vec_env.step(np.array([1, 1]))
+        assert rewards.tolist() == [2, 2]
+        assert dones.tolist() == [True, False]
+        assert infos[0]["terminal_observation"].tolist() == [0, 2]
+        assert obs.tolist() == [[0, 0], [1, 2]]
+        assert arenas.num_step_calls == 2